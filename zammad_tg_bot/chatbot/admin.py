@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import TelegramBot, ZammadGroup, Customer, OpenTicket, Question, QuestionTranslation
+from .models import TelegramBot, ZammadGroup, Customer, OpenTicket, Question, QuestionTranslation, PendingUpdate, ProcessedUpdate, ZammadCustomerUser, PendingZammadWrite, ZammadInstance, ConversationState, TicketCreation
+from . import update_queue, zammad_outbox
 
 
 @admin.register(TelegramBot)
@@ -64,3 +65,67 @@ class OpenTicketAdmin(admin.ModelAdmin):
     list_filter = ('bot', 'priority', 'created_at')
     search_fields = ('telegram_id', 'zammad_ticket_number')
     readonly_fields = ('created_at',)
+
+
+@admin.register(PendingUpdate)
+class PendingUpdateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'bot', 'status', 'attempts', 'next_attempt_at', 'received_at', 'finished_at')
+    list_filter = ('bot', 'status')
+    readonly_fields = ('received_at', 'started_at', 'finished_at')
+    actions = ['retry_updates']
+
+    @admin.action(description='Retry selected failed updates')
+    def retry_updates(self, request, queryset):
+        retried = update_queue.retry_failed_updates(queryset)
+        self.message_user(request, f"{retried} updates returned to the queue")
+
+
+@admin.register(ProcessedUpdate)
+class ProcessedUpdateAdmin(admin.ModelAdmin):
+    list_display = ('update_id', 'bot', 'first_seen_at', 'duplicate_count')
+    list_filter = ('bot',)
+    search_fields = ('update_id',)
+    readonly_fields = ('first_seen_at',)
+
+
+@admin.register(ZammadCustomerUser)
+class ZammadCustomerUserAdmin(admin.ModelAdmin):
+    list_display = ('email', 'zammad_user_id', 'resolved_at')
+    search_fields = ('email',)
+    readonly_fields = ('resolved_at',)
+
+
+@admin.register(PendingZammadWrite)
+class PendingZammadWriteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'action', 'zammad_ticket_id', 'bot', 'status', 'attempts', 'next_attempt_at', 'created_at')
+    list_filter = ('status', 'action', 'bot')
+    search_fields = ('zammad_ticket_id', 'user_name')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    actions = ['retry_writes']
+
+    @admin.action(description='Retry selected dead letters')
+    def retry_writes(self, request, queryset):
+        retried = zammad_outbox.retry_dead_writes(queryset)
+        self.message_user(request, f"{retried} writes returned to the outbox")
+
+
+@admin.register(ZammadInstance)
+class ZammadInstanceAdmin(admin.ModelAdmin):
+    list_display = ('zammad_url', 'attachment_url_scheme', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(ConversationState)
+class ConversationStateAdmin(admin.ModelAdmin):
+    list_display = ('telegram_id', 'bot', 'step', 'version', 'expires_at', 'updated_at')
+    list_filter = ('step', 'bot')
+    search_fields = ('telegram_id',)
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(TicketCreation)
+class TicketCreationAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'bot', 'telegram_id', 'status', 'attempts', 'zammad_ticket_number', 'created_at')
+    list_filter = ('status', 'bot')
+    search_fields = ('idempotency_key', 'telegram_id', 'zammad_ticket_number')
+    readonly_fields = ('created_at', 'started_at', 'uncertain_since')
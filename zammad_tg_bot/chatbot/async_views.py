@@ -0,0 +1,318 @@
+"""Async versions of the Telegram and Zammad webhooks for ASGI deployments (settings.ASYNC_WEBHOOKS)."""
+import asyncio
+import json
+import time
+from contextlib import closing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone, translation
+from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
+import telegram
+
+from . import zammad_async_api, zammad_outbox, update_queue
+from .attachment_pipeline import (
+    finish_attachment_sends, get_agent_attachment_caption, get_filename, get_oversize_reason, get_sendable_attachments,
+    get_skipped_attachment_text, iter_prefetched, plan_attachment_sends,
+)
+from .bot_registry import bot_registry
+from .dedup import update_deduplicator
+from .models import OpenTicket
+from .telegram_async_api import AsyncTelegramClient
+from .ticket_updates import (
+    enqueue_ticket_update, get_photo_attachment, get_progress_text, get_result_text, get_update_kind,
+)
+from .zammad_circuit import zammad_breaker
+from .views import (
+    process_telegram_update, is_ticket_state_fresh, ZAMMAD_OPEN_STATES,
+    WebhookHandler, AgentResponseHandler, TelegramMessageHandler,
+    webhook_latency_histogram, attachment_lists_counter,
+)
+
+
+def _run_in_thread(func):
+    """Run blocking code in a worker thread so other requests keep being served"""
+    def call_and_release_connection(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call_and_release_connection, thread_sensitive=False)
+
+
+def activate_entry_language(bot_entry):
+    """activate_bot_language() for a registry entry that is already loaded (no registry lookup)"""
+    translation.activate(getattr(bot_entry.config, 'preferable_language', 'ky'))
+
+
+async def ais_ticket_open(ticket_in_db):
+    """Async version of views.is_ticket_open()"""
+    if not is_ticket_state_fresh(ticket_in_db):
+        ticket_details = await zammad_async_api.get_ticket_details(ticket_in_db.zammad_ticket_id)
+
+        if ticket_details is None:
+            return not ticket_in_db.zammad_state or ticket_in_db.zammad_state in ZAMMAD_OPEN_STATES
+
+        ticket_in_db.zammad_state = ticket_details.get('state', 'unknown').lower()
+        ticket_in_db.state_synced_at = timezone.now()
+        await ticket_in_db.asave(update_fields=['zammad_state', 'state_synced_at'])
+
+    return ticket_in_db.zammad_state in ZAMMAD_OPEN_STATES
+
+
+async def ahandle_open_ticket_update(bot_record, message):
+    """Async version of views._handle_open_ticket_update() for notes and photos.
+
+    Returns False when the message is something else (commands, wizard
+    steps, no open ticket) and has to go through the sync handlers.
+    """
+    text = message.get('text')
+    photos = message.get('photo')
+    kind = get_update_kind(text, bool(photos))
+    if kind is None:
+        return False
+    if not zammad_outbox.is_enabled() and zammad_breaker.is_open():
+        # The sync path tells the user that Zammad is down
+        return False
+
+    user = message.get('from') or {}
+    open_ticket = await OpenTicket.objects.filter(telegram_id=user.get('id'), bot=bot_record).afirst()
+    if open_ticket is None:
+        return False
+    if not await ais_ticket_open(open_ticket):
+        print(f"Stale ticket #{open_ticket.zammad_ticket_number} found. Cleaning up local DB.")
+        await open_ticket.adelete()
+        return False
+
+    chat_id = message['chat']['id']
+    user_name = user.get('first_name')
+    client = AsyncTelegramClient(bot_record.token)
+    photo_file_id = photos[-1]['file_id'] if kind == 'photo' else None
+    if zammad_outbox.is_enabled():
+        success, acknowledge = await sync_to_async(enqueue_ticket_update)(
+            bot_record, open_ticket.zammad_ticket_id, user_name, kind, text, photo_file_id, message.get('caption')
+        )
+    else:
+        acknowledge = True
+        await client.send_message(chat_id=chat_id, text=get_progress_text(kind))
+        if kind == 'note':
+            success = await zammad_async_api.add_note_to_ticket(open_ticket.zammad_ticket_id, user_name, text)
+        else:
+            filename, caption = get_photo_attachment(photo_file_id, message.get('caption'))
+            # Streamed from Telegram into the Zammad request, never held in memory as a whole
+            success = await zammad_async_api.add_attachment_stream_to_ticket(
+                open_ticket.zammad_ticket_id, user_name, await client.iter_file(photo_file_id), filename, caption
+            )
+
+    reply = get_result_text(success, acknowledge)
+    if reply:
+        await client.send_message(chat_id=chat_id, text=reply)
+    return True
+
+
+class AsyncTelegramMessageHandler(TelegramMessageHandler):
+    """Sends agent messages and attachments to Telegram without blocking the event loop"""
+
+    def __init__(self, bot_token):
+        self.bot = AsyncTelegramClient(bot_token)
+
+    async def send_agent_text_message(self, telegram_chat_id, message_text):
+        """Send agent text message to Telegram"""
+        if not message_text:
+            return
+
+        await self.bot.send_message(
+            chat_id=telegram_chat_id,
+            text=_("💬 **Support Agent Response:**\n\n{message_text}").format(message_text=message_text),
+            parse_mode=telegram.ParseMode.MARKDOWN
+        )
+
+    async def send_attachment_to_telegram(self, telegram_chat_id, file_content, filename, mime_type):
+        """Send a single attachment to Telegram"""
+        caption = get_agent_attachment_caption(filename)
+        try:
+            if mime_type.startswith('image/'):
+                await self.bot.send_photo(chat_id=telegram_chat_id, photo=file_content, caption=caption)
+            else:
+                await self.bot.send_document(
+                    chat_id=telegram_chat_id, document=file_content, filename=filename, caption=caption
+                )
+        except Exception as send_error:
+            print(f"Error sending attachment {filename} to Telegram: {send_error}")
+            # Fallback: send as document if photo fails
+            try:
+                await self.bot.send_document(
+                    chat_id=telegram_chat_id, document=file_content, filename=filename, caption=caption
+                )
+            except Exception as fallback_error:
+                print(f"Fallback also failed for {filename}: {fallback_error}")
+
+    async def send_photo_group(self, telegram_chat_id, photos):
+        """Send downloaded images as one media group, `photos` is a list of (filename, content)"""
+        try:
+            await self.bot.send_media_group(telegram_chat_id, [
+                (filename, file_content, get_agent_attachment_caption(filename)) for filename, file_content in photos
+            ])
+        except Exception as group_error:
+            print(f"Error sending media group to Telegram: {group_error}")
+            for filename, file_content in photos:
+                await self.send_attachment_to_telegram(telegram_chat_id, file_content, filename, 'image/')
+
+    async def send_skipped_attachment_notice(self, telegram_chat_id, filename):
+        """Tell the user about an agent attachment that could not be forwarded"""
+        try:
+            await self.bot.send_message(chat_id=telegram_chat_id, text=get_skipped_attachment_text(filename))
+        except Exception as e:
+            print(f"Error sending skipped attachment notice for {filename}: {e}")
+
+    async def send_planned(self, telegram_chat_id, sends):
+        """Carry out sends from plan_attachment_sends()"""
+        for kind, value in sends:
+            if kind == 'album':
+                await self.send_photo_group(telegram_chat_id, value)
+            elif kind == 'file':
+                filename, file_content, mime_type = value
+                await self.send_attachment_to_telegram(telegram_chat_id, file_content, filename, mime_type)
+            else:
+                await self.send_skipped_attachment_notice(telegram_chat_id, value)
+
+    async def download_article_attachment(self, article_id, attachment):
+        """Download one attachment (None if missing or bigger than ATTACHMENT_MAX_BYTES)"""
+        filename = get_filename(attachment)
+        max_bytes = settings.ATTACHMENT_MAX_BYTES
+        oversize_reason = get_oversize_reason(attachment, max_bytes)
+        if oversize_reason:
+            print(f"Skipping attachment {filename}: {oversize_reason}")
+            return None
+        try:
+            return await zammad_async_api.download_attachment(article_id, attachment.get('id'), max_bytes)
+        except (zammad_async_api.AttachmentTooLargeError, zammad_async_api.ZammadRateLimitedError, zammad_async_api.ZammadUnavailableError) as e:
+            print(f"Skipping attachment {filename}: {e}")
+            return None
+
+    async def send_article_attachments_to_telegram(self, article_id, telegram_chat_id, attachments=None):
+        """Download and send attachments from Zammad article to Telegram.
+
+        Same pipeline as the sync handler (see attachment_pipeline), with the
+        downloads running as tasks on the event loop.
+        """
+        try:
+            if attachments is None:
+                attachment_lists_counter.inc(source='api')
+                attachments = await zammad_async_api.get_article_attachments(article_id)
+            else:
+                attachment_lists_counter.inc(source='payload')
+            attachments = get_sendable_attachments(attachments)
+
+            def start_download(attachment):
+                return asyncio.ensure_future(self.download_article_attachment(article_id, attachment))
+
+            workers = max(1, settings.ATTACHMENT_DOWNLOAD_WORKERS)
+            photos = []
+            with closing(iter_prefetched(attachments, start_download, workers)) as downloads:
+                for attachment, download in downloads:
+                    sends, photos = plan_attachment_sends(photos, attachment, await download)
+                    await self.send_planned(telegram_chat_id, sends)
+
+            await self.send_planned(telegram_chat_id, finish_attachment_sends(photos))
+
+        except Exception as e:
+            print(f"Error processing attachments for article {article_id}: {e}")
+
+
+class AsyncAgentResponseHandler(AgentResponseHandler):
+    """Async version of AgentResponseHandler"""
+
+    async def handle_agent_response(self, ticket_id, article_info):
+        """Send agent response from Zammad to Telegram user"""
+        try:
+            open_ticket = await OpenTicket.objects.aget(zammad_ticket_id=ticket_id)
+            bot_entry = await bot_registry.aget_by_id(open_ticket.bot_id)
+
+            activate_entry_language(bot_entry)
+
+            telegram_handler = AsyncTelegramMessageHandler(bot_entry.record.token)
+
+            clean_text = telegram_handler.clean_html_text(article_info.get('body', ''))
+            await telegram_handler.send_agent_text_message(open_ticket.telegram_id, clean_text)
+
+            article_id = article_info.get('id')
+            if article_id:
+                await telegram_handler.send_article_attachments_to_telegram(
+                    article_id, open_ticket.telegram_id, article_info.get('attachments')
+                )
+
+        except OpenTicket.DoesNotExist:
+            pass
+        except Exception as e:
+            print(f"Error sending agent response to Telegram: {e}")
+
+
+class AsyncWebhookHandler(WebhookHandler):
+    """Async version of WebhookHandler; payload parsing is shared with the sync one"""
+
+    def __init__(self):
+        self.agent_handler = AsyncAgentResponseHandler()
+
+    async def process_agent_article(self, ticket_id, article_info):
+        """Process new article from agent if it meets criteria"""
+        if self.is_agent_article(article_info):
+            await self.agent_handler.handle_agent_response(ticket_id, article_info)
+
+    async def update_ticket_state(self, ticket_id, ticket_state):
+        """Store the state Zammad sent so incoming messages don't have to fetch it"""
+        if ticket_id and ticket_state:
+            await OpenTicket.objects.filter(zammad_ticket_id=ticket_id).aupdate(
+                zammad_state=str(ticket_state).lower(), state_synced_at=timezone.now()
+            )
+
+    async def process_ticket_closure(self, ticket_id, ticket_state):
+        """Handle ticket closure notification"""
+        if not (ticket_id and ticket_state == 'closed'):
+            return
+
+        try:
+            ticket_to_close = await OpenTicket.objects.aget(zammad_ticket_id=ticket_id)
+            bot_entry = await bot_registry.aget_by_id(ticket_to_close.bot_id)
+
+            activate_entry_language(bot_entry)
+
+            await AsyncTelegramClient(bot_entry.record.token).send_message(
+                chat_id=ticket_to_close.telegram_id,
+                text=_("✅ Your ticket has been resolved and closed by our support team.")
+            )
+            await ticket_to_close.adelete()
+        except OpenTicket.DoesNotExist:
+            pass
+
+
+@csrf_exempt
+async def zammad_webhook(request):
+    """Async webhook handler for Zammad notifications"""
+    if request.method != "POST":
+        return HttpResponse("ok")
+
+    started = time.monotonic()
+    try:
+        webhook_handler = AsyncWebhookHandler()
+
+        payload = webhook_handler.parse_payload(request)
+        ticket_info, article_info = webhook_handler.extract_ticket_and_article_info(payload)
+
+        ticket_id = ticket_info.get('id')
+        ticket_state = ticket_info.get('state')
+
+        await webhook_handler.update_ticket_state(ticket_id, ticket_state)
+        await webhook_handler.process_agent_article(ticket_id, article_info)
+        await webhook_handler.process_ticket_closure(ticket_id, ticket_state)
+
+    except Exception as e:
+        print(f"Error processing Zammad webhook: {e}")
+    finally:
+        webhook_latency_histogram.observe(time.monotonic() - started)
+
+    return HttpResponse("ok")
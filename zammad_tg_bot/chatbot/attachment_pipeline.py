@@ -0,0 +1,106 @@
+"""How agent attachments go to Telegram, shared by the sync and async webhook handlers.
+
+The handlers only download and send. Which attachments are skipped, how
+many downloads run ahead of the upload and which files go out together
+as a media group is decided here, so both handlers behave the same.
+"""
+from collections import deque
+from itertools import islice
+
+from django.utils.translation import gettext as _
+
+
+# Telegram albums hold at most 10 photos
+MEDIA_GROUP_LIMIT = 10
+
+
+def get_sendable_attachments(attachments):
+    """The attachments of an article that can be downloaded (they have an id)"""
+    return [attachment for attachment in attachments or [] if attachment.get('id')]
+
+
+def get_filename(attachment):
+    return attachment.get('filename', 'attachment')
+
+
+def get_mime_type(attachment):
+    return attachment.get('preferences', {}).get('Mime-Type', '')
+
+
+def get_oversize_reason(attachment, max_bytes):
+    """Why the attachment is skipped without downloading it (declared size over `max_bytes`), or None"""
+    try:
+        declared_size = int(attachment.get('size') or 0)
+    except (TypeError, ValueError):
+        declared_size = 0
+    if max_bytes and declared_size > max_bytes:
+        return f"{declared_size} bytes is over the limit of {max_bytes}"
+    return None
+
+
+def iter_prefetched(items, start, window):
+    """Yield (item, start(item)) in order, with up to `window` items started ahead of the one yielded.
+
+    `start` begins a download and returns its future (a thread pool or an
+    asyncio future). Futures not handed out yet are cancelled when the
+    iteration is closed early.
+    """
+    not_started = iter(items)
+    started = deque((item, start(item)) for item in islice(not_started, window))
+    try:
+        while started:
+            item, future = started.popleft()
+            # Keep the window full: at most `window` files are downloaded but not sent
+            next_item = next(not_started, None)
+            if next_item is not None:
+                started.append((next_item, start(next_item)))
+            yield item, future
+    finally:
+        for _item, future in started:
+            future.cancel()
+
+
+def get_photo_group_send(photos):
+    """The send for collected images: one photo on its own, several as an album"""
+    if len(photos) == 1:
+        filename, file_content = photos[0]
+        return 'file', (filename, file_content, 'image/')
+    return 'album', photos
+
+
+def plan_attachment_sends(photos, attachment, file_content):
+    """The sends due once `attachment` is downloaded, and the images still collected for an album.
+
+    Consecutive images are collected into albums of up to MEDIA_GROUP_LIMIT;
+    anything else sends the collected images first, so the article order is
+    kept. Sends are ('album', [(filename, content)...]), ('file', (filename,
+    content, mime_type)) or ('skipped', filename) for an attachment that
+    couldn't be downloaded (too large, failed, rate limit or open breaker).
+    """
+    filename = get_filename(attachment)
+    mime_type = get_mime_type(attachment)
+    if file_content and mime_type.startswith('image/'):
+        photos = [*photos, (filename, file_content)]
+        if len(photos) == MEDIA_GROUP_LIMIT:
+            return [get_photo_group_send(photos)], []
+        return [], photos
+
+    sends = [get_photo_group_send(photos)] if photos else []
+    if file_content:
+        sends.append(('file', (filename, file_content, mime_type)))
+    else:
+        sends.append(('skipped', filename))
+    return sends, []
+
+
+def finish_attachment_sends(photos):
+    """The sends left after the last attachment"""
+    return [get_photo_group_send(photos)] if photos else []
+
+
+def get_agent_attachment_caption(filename):
+    return _("📎 Agent sent: {filename}").format(filename=filename)
+
+
+def get_skipped_attachment_text(filename):
+    return _("⚠️ Attachment too large or unavailable: {filename}").format(filename=filename)
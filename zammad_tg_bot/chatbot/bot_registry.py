@@ -0,0 +1,107 @@
+import threading
+import time
+
+from django.conf import settings
+from telegram.utils.request import Request
+
+from .models import TelegramBot
+from .telegram_sender import RateLimitedBot
+
+
+class BotEntry:
+    """Cached TelegramBot row, its ZammadGroup config and a long-lived telegram.Bot"""
+
+    def __init__(self, record, config, bot):
+        self.record = record
+        self.config = config
+        self.bot = bot
+        self.loaded_at = time.monotonic()
+
+
+class BotRegistry:
+    """In-process, token-keyed cache of bot configuration.
+
+    Entries are dropped by the post_save/post_delete signals in chatbot.signals
+    when a bot or its ZammadGroup is edited. The TTL bounds how long another
+    process (which does not see those signals) can serve a stale entry.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else settings.BOT_REGISTRY_TTL
+        self._by_token = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, entry):
+        return entry is not None and (not self.ttl or time.monotonic() - entry.loaded_at < self.ttl)
+
+    def _store(self, record):
+        """Build and cache the entry for a TelegramBot loaded with select_related('zammad_config')"""
+        # Missing reverse one-to-one raises RelatedObjectDoesNotExist (an AttributeError)
+        config = getattr(record, 'zammad_config', None)
+        request = Request(con_pool_size=settings.TELEGRAM_CON_POOL_SIZE)
+        bot = RateLimitedBot(
+            token=record.token,
+            base_url=f"{settings.TELEGRAM_API_URL}/bot",
+            base_file_url=f"{settings.TELEGRAM_API_URL}/file/bot",
+            request=request,
+        )
+        entry = BotEntry(record, config, bot)
+
+        with self._lock:
+            self._by_token[record.token] = entry
+            self._by_id[record.id] = entry
+        return entry
+
+    def _load(self, **lookup):
+        """Load a bot with its ZammadGroup in a single query"""
+        record = TelegramBot.objects.select_related('zammad_config').filter(**lookup).first()
+        return self._store(record) if record else None
+
+    async def _aload(self, **lookup):
+        record = await TelegramBot.objects.select_related('zammad_config').filter(**lookup).afirst()
+        return self._store(record) if record else None
+
+    def get(self, token):
+        """Return the BotEntry for a token, or None if the token is unknown"""
+        entry = self._by_token.get(token)
+        if self._is_fresh(entry):
+            return entry
+        return self._load(token=token)
+
+    def get_by_id(self, bot_id):
+        """Return the BotEntry for a TelegramBot primary key, or None"""
+        entry = self._by_id.get(bot_id)
+        if self._is_fresh(entry):
+            return entry
+        return self._load(id=bot_id)
+
+    async def aget(self, token):
+        """Async version of get() for ASGI views"""
+        entry = self._by_token.get(token)
+        if self._is_fresh(entry):
+            return entry
+        return await self._aload(token=token)
+
+    async def aget_by_id(self, bot_id):
+        """Async version of get_by_id() for ASGI views"""
+        entry = self._by_id.get(bot_id)
+        if self._is_fresh(entry):
+            return entry
+        return await self._aload(id=bot_id)
+
+    def invalidate(self, bot_id):
+        """Forget the cached entry of a bot"""
+        with self._lock:
+            entry = self._by_id.pop(bot_id, None)
+            if entry is not None:
+                self._by_token.pop(entry.record.token, None)
+
+    def clear(self):
+        """Forget all cached entries"""
+        with self._lock:
+            self._by_token.clear()
+            self._by_id.clear()
+
+
+bot_registry = BotRegistry()
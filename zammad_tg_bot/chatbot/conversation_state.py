@@ -0,0 +1,254 @@
+"""Ticket wizard state shared by all worker processes.
+
+A user's wizard (customer number -> issue type -> questions) is one row per
+(telegram user, bot). Every step changes it with a compare-and-set on its
+version, so when two workers handle messages of the same user at once only
+one of them moves the wizard on and the other sees a conflict instead of
+overwriting the answer. Rows expire after their TTL.
+
+CONVERSATION_STATE_BACKEND selects where the rows live:
+  database  the Django database (shared by every process and node using it)
+  sqlite    a local SQLite file (single node, or tests without the database)
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import registry
+from .models import ConversationState
+
+
+state_latency_histogram = registry.histogram(
+    'conversation_state_seconds', 'Latency of wizard state operations by operation'
+)
+state_conflicts_counter = registry.counter(
+    'conversation_state_conflicts_total', 'Wizard steps refused because another worker changed the state first'
+)
+
+
+class BaseConversationStore:
+    """Interface of the state backends.
+
+    States are dicts of the wizard data plus 'step' and 'version'.
+    """
+
+    def __init__(self, purge_every=200):
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id, bot_id):
+        """Current state, or None if there is none or it expired"""
+        started = time.perf_counter()
+        try:
+            return self._get(telegram_id, bot_id)
+        finally:
+            state_latency_histogram.observe(time.perf_counter() - started, operation='get')
+
+    def start(self, telegram_id, bot_id, step, data, ttl):
+        """Begin a new wizard, replacing any previous state; returns its version"""
+        started = time.perf_counter()
+        try:
+            version = self._start(telegram_id, bot_id, step, data, ttl)
+        finally:
+            state_latency_histogram.observe(time.perf_counter() - started, operation='start')
+        self._maybe_purge()
+        return version
+
+    def advance(self, telegram_id, bot_id, version, step, data, ttl):
+        """Move the state at `version` to the next step; False if it changed in the meantime"""
+        started = time.perf_counter()
+        try:
+            advanced = self._advance(telegram_id, bot_id, version, step, data, ttl)
+        finally:
+            state_latency_histogram.observe(time.perf_counter() - started, operation='advance')
+        if not advanced:
+            state_conflicts_counter.inc(operation='advance')
+        return advanced
+
+    def finish(self, telegram_id, bot_id, version=None):
+        """Delete the state (only at `version` if given); False if it was gone or changed"""
+        started = time.perf_counter()
+        try:
+            finished = self._finish(telegram_id, bot_id, version)
+        finally:
+            state_latency_histogram.observe(time.perf_counter() - started, operation='finish')
+        if not finished and version is not None:
+            state_conflicts_counter.inc(operation='finish')
+        return finished
+
+    def _maybe_purge(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.purge_every == 0
+        if due:
+            self.purge_expired()
+
+    @staticmethod
+    def make_state(step, data, version):
+        return {**data, 'step': step, 'version': version}
+
+    @staticmethod
+    def split_state(data):
+        """Wizard data without the bookkeeping keys"""
+        return {key: value for key, value in data.items() if key not in ('step', 'version')}
+
+
+class DatabaseConversationStore(BaseConversationStore):
+    """States in the ConversationState table"""
+
+    def _rows(self, telegram_id, bot_id):
+        return ConversationState.objects.filter(telegram_id=telegram_id, bot_id=bot_id)
+
+    def _get(self, telegram_id, bot_id):
+        row = self._rows(telegram_id, bot_id).filter(expires_at__gt=timezone.now()).first()
+        if row is None:
+            return None
+        return self.make_state(row.step, row.data, row.version)
+
+    def _start(self, telegram_id, bot_id, step, data, ttl):
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        values = {'step': step, 'data': self.split_state(data), 'expires_at': expires_at}
+        # The version keeps growing across wizards, so a stale step of the old one can't match
+        while True:
+            current = self._rows(telegram_id, bot_id).values_list('version', flat=True).first()
+            if current is None:
+                try:
+                    with transaction.atomic():
+                        ConversationState.objects.create(telegram_id=telegram_id, bot_id=bot_id, version=1, **values)
+                    return 1
+                except IntegrityError:
+                    continue  # another worker created it first
+            if self._rows(telegram_id, bot_id).filter(version=current).update(version=current + 1, **values):
+                return current + 1
+
+    def _advance(self, telegram_id, bot_id, version, step, data, ttl):
+        return bool(
+            self._rows(telegram_id, bot_id).filter(version=version, expires_at__gt=timezone.now()).update(
+                step=step,
+                data=self.split_state(data),
+                version=F('version') + 1,
+                expires_at=timezone.now() + timedelta(seconds=ttl),
+            )
+        )
+
+    def _finish(self, telegram_id, bot_id, version):
+        rows = self._rows(telegram_id, bot_id)
+        if version is not None:
+            rows = rows.filter(version=version, expires_at__gt=timezone.now())
+        deleted, _ = rows.delete()
+        return bool(deleted)
+
+    def purge_expired(self):
+        ConversationState.objects.filter(expires_at__lte=timezone.now()).delete()
+
+
+class SQLiteConversationStore(BaseConversationStore):
+    """States in a local SQLite file, shared by the processes of one node"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_state ("
+                " telegram_id INTEGER NOT NULL, bot_id INTEGER NOT NULL, step TEXT NOT NULL,"
+                " data TEXT NOT NULL, version INTEGER NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (telegram_id, bot_id))"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get(self, telegram_id, bot_id):
+        row = self._connection().execute(
+            "SELECT step, data, version FROM conversation_state"
+            " WHERE telegram_id = ? AND bot_id = ? AND expires_at > ?",
+            (telegram_id, bot_id, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return self.make_state(row[0], json.loads(row[1]), row[2])
+
+    def _start(self, telegram_id, bot_id, step, data, ttl):
+        with self._connection() as connection:
+            return connection.execute(
+                "INSERT INTO conversation_state (telegram_id, bot_id, step, data, version, expires_at)"
+                " VALUES (?, ?, ?, ?, 1, ?)"
+                " ON CONFLICT (telegram_id, bot_id) DO UPDATE SET step = excluded.step, data = excluded.data,"
+                " version = conversation_state.version + 1, expires_at = excluded.expires_at"
+                " RETURNING version",
+                (telegram_id, bot_id, step, json.dumps(self.split_state(data)), time.time() + ttl),
+            ).fetchone()[0]
+
+    def _advance(self, telegram_id, bot_id, version, step, data, ttl):
+        now = time.time()
+        with self._connection() as connection:
+            return connection.execute(
+                "UPDATE conversation_state SET step = ?, data = ?, version = version + 1, expires_at = ?"
+                " WHERE telegram_id = ? AND bot_id = ? AND version = ? AND expires_at > ?",
+                (step, json.dumps(self.split_state(data)), now + ttl, telegram_id, bot_id, version, now),
+            ).rowcount == 1
+
+    def _finish(self, telegram_id, bot_id, version):
+        with self._connection() as connection:
+            if version is None:
+                cursor = connection.execute(
+                    "DELETE FROM conversation_state WHERE telegram_id = ? AND bot_id = ?",
+                    (telegram_id, bot_id),
+                )
+            else:
+                cursor = connection.execute(
+                    "DELETE FROM conversation_state"
+                    " WHERE telegram_id = ? AND bot_id = ? AND version = ? AND expires_at > ?",
+                    (telegram_id, bot_id, version, time.time()),
+                )
+            return cursor.rowcount == 1
+
+    def purge_expired(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),))
+
+
+def create_conversation_store():
+    backend = settings.CONVERSATION_STATE_BACKEND
+    if backend == 'sqlite':
+        path = settings.CONVERSATION_STATE_FILE or os.path.join(tempfile.gettempdir(), 'zammad_tg_bot_state.sqlite3')
+        return SQLiteConversationStore(path)
+    if backend == 'database':
+        return DatabaseConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STATE_BACKEND: {backend}")
+
+
+class LazyConversationStore:
+    """Creates the configured store on first use (the SQLite file is not touched at import time)"""
+
+    def __init__(self):
+        self._store = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = create_conversation_store()
+        return getattr(self._store, name)
+
+
+conversation_states = LazyConversationStore()
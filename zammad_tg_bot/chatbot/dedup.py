@@ -0,0 +1,117 @@
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .metrics import registry
+from .models import ProcessedUpdate
+
+
+duplicates_counter = registry.counter(
+    'telegram_duplicate_updates_total', 'Redelivered Telegram updates dropped by the deduplicator'
+)
+
+
+class UpdateDeduplicator:
+    """Remembers accepted update_ids per bot in the database.
+
+    The unique (bot, update_id) constraint makes the check atomic across
+    worker processes. Rows older than the TTL are treated as unseen and pruned,
+    and each bot keeps at most `max_entries` rows.
+    """
+
+    def __init__(self, ttl=None, max_entries=None, prune_every=200):
+        self.ttl = ttl if ttl is not None else settings.UPDATE_DEDUP_TTL
+        self.max_entries = max_entries if max_entries is not None else settings.UPDATE_DEDUP_MAX_PER_BOT
+        self.prune_every = prune_every
+        self._inserts = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    def is_duplicate(self, bot_record, update_id):
+        """Record the update_id and return True if it was already seen within the TTL"""
+        if not self.enabled or update_id is None:
+            return False
+
+        try:
+            with transaction.atomic():
+                ProcessedUpdate.objects.create(bot=bot_record, update_id=update_id)
+        except IntegrityError:
+            now = timezone.now()
+            seen = ProcessedUpdate.objects.filter(bot=bot_record, update_id=update_id)
+            if seen.filter(first_seen_at__gte=now - timedelta(seconds=self.ttl)).update(
+                duplicate_count=F('duplicate_count') + 1
+            ):
+                duplicates_counter.inc(bot=bot_record.name)
+                return True
+            # Expired entry: accept the update again and restart its window
+            seen.update(first_seen_at=now, duplicate_count=0)
+
+        if self._is_prune_due():
+            self.prune(bot_record)
+        return False
+
+    async def ais_duplicate(self, bot_record, update_id):
+        """Async version of is_duplicate() for ASGI views"""
+        if not self.enabled or update_id is None:
+            return False
+
+        try:
+            # A single INSERT in autocommit mode, so no atomic block is needed around it
+            await ProcessedUpdate.objects.acreate(bot=bot_record, update_id=update_id)
+        except IntegrityError:
+            now = timezone.now()
+            seen = ProcessedUpdate.objects.filter(bot=bot_record, update_id=update_id)
+            if await seen.filter(first_seen_at__gte=now - timedelta(seconds=self.ttl)).aupdate(
+                duplicate_count=F('duplicate_count') + 1
+            ):
+                duplicates_counter.inc(bot=bot_record.name)
+                return True
+            await seen.aupdate(first_seen_at=now, duplicate_count=0)
+
+        if self._is_prune_due():
+            await sync_to_async(self.prune)(bot_record)
+        return False
+
+    def forget(self, bot_record, update_id):
+        """Drop a recorded update_id so a redelivery of it is processed again"""
+        if self.enabled and update_id is not None:
+            ProcessedUpdate.objects.filter(bot=bot_record, update_id=update_id).delete()
+
+    async def aforget(self, bot_record, update_id):
+        """Async version of forget()"""
+        if self.enabled and update_id is not None:
+            await ProcessedUpdate.objects.filter(bot=bot_record, update_id=update_id).adelete()
+
+    def suppressed_count(self, bot_record=None):
+        """Duplicates dropped by all processes for updates still inside the window"""
+        rows = ProcessedUpdate.objects.all()
+        if bot_record is not None:
+            rows = rows.filter(bot=bot_record)
+        return rows.aggregate(total=Sum('duplicate_count'))['total'] or 0
+
+    def prune(self, bot_record):
+        """Delete expired rows and keep only the newest `max_entries` rows of a bot"""
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        ProcessedUpdate.objects.filter(first_seen_at__lt=cutoff).delete()
+
+        if self.max_entries:
+            newest_ids = ProcessedUpdate.objects.filter(bot=bot_record).order_by('-id').values_list('id', flat=True)
+            boundary = newest_ids[self.max_entries:self.max_entries + 1].first()
+            if boundary is not None:
+                ProcessedUpdate.objects.filter(bot=bot_record, id__lte=boundary).delete()
+
+    def _is_prune_due(self):
+        with self._lock:
+            self._inserts += 1
+            return self._inserts % self.prune_every == 0
+
+
+update_deduplicator = UpdateDeduplicator()
@@ -0,0 +1,99 @@
+import queue
+import threading
+import zlib
+
+
+_STOP = object()
+
+MESSAGE_UPDATE_TYPES = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+
+def get_update_chat_id(update_data):
+    """Extract the chat id from a raw Telegram update dict (None if it has no chat)"""
+    for update_type in MESSAGE_UPDATE_TYPES:
+        if update_type in update_data:
+            return update_data[update_type].get('chat', {}).get('id')
+
+    callback_query = update_data.get('callback_query')
+    if callback_query:
+        message = callback_query.get('message') or {}
+        chat_id = message.get('chat', {}).get('id')
+        return chat_id if chat_id is not None else callback_query.get('from', {}).get('id')
+
+    return None
+
+
+def make_shard_key(bot_id, chat_id):
+    """Stable non-negative key for a (TelegramBot.id, chat_id) pair.
+
+    The same pair always maps to the same key in every process, so it can be
+    stored with the update and used to split work between worker processes.
+    """
+    return zlib.crc32(f"{bot_id}:{chat_id}".encode()) & 0x7fffffff
+
+
+class ShardedDispatcher:
+    """Runs work items on a fixed set of threads with one FIFO queue per thread.
+
+    Items submitted with the same shard key always land on the same thread, so
+    they are handled strictly in submission order, while items with different
+    keys are handled in parallel on other threads.
+    """
+
+    def __init__(self, workers, handler, name='dispatcher'):
+        self.handler = handler
+        self._queues = [queue.Queue() for _ in range(max(1, workers))]
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, args=(shard_queue,), name=f"{name}-{index}", daemon=True)
+            for index, shard_queue in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def workers(self):
+        return len(self._queues)
+
+    def shard_for(self, shard_key):
+        """Index of the worker thread responsible for a shard key"""
+        return shard_key % len(self._queues)
+
+    def submit(self, shard_key, item):
+        """Queue an item on the worker owning its shard"""
+        with self._lock:
+            self._pending += 1
+        self._queues[self.shard_for(shard_key)].put(item)
+
+    def pending_count(self):
+        """Items submitted but not finished yet"""
+        with self._lock:
+            return self._pending
+
+    def join(self):
+        """Block until every submitted item has been handled"""
+        for shard_queue in self._queues:
+            shard_queue.join()
+
+    def shutdown(self):
+        """Finish queued items and stop the worker threads"""
+        for shard_queue in self._queues:
+            shard_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, shard_queue):
+        while True:
+            item = shard_queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(item)
+            except Exception as e:
+                print(f"Error in {threading.current_thread().name}: {e}")
+            finally:
+                if item is not _STOP:
+                    with self._lock:
+                        self._pending -= 1
+                shard_queue.task_done()
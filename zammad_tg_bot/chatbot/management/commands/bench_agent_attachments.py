@@ -0,0 +1,75 @@
+import time
+
+import telegram
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from chatbot import zammad_api
+from chatbot.management.fake_zammad import FakeZammadServer
+from chatbot.views import TelegramMessageHandler
+
+BENCH_TOKEN = '123456:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+
+
+class Command(BaseCommand):
+    help = ('Compare forwarding the attachments of an agent reply one by one (download, send, repeat) '
+            'with the pipelined sender (downloads ahead, images as one media group)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=6, help='Image attachments on the article')
+        parser.add_argument('--documents', type=int, default=2, help='Other attachments on the article')
+        parser.add_argument('--size-kb', type=int, default=512, help='Size of every attachment')
+        parser.add_argument('--latency-ms', type=float, default=100,
+                            help='Simulated latency of every Zammad and Telegram API call')
+        parser.add_argument('--workers', type=int, default=3, help='ATTACHMENT_DOWNLOAD_WORKERS for the pipeline')
+
+    def handle(self, *args, **options):
+        # Work on a throwaway test database, never on the real one
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        server = FakeZammadServer(delay=options['latency_ms'] / 1000).start()
+        size = options['size_kb'] * 1024
+        server.article_attachments = [
+            {'id': index + 1, 'filename': f'image{index + 1}.jpg', 'size': size,
+             'preferences': {'Mime-Type': 'image/jpeg'}}
+            for index in range(options['images'])
+        ] + [
+            {'id': options['images'] + index + 1, 'filename': f'document{index + 1}.pdf', 'size': size,
+             'preferences': {'Mime-Type': 'application/pdf'}}
+            for index in range(options['documents'])
+        ]
+        try:
+            with override_settings(ATTACHMENT_DOWNLOAD_WORKERS=options['workers']):
+                for manager in (zammad_api.article_manager, zammad_api.attachment_manager):
+                    manager.zammad_url = server.url
+                handler = TelegramMessageHandler(BENCH_TOKEN)
+                handler.bot = telegram.Bot(BENCH_TOKEN, base_url=f"{server.url}bot")
+                # Learn the working download URL first, so neither run pays for probing
+                zammad_api.download_attachment(1, 1)
+
+                self.stdout.write(
+                    f"{len(server.article_attachments)} attachments of {options['size_kb']} KB, "
+                    f"{options['latency_ms']:.0f}ms per Zammad/Telegram call"
+                )
+                self.stdout.write(f"{'sender':<12} {'seconds':>8} {'Telegram calls':>15}")
+                self.run_variant('sequential', server, lambda: self.send_sequentially(handler))
+                self.run_variant('pipelined', server, lambda: handler.send_article_attachments_to_telegram(1, 1))
+        finally:
+            server.stop()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+    def run_variant(self, name, server, send):
+        server.requests.clear()
+        started = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - started
+        telegram_calls = sum(1 for _, path, _ in server.requests if path.startswith('/bot'))
+        self.stdout.write(f"{name:<12} {elapsed:>8.2f} {telegram_calls:>15}")
+
+    def send_sequentially(self, handler):
+        """The previous sender: download and send each attachment in turn"""
+        for attachment in zammad_api.get_article_attachments(1):
+            file_content = zammad_api.download_attachment(1, attachment['id'])
+            handler.send_attachment_to_telegram(
+                1, file_content, attachment['filename'], attachment['preferences']['Mime-Type']
+            )
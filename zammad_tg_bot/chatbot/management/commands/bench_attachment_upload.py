@@ -0,0 +1,88 @@
+import json
+import subprocess
+import sys
+import time
+
+import telegram
+from django.core.management.base import BaseCommand
+
+from chatbot.management.fake_zammad import FakeZammadServer
+from chatbot.telegram_files import iter_telegram_file
+from chatbot.zammad_api import ZammadAttachmentManager
+
+BENCH_TOKEN = '123456:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+VARIANTS = ('buffered', 'streaming')
+
+
+def read_memory_kb(field):
+    """VmRSS (current) or VmHWM (peak) of this process in kB"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+class Command(BaseCommand):
+    help = ('Measure peak RSS of forwarding a Telegram file to Zammad: fully buffered '
+            '(download, Base64, JSON) vs streamed through the chunked encoder')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,20', help='Comma separated file sizes in MB')
+        parser.add_argument('--child', choices=VARIANTS, help='(internal) run one upload in this process')
+        parser.add_argument('--size', type=int, help='(internal) file size in bytes')
+        parser.add_argument('--url', help='(internal) fake Zammad/Telegram URL')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.run_child(options['child'], options['size'], options['url'])
+            return
+
+        server = FakeZammadServer().start()
+        try:
+            self.stdout.write(f"{'file':>6} {'variant':<10} {'peak RSS MB':>12} {'growth MB':>10} {'seconds':>8} {'uploaded MB':>12}")
+            for size_mb in [int(size) for size in options['sizes'].split(',')]:
+                for variant in VARIANTS:
+                    result = self.run_in_subprocess(variant, size_mb * 1024 * 1024, server.url)
+                    uploaded = server.requests[-1][2] if server.requests else 0
+                    self.stdout.write(
+                        f"{size_mb:>4}MB {variant:<10} {result['peak_kb'] / 1024:>12.1f} "
+                        f"{(result['peak_kb'] - result['baseline_kb']) / 1024:>10.1f} "
+                        f"{result['seconds']:>8.2f} {uploaded / 1024 / 1024:>12.1f}"
+                    )
+        finally:
+            server.stop()
+
+    def run_in_subprocess(self, variant, size, url):
+        """A fresh interpreter per measurement, so peak RSS isn't left over from an earlier run"""
+        output = subprocess.run(
+            [sys.executable, sys.argv[0], 'bench_attachment_upload',
+             '--child', variant, '--size', str(size), '--url', url],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def run_child(self, variant, size, url):
+        bot = telegram.Bot(BENCH_TOKEN, base_url=f"{url}bot", base_file_url=f"{url}file/bot")
+        manager = ZammadAttachmentManager()
+        manager.zammad_url = url
+        file_id = f"bench-{size}"
+        manager.session  # open the pooled session before taking the baseline
+
+        baseline_kb = read_memory_kb('VmHWM')
+        started = time.perf_counter()
+        if variant == 'buffered':
+            # The previous upload path: whole file, then its Base64 string, then the JSON string
+            file_content = bot.get_file(file_id).download_as_bytearray()
+            encoded_file = manager.encode_file_to_base64(file_content)
+            payload = manager.build_attachment_payload('bench', 'bench.bin', encoded_file, None)
+            ok = manager.make_request('PUT', f"{url}/api/v1/tickets/1", payload, timeout=90).status_code < 400
+        else:
+            ok = manager.add_attachment_stream_to_ticket(1, 'bench', iter_telegram_file(bot, file_id), 'bench.bin')
+
+        self.stdout.write(json.dumps({
+            'ok': ok,
+            'seconds': time.perf_counter() - started,
+            'baseline_kb': baseline_kb,
+            'peak_kb': read_memory_kb('VmHWM'),
+        }))
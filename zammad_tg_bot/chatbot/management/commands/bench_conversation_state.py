@@ -0,0 +1,105 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from chatbot.conversation_state import DatabaseConversationStore, SQLiteConversationStore
+from chatbot.models import TelegramBot
+
+BENCH_TOKEN = '123456:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+
+
+class Command(BaseCommand):
+    help = ('Measure wizard state latency of the database and SQLite file backends under concurrent workers '
+            'and check that racing workers never both advance the same step')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,4,8,16', help='Comma separated worker counts to benchmark')
+        parser.add_argument('--users', type=int, default=200, help='Users walking through the wizard per run')
+        parser.add_argument('--questions', type=int, default=3, help='Questions answered per wizard')
+
+    def handle(self, *args, **options):
+        worker_counts = [int(value) for value in options['workers'].split(',') if value.strip()]
+        state_dir = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite':
+            # A shared in-memory SQLite test database has no busy timeout; use a file like production
+            connection.settings_dict['TEST']['NAME'] = os.path.join(state_dir.name, 'test.sqlite3')
+        # Work on a throwaway test database, never on the real one
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            bot = TelegramBot.objects.create(name='bench', token=BENCH_TOKEN)
+            stores = [
+                ('database', DatabaseConversationStore()),
+                ('sqlite', SQLiteConversationStore(os.path.join(state_dir.name, 'state.sqlite3'))),
+            ]
+            self.stdout.write(f"{options['users']} wizards, {options['questions']} questions each")
+            self.stdout.write(
+                f"{'backend':<9} {'workers':>8} {'steps/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'races won':>10}"
+            )
+            for name, store in stores:
+                for workers in worker_counts:
+                    elapsed, latencies = self.run_wizards(store, bot.id, workers, options['users'],
+                                                          options['questions'])
+                    winners = self.run_race(store, bot.id, workers)
+                    quantiles = statistics.quantiles(latencies, n=100)
+                    self.stdout.write(
+                        f"{name:<9} {workers:>8} {len(latencies) / elapsed:>9.0f} "
+                        f"{quantiles[49] * 1000:>8.2f} {quantiles[98] * 1000:>8.2f} "
+                        f"{winners:>4} of {workers:<3}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            state_dir.cleanup()
+
+    def run_wizards(self, store, bot_id, workers, users, questions):
+        """Walk every user through start -> questions -> finish; returns elapsed seconds and step latencies"""
+        latencies = []
+        lock = threading.Lock()
+
+        def timed(call, *args):
+            started = time.perf_counter()
+            result = call(*args)
+            with lock:
+                latencies.append(time.perf_counter() - started)
+            return result
+
+        def wizard(telegram_id):
+            try:
+                timed(store.start, telegram_id, bot_id, 'questions', {'current_question': 0, 'answers': {}}, 600)
+                for index in range(questions):
+                    state = timed(store.get, telegram_id, bot_id)
+                    state['answers'][f"q_{index}"] = {'question': 'Q', 'answer': 'A'}
+                    state['current_question'] = index + 1
+                    timed(store.advance, telegram_id, bot_id, state['version'], 'questions', state, 600)
+                state = timed(store.get, telegram_id, bot_id)
+                timed(store.finish, telegram_id, bot_id, state['version'])
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(wizard, range(1, users + 1)))
+        return time.perf_counter() - started, latencies
+
+    def run_race(self, store, bot_id, workers):
+        """Let every worker answer the same question at once; exactly one may win"""
+        telegram_id = 10 ** 9
+        version = store.start(telegram_id, bot_id, 'questions', {'current_question': 0, 'answers': {}}, 600)
+        barrier = threading.Barrier(workers)
+
+        def answer(worker):
+            try:
+                barrier.wait()
+                return store.advance(telegram_id, bot_id, version, 'questions', {'current_question': worker}, 600)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(workers) as executor:
+            winners = sum(executor.map(answer, range(workers)))
+        store.finish(telegram_id, bot_id)
+        return winners
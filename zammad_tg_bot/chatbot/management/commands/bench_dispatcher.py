@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from chatbot.dispatcher import ShardedDispatcher, make_shard_key
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ShardedDispatcher throughput and per-chat ordering for several worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8,16',
+                            help='Comma separated worker counts to benchmark')
+        parser.add_argument('--updates', type=int, default=400, help='Updates per run')
+        parser.add_argument('--chats', type=int, default=50, help='Distinct chats the updates are spread over')
+        parser.add_argument('--handler-ms', type=float, default=20,
+                            help='Simulated handler time per update (Zammad/Telegram I/O)')
+
+    def handle(self, *args, **options):
+        worker_counts = [int(value) for value in options['workers'].split(',') if value.strip()]
+        updates = [
+            (make_shard_key(1, chat_id), chat_id, sequence)
+            for sequence in range(options['updates'])
+            for chat_id in [sequence % options['chats']]
+        ]
+        handler_seconds = options['handler_ms'] / 1000
+
+        self.stdout.write(
+            f"{options['updates']} updates over {options['chats']} chats, "
+            f"{options['handler_ms']:.0f}ms per update"
+        )
+        self.stdout.write(f"{'workers':>8} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'ordered':>8}")
+
+        baseline = None
+        for workers in worker_counts:
+            elapsed, ordered = self.run_once(workers, updates, handler_seconds)
+            throughput = len(updates) / elapsed
+            baseline = baseline or throughput
+            self.stdout.write(
+                f"{workers:>8} {elapsed:>9.2f} {throughput:>10.1f} "
+                f"{throughput / baseline:>7.1f}x {'yes' if ordered else 'NO':>8}"
+            )
+
+    def run_once(self, workers, updates, handler_seconds):
+        """Push all updates through a dispatcher and check that every chat kept its order"""
+        seen = defaultdict(list)
+        lock = threading.Lock()
+
+        def handler(item):
+            _, chat_id, sequence = item
+            time.sleep(handler_seconds)
+            with lock:
+                seen[chat_id].append(sequence)
+
+        dispatcher = ShardedDispatcher(workers, handler, name='bench')
+        started = time.perf_counter()
+        for item in updates:
+            dispatcher.submit(item[0], item)
+        dispatcher.join()
+        elapsed = time.perf_counter() - started
+        dispatcher.shutdown()
+
+        ordered = all(sequences == sorted(sequences) for sequences in seen.values())
+        return elapsed, ordered
@@ -0,0 +1,117 @@
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import telegram
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from chatbot import views, zammad_api
+from chatbot.bot_registry import bot_registry
+from chatbot.management.fake_zammad import FakeZammadProcess
+from chatbot.models import TelegramBot, ZammadGroup, Customer, Question
+from chatbot.photo_prefetch import photo_prefetcher
+
+BENCH_TOKEN = '123456:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+PHOTO_SIZE = 300 * 1024
+
+
+class Command(BaseCommand):
+    help = ('Measure the time from the last answer of the question flow to the "Success" message, '
+            'with and without resolving the customer and downloading photo answers ahead of time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Tickets created per variant')
+        parser.add_argument('--photos', type=int, default=3, help='Photo questions in the questionnaire')
+        parser.add_argument('--latency-ms', type=float, default=100,
+                            help='Simulated latency of every Zammad and Telegram API call')
+        parser.add_argument('--think-ms', type=float, default=1000,
+                            help='Time the user takes for each answer')
+
+    def handle(self, *args, **options):
+        state_dir = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite':
+            # Background threads use the database too; a shared in-memory test database has no busy timeout
+            connection.settings_dict['TEST']['NAME'] = os.path.join(state_dir.name, 'test.sqlite3')
+        # Work on a throwaway test database, never on the real one
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        server = FakeZammadProcess(delay=options['latency_ms'] / 1000).start()
+        old_prefetch = (photo_prefetcher.directory, photo_prefetcher.workers)
+        photo_prefetcher.directory = os.path.join(state_dir.name, 'photos')
+        try:
+            for manager in (zammad_api.ticket_manager, zammad_api.attachment_manager):
+                manager.zammad_url = server.url
+            bot = telegram.Bot(BENCH_TOKEN, base_url=f"{server.url}bot", base_file_url=f"{server.url}file/bot")
+            bot_record = self.create_bot(options['photos'])
+
+            self.stdout.write(
+                f"{options['photos']} photo answers, {options['latency_ms']:.0f}ms per Zammad/Telegram call, "
+                f"{options['think_ms']:.0f}ms per answer"
+            )
+            self.stdout.write(f"{'pipeline':<42} {'avg ms':>8} {'max ms':>8}")
+
+            variants = [
+                ('sequential (resolve, create, 1 PUT/photo)', False, False),
+                ('inline attachments', False, True),
+                ('inline + customer and photos prefetched', True, True),
+            ]
+            customer_number = 0
+            for name, prefetch, inline in variants:
+                timings = []
+                for _ in range(options['runs']):
+                    customer_number += 1
+                    timings.append(self.run_once(bot, bot_record, customer_number, prefetch, inline,
+                                                 options['think_ms'] / 1000))
+                self.stdout.write(
+                    f"{name:<42} {statistics.mean(timings) * 1000:>8.0f} {max(timings) * 1000:>8.0f}"
+                )
+        finally:
+            photo_prefetcher.directory, photo_prefetcher.workers = old_prefetch
+            server.stop()
+            bot_registry.clear()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            state_dir.cleanup()
+
+    def create_bot(self, photos):
+        bot_record = TelegramBot.objects.create(name='bench', token=BENCH_TOKEN)
+        ZammadGroup.objects.create(telegram_bot=bot_record, customer_last_name='Bench')
+        for order in range(photos):
+            Question.objects.create(question_text=f"Photo {order + 1}", question_type='photo', order=order)
+        return bot_registry.get(BENCH_TOKEN).record
+
+    def run_once(self, bot, bot_record, customer_number, prefetch, inline, think_seconds):
+        """Walk one user through the wizard; returns the seconds the last answer took"""
+        customer = Customer.objects.create(first_name=customer_number, telegram_bot=bot_record)
+        user = SimpleNamespace(id=customer_number, first_name='Bench', last_name='', username='bench')
+        chat = SimpleNamespace(id=customer_number)
+
+        with mock.patch.object(photo_prefetcher, 'workers', photo_prefetcher.workers if prefetch else 0), \
+                mock.patch.object(zammad_api, 'prefetch_zammad_user',
+                                  zammad_api.prefetch_zammad_user if prefetch else lambda *args: None), \
+                mock.patch.object(views, 'collect_answer_photos',
+                                  views.collect_answer_photos if inline else self.collect_no_photos):
+            views.show_customer_selection(bot, chat.id, user, bot_record, '+996000000000')
+            views._handle_customer_number_input(bot, self.message(chat, text=str(customer_number)), user, bot_record)
+            time.sleep(think_seconds)
+            views.start_question_flow(bot, chat.id, user, bot_record, customer, '+996000000000', 2, 'Bench')
+
+            questions = Question.objects.count()
+            for index in range(questions):
+                time.sleep(think_seconds)
+                photo = SimpleNamespace(file_id=f"bench{customer_number}_{index}-{PHOTO_SIZE}", file_size=PHOTO_SIZE)
+                message = self.message(chat, photo=[photo])
+                started = time.perf_counter()
+                views.handle_question_answer(bot, message, user, bot_record)
+            return time.perf_counter() - started
+
+    @staticmethod
+    def collect_no_photos(bot, answers):
+        """The old flow: every photo is downloaded and uploaded after the ticket exists"""
+        return [], [answer for answer in answers.values() if 'photo_file_id' in answer]
+
+    @staticmethod
+    def message(chat, text=None, photo=None):
+        return SimpleNamespace(chat=chat, text=text, photo=photo, caption=None)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import RequestFactory, AsyncRequestFactory
+from django.test.utils import override_settings
+
+from chatbot import views, async_views, zammad_api, zammad_async_api
+from chatbot.bot_registry import bot_registry
+from chatbot.management.fake_zammad import FakeZammadProcess
+from chatbot.models import TelegramBot, Customer, OpenTicket
+from chatbot.telegram_async_api import AsyncTelegramClient
+from chatbot.telegram_sender import telegram_send_limiter
+
+BENCH_TOKEN = '123456:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+
+
+class Command(BaseCommand):
+    help = ('Compare how many concurrent Zammad agent-reply webhooks and Telegram notes on open tickets '
+            'the sync (WSGI) and async (ASGI) views handle against a slow fake Zammad/Telegram')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent webhook calls per run')
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help='Request threads of the WSGI server (e.g. gunicorn workers x threads)')
+        parser.add_argument('--latency-ms', type=float, default=100,
+                            help='Simulated latency of every Zammad and Telegram API call')
+        parser.add_argument('--embed-attachments', action='store_true',
+                            help="Put the article's attachment list in the payload (no Zammad article fetch)")
+        parser.add_argument('--pool-size', type=int, default=100,
+                            help='HTTP connection pool size for the async Zammad/Telegram clients')
+        parser.add_argument('--endpoint', choices=['zammad', 'telegram', 'both'], default='both',
+                            help='Webhook to benchmark')
+
+    def handle(self, *args, **options):
+        state_dir = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite':
+            # Request threads write to the database; a shared in-memory test database has no busy timeout
+            connection.settings_dict['TEST']['NAME'] = os.path.join(state_dir.name, 'test.sqlite3')
+        # Work on a throwaway test database, never on the real one
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        server = FakeZammadProcess(delay=options['latency_ms'] / 1000).start()
+        try:
+            # The fake Telegram has no flood control, so don't pace the sends
+            with override_settings(TELEGRAM_API_URL=server.url.rstrip('/'),
+                                   TELEGRAM_CON_POOL_SIZE=options['pool_size'], TELEGRAM_SEND_RATE=100000,
+                                   TELEGRAM_CHAT_SEND_RATE=100000, TELEGRAM_UPDATE_MODE='sync',
+                                   ZAMMAD_WRITE_MODE='inline'):
+                telegram_send_limiter.clear()
+                self.point_clients_at(server.url, options['pool_size'])
+                bot = TelegramBot.objects.create(name='bench', token=BENCH_TOKEN)
+                payloads = self.create_tickets(bot, options['requests'], options['embed_attachments'])
+
+                if options['endpoint'] in ('zammad', 'both'):
+                    self.stdout.write(
+                        f"{len(payloads)} agent replies, {options['latency_ms']:.0f}ms per Zammad/Telegram call "
+                        f"({1 if options['embed_attachments'] else 2} calls per webhook)"
+                    )
+                    self.stdout.write(f"{'server':<26} {'seconds':>8} {'webhooks/s':>11} {'avg latency ms':>15}")
+
+                    elapsed = self.run_wsgi(views.zammad_webhook, '/telegram/webhook/zammad/', payloads,
+                                            options['wsgi_threads'])
+                    self.report(f"WSGI ({options['wsgi_threads']} threads)", len(payloads), elapsed)
+
+                    elapsed = asyncio.run(self.run_asgi(async_views.zammad_webhook, '/telegram/webhook/zammad/',
+                                                        payloads))
+                    self.report('ASGI (1 event loop)', len(payloads), elapsed)
+
+                if options['endpoint'] in ('telegram', 'both'):
+                    self.stdout.write(
+                        f"{options['requests']} notes on open tickets, {options['latency_ms']:.0f}ms per "
+                        f"Zammad/Telegram call (4 calls per update)"
+                    )
+                    self.stdout.write(f"{'server':<26} {'seconds':>8} {'updates/s':>11}")
+                    url = f"/telegram/webhook/{BENCH_TOKEN}/"
+
+                    updates = self.create_note_updates(options['requests'], first_update_id=1)
+                    elapsed = self.run_wsgi(views.telegram_webhook, url, updates, options['wsgi_threads'],
+                                            bot_token=BENCH_TOKEN)
+                    self.report_updates(f"WSGI ({options['wsgi_threads']} threads)", len(updates), elapsed)
+
+                    updates = self.create_note_updates(options['requests'], first_update_id=len(updates) + 1)
+                    elapsed = asyncio.run(self.run_asgi(async_views.telegram_webhook, url, updates,
+                                                        bot_token=BENCH_TOKEN))
+                    self.report_updates('ASGI (1 event loop)', len(updates), elapsed)
+        finally:
+            server.stop()
+            bot_registry.clear()
+            telegram_send_limiter.clear()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            state_dir.cleanup()
+
+    def point_clients_at(self, url, pool_size):
+        bot_registry.clear()
+        for manager in (zammad_api.ticket_manager, zammad_api.attachment_manager, zammad_api.article_manager):
+            manager.zammad_url = url
+        for manager in (zammad_async_api.async_ticket_manager, zammad_async_api.async_attachment_manager,
+                        zammad_async_api.async_article_manager):
+            manager.zammad_url = url
+            manager.pool_size = pool_size
+
+    def create_tickets(self, bot, count, embed_attachments=False):
+        """One open ticket per simulated agent reply, returns the webhook payloads"""
+        customer = Customer.objects.create(first_name=1, telegram_bot=bot)
+        payloads = []
+        for index in range(count):
+            OpenTicket.objects.create(
+                telegram_id=1000 + index, bot=bot, customer=customer,
+                zammad_ticket_id=index + 1, zammad_ticket_number=str(index + 1),
+            )
+            article = {'id': index + 1, 'type': 'note', 'sender': 'Agent', 'internal': False, 'body': 'Hi'}
+            if embed_attachments:
+                article['attachments'] = []
+            payloads.append(json.dumps({'ticket': {'id': index + 1, 'state': 'open'}, 'article': article}))
+        return payloads
+
+    def create_note_updates(self, count, first_update_id):
+        """Telegram updates with a note from every ticket's user (the ticket state is fetched from Zammad)"""
+        OpenTicket.objects.update(zammad_state='', state_synced_at=None)
+        return [
+            json.dumps({
+                'update_id': first_update_id + index,
+                'message': {
+                    'message_id': 1, 'date': 0, 'text': 'Any news?',
+                    'chat': {'id': 1000 + index, 'type': 'private'},
+                    'from': {'id': 1000 + index, 'is_bot': False, 'first_name': 'Bench'},
+                },
+            })
+            for index in range(count)
+        ]
+
+    def run_wsgi(self, view, url, payloads, threads, **view_kwargs):
+        """Sync view, one request per thread, like a threaded WSGI server"""
+        def call(payload):
+            request = RequestFactory().post(url, payload, content_type='application/json')
+            try:
+                return view(request, **view_kwargs)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(call, payloads))
+        return time.perf_counter() - started
+
+    async def run_asgi(self, view, url, payloads, **view_kwargs):
+        """Async view, all requests in flight on one event loop"""
+        factory = AsyncRequestFactory()
+
+        async def call(payload):
+            request = factory.post(url, payload, content_type='application/json')
+            return await view(request, **view_kwargs)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call(payload) for payload in payloads))
+        elapsed = time.perf_counter() - started
+
+        await zammad_async_api.AsyncZammadApiClient.close_sessions()
+        await AsyncTelegramClient.close_sessions()
+        return elapsed
+
+    def report(self, name, count, elapsed):
+        # The histogram is cumulative, so compare with the totals after the previous run
+        totals = views.webhook_latency_histogram.samples()
+        latency_count = sum(series['count'] for _, series in totals)
+        latency_sum = sum(series['sum'] for _, series in totals)
+        previous_count, previous_sum = getattr(self, 'latency_totals', (0, 0.0))
+        self.latency_totals = (latency_count, latency_sum)
+        runs = latency_count - previous_count
+        average_ms = (latency_sum - previous_sum) / runs * 1000 if runs else 0
+        self.stdout.write(f"{name:<26} {elapsed:>8.2f} {count / elapsed:>11.1f} {average_ms:>15.1f}")
+
+    def report_updates(self, name, count, elapsed):
+        self.stdout.write(f"{name:<26} {elapsed:>8.2f} {count / elapsed:>11.1f}")
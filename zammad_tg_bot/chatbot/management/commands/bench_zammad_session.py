@@ -0,0 +1,65 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from chatbot.management.fake_zammad import FakeZammadServer
+from chatbot.zammad_api import ZammadTicketManager
+
+
+class Command(BaseCommand):
+    help = 'Compare per-call latency of fresh connections vs the pooled ZammadApiClient session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Calls per variant')
+        parser.add_argument('--threads', type=int, default=1, help='Concurrent callers')
+        parser.add_argument('--url', default=None,
+                            help='Benchmark against this Zammad URL instead of the local fake server')
+
+    def handle(self, *args, **options):
+        server = None
+        if options['url']:
+            base_url = options['url']
+        else:
+            server = FakeZammadServer().start()
+            base_url = server.url
+
+        manager = ZammadTicketManager()
+        manager.zammad_url = base_url
+        manager.pool_size = max(manager.pool_size, options['threads'])
+        ticket_url = f"{base_url.rstrip('/')}/api/v1/tickets/1?expand=true"
+        headers = {"Authorization": f"Token token={manager.zammad_token}"}
+
+        variants = [
+            ('new connection per call', lambda: requests.get(ticket_url, headers=headers, timeout=10)),
+            ('pooled keep-alive session', lambda: manager.session.get(ticket_url, headers=headers, timeout=10)),
+        ]
+
+        try:
+            self.stdout.write(f"{options['requests']} GET /tickets/1 calls, {options['threads']} thread(s), {base_url}")
+            self.stdout.write(f"{'variant':<28} {'avg ms':>8} {'p95 ms':>8} {'calls/s':>9}")
+            for name, call in variants:
+                call()  # warm up (opens the pooled connection)
+                latencies, elapsed = self.run_variant(call, options['requests'], options['threads'])
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                self.stdout.write(
+                    f"{name:<28} {statistics.mean(latencies) * 1000:>8.2f} {p95 * 1000:>8.2f} "
+                    f"{len(latencies) / elapsed:>9.0f}"
+                )
+        finally:
+            if server:
+                server.stop()
+
+    def run_variant(self, call, count, threads):
+        """Run `count` calls on `threads` threads and return per-call latencies and wall time"""
+        def timed_call(_):
+            started = time.perf_counter()
+            call().raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(timed_call, range(count)))
+        return latencies, time.perf_counter() - started
@@ -0,0 +1,83 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot import zammad_outbox
+from chatbot.dispatcher import ShardedDispatcher
+from chatbot.metrics import start_configured_snapshots
+from chatbot.models import PendingZammadWrite
+
+
+class Command(BaseCommand):
+    help = 'Send Zammad notes, attachments and ticket closes recorded in the outbox (ZAMMAD_WRITE_MODE=outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.ZAMMAD_OUTBOX_WORKERS,
+                            help='Maximum number of concurrent Zammad requests')
+        parser.add_argument('--max-attempts', type=int, default=settings.ZAMMAD_OUTBOX_MAX_ATTEMPTS,
+                            help='Failed attempts after which a write becomes a dead letter')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between outbox depth / delivery reports')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue writes stuck in processing for longer than this many seconds')
+        parser.add_argument('--retention', type=int, default=86400,
+                            help='Delete sent writes older than this many seconds')
+        parser.add_argument('--once', action='store_true',
+                            help='Send everything that is due now and exit')
+
+    def handle(self, *args, **options):
+        start_configured_snapshots()
+        workers = max(1, options['workers'])
+        max_attempts = max(1, options['max_attempts'])
+
+        requeued = zammad_outbox.requeue_stale_writes(options['stale_after'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale writes'))
+
+        self.stdout.write(self.style.SUCCESS(f'Flushing the Zammad outbox with {workers} workers'))
+        dispatcher = ShardedDispatcher(
+            workers, lambda write: zammad_outbox.process_write(write, max_attempts), name='outbox-worker'
+        )
+        last_stats = time.monotonic()
+
+        try:
+            while True:
+                # Counted before claiming: a write finishing meanwhile can make the next one of its ticket due
+                in_flight = dispatcher.pending_count()
+                free_slots = workers * 2 - in_flight
+                claimed = zammad_outbox.claim_due_writes(free_slots) if free_slots > 0 else []
+                for write in claimed:
+                    dispatcher.submit(write.zammad_ticket_id, write)
+
+                if time.monotonic() - last_stats >= options['stats_interval']:
+                    self.report_stats()
+                    zammad_outbox.purge_sent_writes(options['retention'])
+                    last_stats = time.monotonic()
+
+                if not claimed:
+                    if options['once'] and not in_flight:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopping, waiting for in-flight writes...'))
+        finally:
+            dispatcher.shutdown()
+
+        self.report_stats()
+
+    def report_stats(self):
+        """Print outbox depth, dead letters and delivery latency"""
+        depth = zammad_outbox.get_outbox_depth()
+        dead = PendingZammadWrite.objects.filter(status='dead').count()
+        lines = [f'Outbox depth: {depth}, dead letters: {dead}']
+        for _, series in zammad_outbox.outbox_delivery_histogram.samples():
+            if series['count']:
+                average_ms = series['sum'] / series['count'] * 1000
+                lines.append(f'{zammad_outbox.outbox_delivery_histogram.name}: count={series["count"]} avg={average_ms:.1f}ms')
+        for labels, value in zammad_outbox.outbox_attempts_counter.samples():
+            lines.append(f'{zammad_outbox.outbox_attempts_counter.name}'
+                         f'{{action={labels.get("action")},result={labels.get("result")}}}: {value}')
+        self.stdout.write('\n'.join(lines))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.ticket_reconciler import TicketReconciler
+
+
+class Command(BaseCommand):
+    help = 'Check all open tickets against Zammad in batches and clean up the ones closed there'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Tickets per Zammad search request (Zammad caps search results, keep <= 100)')
+        parser.add_argument('--notify', action='store_true',
+                            help='Tell users that their ticket was closed, like the Zammad webhook does')
+        parser.add_argument('--mark-only', action='store_true',
+                            help='Only store the Zammad state of closed tickets instead of deleting them')
+        parser.add_argument('--progress-every', type=int, default=10,
+                            help='Print progress every N batches (0 to disable)')
+
+    def handle(self, *args, **options):
+        reconciler = TicketReconciler(
+            batch_size=max(1, options['batch_size']),
+            notify=options['notify'],
+            delete_closed=not options['mark_only'],
+        )
+        batches = 0
+
+        def progress(stats):
+            nonlocal batches
+            batches += 1
+            if options['progress_every'] and batches % options['progress_every'] == 0:
+                self.stdout.write(f'{stats.checked} tickets checked in {stats.elapsed:.1f}s')
+
+        stats = reconciler.run(progress)
+
+        action = 'marked' if options['mark_only'] else 'removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {stats.checked} tickets in {stats.elapsed:.2f}s '
+            f'({stats.checked / stats.elapsed if stats.elapsed else 0:.0f} tickets/s, '
+            f'{stats.zammad_requests} Zammad requests)'
+        ))
+        self.stdout.write(
+            f'Still open: {stats.still_open}, closed and {action}: {stats.closed}, '
+            f'users notified: {stats.notified}, skipped (Zammad unreachable): {stats.skipped}'
+        )
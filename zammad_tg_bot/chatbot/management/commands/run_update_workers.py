@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot import update_queue
+from chatbot.dispatcher import ShardedDispatcher
+from chatbot.metrics import start_configured_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Process Telegram updates queued by the webhook (TELEGRAM_UPDATE_MODE=queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.UPDATE_WORKER_COUNT,
+                            help='Number of worker threads; updates of one chat always share a thread')
+        parser.add_argument('--process-index', type=int, default=0,
+                            help='Index of this process when running several worker processes')
+        parser.add_argument('--process-count', type=int, default=1,
+                            help='Total number of worker processes sharing the queue')
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stats-interval', type=float, default=30,
+                            help='Seconds between queue depth / latency reports')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Requeue updates stuck in processing for longer than this many seconds')
+        parser.add_argument('--retention', type=int, default=3600,
+                            help='Delete processed updates older than this many seconds')
+        parser.add_argument('--failed-retention', type=int, default=7 * 86400,
+                            help='Delete updates given up on (dead letters) older than this many seconds')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the current queue and exit')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        process_index = options['process_index']
+        process_count = max(1, options['process_count'])
+        if not 0 <= process_index < process_count:
+            raise CommandError('--process-index must be between 0 and --process-count - 1')
+        start_configured_snapshots()
+
+        if process_index == 0:
+            requeued = update_queue.requeue_stale_updates(options['stale_after'])
+            if requeued:
+                self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale updates'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Starting {workers} update workers (process {process_index + 1}/{process_count})'
+        ))
+        dispatcher = ShardedDispatcher(workers, update_queue.process_pending_update, name='update-worker')
+        last_stats = time.monotonic()
+
+        try:
+            while True:
+                free_slots = workers * 2 - dispatcher.pending_count()
+                claimed = []
+                if free_slots > 0:
+                    claimed = update_queue.claim_pending_updates(free_slots, process_index, process_count)
+                for pending in claimed:
+                    # Updates of one (bot, chat) pair share a thread and stay in order
+                    dispatcher.submit(pending.shard_key // process_count, pending)
+
+                if time.monotonic() - last_stats >= options['stats_interval']:
+                    self.report_stats()
+                    update_queue.purge_finished_updates(options['retention'], options['failed_retention'])
+                    last_stats = time.monotonic()
+
+                if not claimed:
+                    if options['once'] and not dispatcher.pending_count():
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopping, waiting for in-flight updates...'))
+        finally:
+            dispatcher.shutdown()
+
+        self.report_stats()
+
+    def report_stats(self):
+        """Print queue depth and per-update latency"""
+        depth = update_queue.get_queue_depth()
+        lines = [f'Queue depth: {depth}']
+        failed = update_queue.get_failed_count()
+        if failed:
+            lines.append(f'Failed updates (dead letters, see the admin): {failed}')
+        for histogram in (update_queue.queue_wait_histogram, update_queue.processing_histogram):
+            for _, series in histogram.samples():
+                if series['count']:
+                    average_ms = series['sum'] / series['count'] * 1000
+                    lines.append(f'{histogram.name}: count={series["count"]} avg={average_ms:.1f}ms')
+        for labels, value in update_queue.processed_counter.samples():
+            lines.append(f'{update_queue.processed_counter.name}{{status={labels.get("status")}}}: {value}')
+        self.stdout.write('\n'.join(lines))
@@ -0,0 +1,250 @@
+"""Minimal Zammad (and Telegram Bot API) stand-in used by the benchmark commands."""
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeZammadHandler(BaseHTTPRequestHandler):
+    """Answers the handful of Zammad endpoints the bot uses with canned JSON"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like a real Zammad behind nginx
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # Bot API calls are small JSON bodies, keep that much so routes can look at them
+    KEEP_BODY_BYTES = 64 * 1024
+    # and the end of bigger ones (ticket tags come after the article and its attachments)
+    KEEP_BODY_END_BYTES = 4 * 1024
+
+    def read_body(self):
+        """Read the request body, plain or chunked, counting bytes without keeping them"""
+        self.body_start = b''
+        self.body_end = b''
+        size = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0], 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    break
+                remaining = chunk_size
+                while remaining:
+                    data = self.rfile.read(min(remaining, 65536))
+                    self.keep_body_start(data)
+                    remaining -= len(data)
+                self.rfile.readline()
+                size += chunk_size
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                data = self.rfile.read(min(remaining, 65536))
+                self.keep_body_start(data)
+                remaining -= len(data)
+                size += len(data)
+        return size
+
+    def keep_body_start(self, data):
+        if len(self.body_start) < self.KEEP_BODY_BYTES:
+            self.body_start += data[:self.KEEP_BODY_BYTES - len(self.body_start)]
+        self.body_end = (self.body_end + data)[-self.KEEP_BODY_END_BYTES:]
+
+    def stream_file(self, size):
+        """Send `size` bytes of file content without building it in memory"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        block = b'\xff' * 65536
+        while size:
+            self.wfile.write(block[:min(size, len(block))])
+            size -= min(size, len(block))
+
+    def respond(self, status, payload):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self):
+        self.server.record_request(self.command, self.path, self.read_body())
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        # The bot builds both "{url}api/v1" and "{url}/api/v1" style URLs
+        path = '/' + self.path.lstrip('/')
+        download = re.match(r'/file/bot[^/]+/files/(\d+)\.bin', path)
+        if download:
+            self.stream_file(int(download.group(1)))
+            return
+        if path.startswith('/api/') and self.server.take_rate_limited_request():
+            self.send_response(429)
+            self.send_header('Retry-After', str(self.server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path.startswith('/bot') and self.server.take_rate_limited_request(telegram=True):
+            self.respond(429, {
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry later',
+                'parameters': {'retry_after': self.server.retry_after},
+            })
+            return
+        status, payload = self.server.route(self.command, path, self.body_start, self.body_end)
+        self.respond(status, payload)
+
+    do_GET = do_POST = do_PUT = handle_any
+
+
+class FakeZammadServer(ThreadingHTTPServer):
+    """Threaded fake Zammad listening on a free localhost port"""
+
+    daemon_threads = True
+    request_queue_size = 1024  # benchmarks open hundreds of connections at once
+
+    def __init__(self, delay=0.0):
+        super().__init__(('127.0.0.1', 0), FakeZammadHandler)
+        self.delay = delay
+        self.requests = []
+        self.ticket_counter = 0
+        # Attachments listed on every article ({'id', 'filename', 'size', 'preferences'} like Zammad)
+        self.article_attachments = []
+        # Answer this many of the next Zammad requests with 429 and Retry-After: retry_after
+        self.rate_limited_requests = 0
+        # Same for the next Telegram Bot API calls (flood control)
+        self.telegram_rate_limited_requests = 0
+        self.retry_after = 1
+        # Create this many of the next tickets but answer 504, like a gateway timing out
+        self.failed_ticket_creates = 0
+        self.ticket_tags = {}  # tag -> ticket
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def record_request(self, method, path, body_size):
+        with self._lock:
+            self.requests.append((method, path, body_size))
+
+    def take_rate_limited_request(self, telegram=False):
+        attribute = 'telegram_rate_limited_requests' if telegram else 'rate_limited_requests'
+        with self._lock:
+            if getattr(self, attribute) <= 0:
+                return False
+            setattr(self, attribute, getattr(self, attribute) - 1)
+            return True
+
+    def find_article_attachment(self, attachment_id):
+        return next((a for a in self.article_attachments if a['id'] == attachment_id), None)
+
+    def take_failed_ticket_create(self):
+        with self._lock:
+            if self.failed_ticket_creates <= 0:
+                return False
+            self.failed_ticket_creates -= 1
+            return True
+
+    def route(self, method, path, body=b'', body_end=b''):
+        # Telegram Bot API (TELEGRAM_API_URL can point here too)
+        match = re.match(r'/bot[^/]+/(\w+)', path)
+        if match and match.group(1) == 'getFile':
+            # A file_id ending in "-<bytes>" is served as a file of that size
+            file_id = json.loads(body or b'{}').get('file_id', '')
+            size = int(file_id.rsplit('-', 1)[-1]) if file_id.rsplit('-', 1)[-1].isdigit() else 1024
+            return 200, {'ok': True, 'result': {
+                'file_id': file_id, 'file_unique_id': file_id, 'file_size': size, 'file_path': f'files/{size}.bin',
+            }}
+        if match:
+            message = {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}}
+            result = [message] if match.group(1) == 'sendMediaGroup' else message
+            return 200, {'ok': True, 'result': result}
+        if method == 'POST' and path.startswith('/api/v1/tickets'):
+            with self._lock:
+                self.ticket_counter += 1
+                ticket_id = self.ticket_counter
+            ticket = {'id': ticket_id, 'number': str(10000 + ticket_id), 'state': 'new'}
+            tags = re.search(rb'"tags": "([^"]*)"', body + body_end)
+            for tag in tags.group(1).decode().split(',') if tags else ():
+                self.ticket_tags[tag] = ticket
+            if self.take_failed_ticket_create():
+                return 504, {'error': 'Gateway Timeout'}
+            return 201, ticket
+        if method == 'GET' and path.startswith('/api/v1/tickets/search'):
+            query = parse_qs(urlparse(path).query)
+            tag_query = re.match(r'tags:(\S+)$', query.get('query', [''])[0])
+            if tag_query:
+                ticket = self.ticket_tags.get(tag_query.group(1))
+                return 200, [ticket] if ticket else []
+            # Every tenth ticket is closed, so reconciliation has something to do
+            ticket_ids = [int(ticket_id) for ticket_id in re.findall(r'\d+', query.get('query', [''])[0])]
+            tickets = [{'id': ticket_id, 'state': 'closed' if ticket_id % 10 == 0 else 'open'}
+                       for ticket_id in ticket_ids]
+            if query.get('expand') == ['true']:
+                return 200, tickets
+            return 200, {'tickets': ticket_ids, 'assets': {'Ticket': {str(t['id']): t for t in tickets}}}
+        match = re.match(r'/api/v1/tickets/(\d+)', path)
+        if match:
+            return 200, {'id': int(match.group(1)), 'state': 'open', 'number': '10001'}
+        if path.startswith('/api/v1/users/search'):
+            return 200, []
+        if method == 'POST' and path.startswith('/api/v1/users'):
+            return 201, {'id': 1, 'email': 'customer@customer.local'}
+        # Like some Zammad versions, only the generic attachments endpoint exists
+        if re.match(r'/api/v1/(ticket_attachment/|ticket_articles/\d+/attachments/)', path):
+            return 404, {'error': 'Not Found'}
+        match = re.match(r'/api/v1/attachments/(\d+)', path)
+        if match:
+            attachment = self.find_article_attachment(int(match.group(1)))
+            return 200, b'\xff' * attachment['size'] if attachment else b'attachment-content'
+        match = re.match(r'/api/v1/ticket_articles/(\d+)', path)
+        if method == 'GET' and match:
+            return 200, {'id': int(match.group(1)), 'attachments': self.article_attachments}
+        if path.startswith('/api/v1/ticket_articles'):
+            return 201, {'id': 1, 'attachments': []}
+        return 200, {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve_forever(delay, url_queue):
+    server = FakeZammadServer(delay=delay)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+class FakeZammadProcess:
+    """Runs FakeZammadServer in a child process.
+
+    Concurrency benchmarks use this so hundreds of server threads don't
+    compete for the GIL with the code being measured.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.url = None
+        self._process = None
+
+    def start(self):
+        url_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve_forever, args=(self.delay, url_queue), daemon=True)
+        self._process.start()
+        self.url = url_queue.get(timeout=10)
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,336 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(labels, extra=()):
+    """Prometheus label set, e.g. {operation="create_ticket",status="201"}"""
+    items = [*labels.items(), *extra]
+    if not items:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float) and value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    prometheus_type = 'counter'
+    # Values of the node's processes add up (see MetricsRegistry.combined)
+    summed_across_processes = True
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for the given label set"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return current value for the given label set"""
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        """Return a list of (labels, value) pairs"""
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+    def empty_copy(self):
+        return type(self)(self.name, self.description)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def dump(self):
+        """Raw values as JSON-friendly [labels, value] pairs (see add_dump)"""
+        with self._lock:
+            return [[dict(key), value] for key, value in self._values.items()]
+
+    def add_dump(self, dumped):
+        """Add the values another process dumped"""
+        with self._lock:
+            for labels, value in dumped:
+                key = tuple(sorted(labels.items()))
+                self._values[key] = self._values.get(key, 0) + value
+
+    def render_prometheus(self):
+        """Lines of the Prometheus text format"""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.prometheus_type}']
+        for labels, value in self.samples():
+            lines.append(f'{self.name}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    prometheus_type = 'gauge'
+    # A gauge describes its own process (e.g. its circuit breaker), another process's value is not added
+    summed_across_processes = False
+
+    def set(self, value, **labels):
+        """Set the gauge for the given label set"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Bucketed distribution of observed values (e.g. latencies in seconds)"""
+
+    summed_across_processes = True
+
+    def __init__(self, name, description, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record a single observation"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['count'] += 1
+            series['sum'] += value
+
+    def samples(self):
+        """Return a list of (labels, series) pairs with cumulative bucket counts"""
+        with self._lock:
+            result = []
+            for key, series in self._series.items():
+                cumulative = []
+                running = 0
+                for count in series['buckets']:
+                    running += count
+                    cumulative.append(running)
+                result.append((dict(key), {
+                    'buckets': list(zip(self.buckets, cumulative)),
+                    'count': series['count'],
+                    'sum': series['sum'],
+                }))
+            return result
+
+    def empty_copy(self):
+        return Histogram(self.name, self.description, self.buckets)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def dump(self):
+        """Raw series as JSON-friendly [labels, series] pairs (see add_dump)"""
+        with self._lock:
+            return [[dict(key), {**series, 'buckets': list(series['buckets'])}] for key, series in self._series.items()]
+
+    def add_dump(self, dumped):
+        """Add the series another process dumped (skipped if it used other buckets)"""
+        with self._lock:
+            for labels, other in dumped:
+                if len(other['buckets']) != len(self.buckets):
+                    continue
+                key = tuple(sorted(labels.items()))
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+                series['buckets'] = [count + added for count, added in zip(series['buckets'], other['buckets'])]
+                series['count'] += other['count']
+                series['sum'] += other['sum']
+
+    def render_prometheus(self):
+        """Lines of the Prometheus text format"""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, series in self.samples():
+            for bound, count in [*series['buckets'], (float('inf'), series['count'])]:
+                lines.append(f'{self.name}_bucket{format_labels(labels, [("le", format_value(float(bound)))])} {count}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(float(series["sum"]))}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {series["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide collection of named metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, description, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, description, **kwargs)
+            return metric
+
+    def counter(self, name, description):
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name, description):
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name, description, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def all_metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.all_metrics():
+            lines.extend(metric.render_prometheus())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Drop every value (the metrics stay registered)"""
+        for metric in self.all_metrics():
+            metric.reset()
+
+    def dump(self):
+        """name -> dumped values of every metric"""
+        return {metric.name: metric.dump() for metric in self.all_metrics()}
+
+    def combined(self, dumps):
+        """A registry with the metrics of this process plus the counters and histograms other processes dumped"""
+        combined = MetricsRegistry()
+        for metric in self.all_metrics():
+            copy = combined._metrics[metric.name] = metric.empty_copy()
+            copy.add_dump(metric.dump())
+            if metric.summed_across_processes:
+                for dumped in dumps:
+                    copy.add_dump(dumped.get(metric.name, []))
+        return combined
+
+
+class MetricsSnapshots:
+    """Shares a registry with the other processes of a node through files in `directory`.
+
+    Every process writes its metrics to its own file every `interval`
+    seconds and removes it when it exits; the process that answers a
+    scrape adds the files of the others to its live values. A file not
+    rewritten for STALE_INTERVALS intervals belongs to a process that
+    died without cleaning up and is deleted by the next scrape.
+    """
+
+    STALE_INTERVALS = 3
+
+    def __init__(self, registry, directory, interval=15):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.path = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._start_writer()
+        # A forked worker (e.g. gunicorn --preload) gets its own file and writer thread
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.remove)
+
+    def _after_fork(self):
+        # What the child inherited is still reported by the parent
+        self.registry.reset()
+        self._start_writer()
+
+    def _start_writer(self):
+        # pid and start time, so a reused pid doesn't overwrite the counts of an exited process
+        self.path = os.path.join(self.directory, f"metrics_{os.getpid()}_{time.time_ns()}.json")
+        threading.Thread(target=self._run, name='metrics-snapshots', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.write()
+            time.sleep(self.interval)
+
+    def write(self):
+        """Replace this process's file with its current metrics"""
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics_', suffix='.tmp')
+            with os.fdopen(fd, 'w') as snapshot_file:
+                json.dump(self.registry.dump(), snapshot_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not write metrics snapshot {self.path}: {e}")
+
+    def remove(self):
+        """Delete this process's file (it exits)"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def read_others(self):
+        """The metrics the live other processes wrote last; stale files are deleted"""
+        dumps = []
+        stale_before = time.time() - self.interval * self.STALE_INTERVALS
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            if path == self.path:
+                continue
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+                    continue
+                with open(path) as snapshot_file:
+                    dumps.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue
+        return dumps
+
+    def render_prometheus(self):
+        return self.registry.combined(self.read_others()).render_prometheus()
+
+
+registry = MetricsRegistry()
+snapshots = None
+
+
+def start_snapshots(directory, interval=15):
+    """Share the metrics of this process through `directory` (see MetricsSnapshots)"""
+    global snapshots
+    if snapshots is None:
+        snapshots = MetricsSnapshots(registry, directory, interval)
+        snapshots.start()
+
+
+def start_configured_snapshots():
+    """start_snapshots() with METRICS_DIR, for the web server and the worker commands"""
+    from django.conf import settings
+
+    if settings.METRICS_DIR:
+        start_snapshots(settings.METRICS_DIR, settings.METRICS_WRITE_INTERVAL)
+
+
+def render_node_metrics():
+    """Metrics of this process, plus those of the node's other processes once start_snapshots() ran"""
+    if snapshots is None:
+        return registry.render_prometheus()
+    return snapshots.render_prometheus()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0020_pendingupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupdate',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pendingupdate',
+            name='shard_key',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-16 23:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0021_pendingupdate_shard_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('update_id', models.BigIntegerField()),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('duplicate_count', models.IntegerField(default=0)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chatbot.telegrambot')),
+            ],
+            options={
+                'unique_together': {('bot', 'update_id')},
+            },
+        ),
+    ]
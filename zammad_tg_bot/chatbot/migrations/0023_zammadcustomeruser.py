@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0022_processedupdate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZammadCustomerUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=254, unique=True)),
+                ('zammad_user_id', models.IntegerField()),
+                ('resolved_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0023_zammadcustomeruser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openticket',
+            name='state_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='openticket',
+            name='zammad_state',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0024_openticket_zammad_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingZammadWrite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zammad_ticket_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('note', 'Note'), ('attachment', 'Attachment'), ('close', 'Close ticket')], max_length=20)),
+                ('user_name', models.CharField(blank=True, default='', max_length=255)),
+                ('body', models.TextField(blank=True, default='')),
+                ('telegram_file_id', models.CharField(blank=True, default='', max_length=255)),
+                ('filename', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('dead', 'Dead letter')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chatbot.telegrambot')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='chatbot_pen_status_2527c9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0025_pendingzammadwrite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZammadInstance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zammad_url', models.CharField(max_length=255, unique=True)),
+                ('attachment_url_scheme', models.CharField(blank=True, default='', max_length=50)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0026_zammadinstance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_id', models.BigIntegerField()),
+                ('step', models.CharField(max_length=50)),
+                ('data', models.JSONField(default=dict)),
+                ('version', models.IntegerField(default=1)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chatbot.telegrambot')),
+            ],
+            options={
+                'unique_together': {('telegram_id', 'bot')},
+            },
+        ),
+    ]
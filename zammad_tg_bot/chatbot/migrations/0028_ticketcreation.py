@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-17 00:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0027_conversationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCreation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idempotency_key', models.CharField(max_length=64, unique=True)),
+                ('telegram_id', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('creating', 'Creating'), ('created', 'Created')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('zammad_ticket_id', models.IntegerField(blank=True, null=True)),
+                ('zammad_ticket_number', models.CharField(blank=True, default='', max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chatbot.telegrambot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bot', 'telegram_id', 'status'], name='chatbot_tic_bot_id_133e4d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-17 01:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0028_ticketcreation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupdate',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pendingupdate',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='pendingupdate',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed (dead letter)')], default='pending', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0029_pendingupdate_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketcreation',
+            name='uncertain_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ticketcreation',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('creating', 'Creating'), ('uncertain', 'Uncertain (looking up)'), ('created', 'Created')], default='pending', max_length=10),
+        ),
+    ]
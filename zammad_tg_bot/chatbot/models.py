@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class TelegramBot(models.Model):
@@ -100,9 +101,162 @@ class OpenTicket(models.Model):
     zammad_ticket_number = models.CharField(max_length=50)
     priority = models.IntegerField(default=2)  # 1=Low, 2=Medium, 3=High
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last known Zammad state, kept current by the Zammad webhook
+    zammad_state = models.CharField(max_length=50, blank=True, default='')
+    state_synced_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         unique_together = ['telegram_id', 'bot']
     
     def __str__(self):
-        return f"{self.bot.name}: {self.telegram_id} - Ticket #{self.zammad_ticket_number}"
\ No newline at end of file
+        return f"{self.bot.name}: {self.telegram_id} - Ticket #{self.zammad_ticket_number}"
+
+
+class PendingUpdate(models.Model):
+    """Raw Telegram update waiting to be processed by the update workers"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed (dead letter)'),
+    ]
+
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE)
+    payload = models.JSONField()
+    chat_id = models.BigIntegerField(null=True, blank=True)
+    shard_key = models.IntegerField(default=0)  # make_shard_key(bot.id, chat_id)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"{self.bot.name}: update #{self.id} ({self.status})"
+
+
+class ProcessedUpdate(models.Model):
+    """Telegram update_id already accepted for a bot, used to drop redeliveries"""
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE)
+    update_id = models.BigIntegerField()
+    first_seen_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    duplicate_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['bot', 'update_id']
+
+    def __str__(self):
+        return f"{self.bot.name}: update_id {self.update_id} ({self.duplicate_count} duplicates)"
+
+
+class ZammadCustomerUser(models.Model):
+    """Zammad user resolved for a generated customer email ({prefix}_{number} customers)"""
+    email = models.CharField(max_length=254, unique=True)
+    zammad_user_id = models.IntegerField()
+    resolved_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.email} -> Zammad user {self.zammad_user_id}"
+
+
+class PendingZammadWrite(models.Model):
+    """Zammad write recorded by a handler and sent later by `manage.py flush_zammad_outbox`"""
+    ACTION_CHOICES = [
+        ('note', 'Note'),
+        ('attachment', 'Attachment'),
+        ('close', 'Close ticket'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('dead', 'Dead letter'),
+    ]
+
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE)
+    zammad_ticket_id = models.IntegerField()
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    user_name = models.CharField(max_length=255, blank=True, default='')
+    body = models.TextField(blank=True, default='')  # note text or attachment caption
+    telegram_file_id = models.CharField(max_length=255, blank=True, default='')
+    filename = models.CharField(max_length=255, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"{self.action} for ticket {self.zammad_ticket_id} ({self.status})"
+
+
+class ZammadInstance(models.Model):
+    """What the bot learned about a Zammad installation (keyed by its base URL)"""
+    zammad_url = models.CharField(max_length=255, unique=True)
+    attachment_url_scheme = models.CharField(max_length=50, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.zammad_url} (attachments: {self.attachment_url_scheme or 'unknown'})"
+
+
+class ConversationState(models.Model):
+    """Ticket wizard step of a Telegram user, shared by all worker processes"""
+    telegram_id = models.BigIntegerField()
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE)
+    step = models.CharField(max_length=50)
+    data = models.JSONField(default=dict)
+    version = models.IntegerField(default=1)  # bumped on every step, for compare-and-set
+    expires_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['telegram_id', 'bot']
+
+    def __str__(self):
+        return f"{self.bot.name}: {self.telegram_id} at {self.step} (v{self.version})"
+
+
+class TicketCreation(models.Model):
+    """Ticket creation of one wizard session, recorded before Zammad is called.
+
+    The key is also set as a tag on the Zammad ticket, so after a timeout or
+    a crash the ticket can be found in Zammad instead of being created twice.
+    A request whose outcome is unknown leaves the creation 'uncertain': until
+    TICKET_CREATION_GRACE seconds after uncertain_since it is only looked up.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('creating', 'Creating'),
+        ('uncertain', 'Uncertain (looking up)'),
+        ('created', 'Created'),
+    ]
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    bot = models.ForeignKey(TelegramBot, on_delete=models.CASCADE)
+    telegram_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    zammad_ticket_id = models.IntegerField(null=True, blank=True)
+    zammad_ticket_number = models.CharField(max_length=50, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    uncertain_since = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['bot', 'telegram_id', 'status'])]
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
@@ -0,0 +1,155 @@
+"""Background download of photo answers while the user is still answering.
+
+Each photo answer is downloaded from Telegram as soon as it arrives, into
+a size-bounded directory of temp files. When the last question is answered
+the ticket is created with the photos taken from there, so the user does
+not wait for the downloads at the end. The directory is shared by the
+worker processes of a node, so it does not matter which worker handled the
+photo. A photo that is not there (store full, download failed, another
+node) is downloaded when the ticket is created.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .metrics import registry
+from .shared_state import ensure_private_directory
+from .telegram_files import iter_telegram_file
+
+
+prefetch_counter = registry.counter(
+    'photo_prefetch_total', 'Photo answers by prefetch outcome (hit, miss, skipped, failed)'
+)
+
+
+class PhotoPrefetcher:
+    """Downloads photo answers in the background into a bounded temp file store"""
+
+    # How long take() waits for a download still running (here or in another worker)
+    WAIT_SECONDS = 30
+
+    def __init__(self, workers=None, directory=None, max_bytes=None, ttl=None):
+        self.workers = workers if workers is not None else settings.PHOTO_PREFETCH_WORKERS
+        self.directory = directory or settings.PHOTO_PREFETCH_DIR or os.path.join(
+            tempfile.gettempdir(), 'zammad_tg_bot_photos'
+        )
+        self.max_bytes = max_bytes if max_bytes is not None else settings.PHOTO_PREFETCH_MAX_BYTES
+        self.ttl = ttl if ttl is not None else settings.PHOTO_PREFETCH_TTL
+        self._executor = None
+        self._downloads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='photo-prefetch')
+        return self._executor
+
+    def get_path(self, file_id):
+        return os.path.join(self.directory, hashlib.sha256(file_id.encode()).hexdigest() + '.jpg')
+
+    def ensure_directory(self):
+        """Create the store readable by this user only; refuse a directory someone else owns"""
+        ensure_private_directory(self.directory)
+
+    def get_stored_bytes(self):
+        """Size of the stored photos, after deleting expired ones"""
+        total = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.ttl:
+                    os.unlink(entry.path)
+                else:
+                    total += stat.st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def prefetch(self, bot, file_id, file_size=None):
+        """Start downloading a photo answer unless the store is full"""
+        if not self.enabled:
+            return
+        size = file_size or 0
+        if size > settings.ATTACHMENT_MAX_BYTES or self.get_stored_bytes() + size > self.max_bytes:
+            prefetch_counter.inc(result='skipped')
+            return
+        executor = self.executor
+        with self._lock:
+            if file_id in self._downloads:
+                return
+            self._downloads[file_id] = executor.submit(self.download, bot, file_id)
+
+    def download(self, bot, file_id):
+        path = self.get_path(file_id)
+        partial_path = None
+        try:
+            self.ensure_directory()
+            # A file of our own (mode 0600), even when another worker downloads the same photo
+            descriptor, partial_path = tempfile.mkstemp(
+                dir=self.directory, prefix=os.path.basename(path) + '.', suffix='.part'
+            )
+            with os.fdopen(descriptor, 'wb') as partial_file:
+                for chunk in iter_telegram_file(bot, file_id):
+                    partial_file.write(chunk)
+            # Readers only ever see complete files
+            os.replace(partial_path, path)
+        except Exception as e:
+            prefetch_counter.inc(result='failed')
+            print(f"Error prefetching photo {file_id}: {e}")
+            if partial_path:
+                try:
+                    os.unlink(partial_path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            with self._lock:
+                self._downloads.pop(file_id, None)
+
+    def take(self, file_id):
+        """Return the downloaded photo and remove it from the store, or None if it is not there"""
+        if not self.enabled:
+            return None
+        path = self.get_path(file_id)
+        with self._lock:
+            download = self._downloads.get(file_id)
+        if download is not None:
+            try:
+                download.exception(timeout=self.WAIT_SECONDS)
+            except TimeoutError:
+                pass
+        else:
+            # Maybe another worker process is still writing it
+            deadline = time.monotonic() + self.WAIT_SECONDS
+            while glob.glob(f"{path}.*.part") and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+        try:
+            with open(path, 'rb') as photo_file:
+                content = photo_file.read()
+            os.unlink(path)
+        except FileNotFoundError:
+            prefetch_counter.inc(result='miss')
+            return None
+        prefetch_counter.inc(result='hit')
+        return content
+
+
+photo_prefetcher = PhotoPrefetcher()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+from django.conf import settings
+
+from .metrics import registry
+from .models import Question
+
+
+snapshot_builds_counter = registry.counter(
+    'questionnaire_snapshot_builds_total', 'Questionnaire snapshots loaded from the database'
+)
+
+
+class QuestionSnapshot:
+    """Read-only copy of an active Question with all its translations"""
+
+    __slots__ = ('id', 'order', 'question_type', 'texts', 'fallback_text')
+
+    def __init__(self, question):
+        self.id = question.id
+        self.order = question.order
+        self.question_type = question.question_type
+        self.texts = MappingProxyType({t.language: t.text for t in question.translations.all()})
+        self.fallback_text = question.question_text
+
+    def get_text(self, language='ky'):
+        """Same fallbacks as Question.get_text(), without queries"""
+        # A translation is used even if its text is empty, like Question.get_text() does
+        if language in self.texts:
+            return self.texts[language]
+        if 'ky' in self.texts:
+            return self.texts['ky']
+        return self.fallback_text if self.fallback_text else "Question text not available"
+
+
+class Questionnaire:
+    """Ordered, immutable set of the active questions.
+
+    `version` is a hash of the content, so every process that loaded the
+    same questions agrees on it.
+    """
+
+    def __init__(self, questions):
+        self.questions = tuple(questions)
+        content = [(q.id, q.order, q.question_type, dict(q.texts), q.fallback_text) for q in self.questions]
+        self.version = hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()[:12]
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __getitem__(self, index):
+        return self.questions[index]
+
+
+class QuestionnaireCache:
+    """Current questionnaire snapshot of this process.
+
+    Saving a Question or QuestionTranslation drops it (see signals.py);
+    other processes reload theirs after QUESTIONNAIRE_REFRESH seconds. The
+    last few snapshots are kept by version so a user who started answering
+    keeps the questions they started with; a worker that never saw that
+    version rebuilds it from the question ids kept in the wizard state.
+    """
+
+    def __init__(self, max_age=None, keep_versions=4):
+        self.max_age = max_age if max_age is not None else settings.QUESTIONNAIRE_REFRESH
+        self.keep_versions = keep_versions
+        self._current = None
+        self._loaded_at = 0.0
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        questions = Question.objects.filter(is_active=True).order_by('order').prefetch_related('translations')
+        snapshot_builds_counter.inc()
+        return Questionnaire(QuestionSnapshot(question) for question in questions)
+
+    def load_questions(self, question_ids):
+        """The questions with these ids in this order, active or not (None if one was deleted)"""
+        questions = Question.objects.filter(id__in=question_ids).prefetch_related('translations').in_bulk()
+        if any(question_id not in questions for question_id in question_ids):
+            return None
+        snapshot_builds_counter.inc()
+        return Questionnaire(QuestionSnapshot(questions[question_id]) for question_id in question_ids)
+
+    def keep(self, version, questionnaire):
+        """Remember a snapshot under `version` (call with the lock held)"""
+        self._versions.pop(version, None)
+        self._versions[version] = questionnaire
+        while len(self._versions) > self.keep_versions:
+            self._versions.popitem(last=False)
+
+    def current(self):
+        """The active questionnaire (loaded from the database when missing or too old)"""
+        questionnaire = self._current
+        if questionnaire is not None and time.monotonic() - self._loaded_at < self.max_age:
+            return questionnaire
+
+        questionnaire = self.load()
+        with self._lock:
+            self._current = questionnaire
+            self._loaded_at = time.monotonic()
+            self.keep(questionnaire.version, questionnaire)
+        return questionnaire
+
+    def get(self, version, question_ids=None):
+        """The questionnaire a user started with, or the current one if it can't be rebuilt"""
+        if version is not None:
+            with self._lock:
+                questionnaire = self._versions.get(version)
+            if questionnaire is not None:
+                return questionnaire
+            if question_ids:
+                # Started on another worker or before a reload: same questions, as they are now
+                questionnaire = self.load_questions(question_ids)
+                if questionnaire is not None:
+                    with self._lock:
+                        self.keep(version, questionnaire)
+                    return questionnaire
+        return self.current()
+
+    def invalidate(self):
+        with self._lock:
+            self._current = None
+
+
+questionnaire_cache = QuestionnaireCache()
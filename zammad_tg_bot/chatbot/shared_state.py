@@ -0,0 +1,86 @@
+"""Small JSON state shared by the threads of a process and, through a lock file, the processes of a node."""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the state is only shared between threads
+    fcntl = None
+
+
+def ensure_private_directory(directory):
+    """Create `directory` readable by this user only; refuse a directory someone else owns"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.stat(directory)
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        raise PermissionError(f"{directory} belongs to another user")
+    if stat.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def get_private_state_dir():
+    """Default directory of the state files: private to this user in the temp directory (None if unusable)"""
+    suffix = f"-{os.getuid()}" if hasattr(os, 'getuid') else ''
+    directory = os.path.join(tempfile.gettempdir(), f"zammad_tg_bot{suffix}")
+    try:
+        ensure_private_directory(directory)
+    except OSError as e:
+        print(f"Can't use {directory} for shared state ({e}), limits are kept per process")
+        return None
+    return directory
+
+
+class SharedState:
+    """A dict kept in `path` under an flock (in memory without a path, without fcntl or if the file can't be opened)"""
+
+    def __init__(self, path, new_state):
+        self.path = path if fcntl else None
+        self.new_state = new_state
+        self._state = new_state()
+        self._lock = threading.Lock()
+
+    @property
+    def is_shared(self):
+        return bool(self.path)
+
+    def open_state_file(self):
+        """The state file, opened without following a symlink and only if this user owns it"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        if os.fstat(fd).st_uid != os.getuid():
+            os.close(fd)
+            raise PermissionError(f"{self.path} belongs to another user")
+        return os.fdopen(fd, 'r+')
+
+    @contextmanager
+    def locked(self):
+        """The state, locked against other threads and processes for the block and saved after it"""
+        with self._lock:
+            state_file = None
+            if self.path:
+                try:
+                    state_file = self.open_state_file()
+                except OSError as e:
+                    print(f"Can't open {self.path} ({e}), the state is kept in this process only")
+                    self.path = None
+            if state_file is None:
+                yield self._state
+                return
+
+            with state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    try:
+                        state = json.loads(state_file.read())
+                    except ValueError:
+                        state = self.new_state()
+                    yield state
+                    state_file.seek(0)
+                    state_file.truncate()
+                    state_file.write(json.dumps(state))
+                    state_file.flush()
+                finally:
+                    fcntl.flock(state_file, fcntl.LOCK_UN)
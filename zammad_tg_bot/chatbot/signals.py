@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .bot_registry import bot_registry
+from .models import TelegramBot, ZammadGroup, ZammadCustomerUser, Question, QuestionTranslation
+from .questionnaire import questionnaire_cache
+from .zammad_users import zammad_user_cache
+
+
+@receiver(post_save, sender=TelegramBot)
+@receiver(post_delete, sender=TelegramBot)
+def invalidate_bot_on_change(sender, instance, **kwargs):
+    """Drop the cached bot when it is edited or deleted in the admin"""
+    bot_registry.invalidate(instance.id)
+
+
+@receiver(post_save, sender=ZammadGroup)
+@receiver(post_delete, sender=ZammadGroup)
+def invalidate_bot_on_config_change(sender, instance, **kwargs):
+    """Drop the cached bot when its Zammad configuration changes"""
+    bot_registry.invalidate(instance.telegram_bot_id)
+
+
+@receiver(post_save, sender=ZammadCustomerUser)
+@receiver(post_delete, sender=ZammadCustomerUser)
+def forget_customer_user_on_change(sender, instance, **kwargs):
+    """Re-read a customer's Zammad user after it is edited or deleted in the admin"""
+    zammad_user_cache.forget(instance.email)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=QuestionTranslation)
+@receiver(post_delete, sender=QuestionTranslation)
+def invalidate_questionnaire_on_change(sender, instance, **kwargs):
+    """Reload the questionnaire after questions or their translations change"""
+    questionnaire_cache.invalidate()
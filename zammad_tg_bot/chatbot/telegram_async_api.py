@@ -0,0 +1,132 @@
+import asyncio
+import json
+import weakref
+
+import aiohttp
+from django.conf import settings
+
+from .telegram_files import DOWNLOAD_CHUNK_SIZE
+from .telegram_sender import SEND_METHODS, await_send_slot, telegram_send_limiter
+
+
+class TelegramApiError(Exception):
+    """Telegram Bot API returned ok=false"""
+
+    def __init__(self, description, retry_after=None):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+
+class AsyncTelegramClient:
+    """Minimal non-blocking Telegram Bot API client used by the async views"""
+
+    # aiohttp sessions belong to the event loop that created them, so keep one pooled session per loop
+    _sessions = weakref.WeakKeyDictionary()
+
+    def __init__(self, token):
+        self.token = token
+        self.base_url = f"{settings.TELEGRAM_API_URL}/bot{token}"
+
+    @property
+    def session(self):
+        loop = asyncio.get_running_loop()
+        session = AsyncTelegramClient._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=settings.TELEGRAM_CON_POOL_SIZE)
+            session = aiohttp.ClientSession(connector=connector)
+            AsyncTelegramClient._sessions[loop] = session
+        return session
+
+    @classmethod
+    async def close_sessions(cls):
+        """Close the session of the running event loop (e.g. before the loop shuts down)"""
+        session = cls._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def call(self, method, data=None, files=None, timeout=30):
+        """Call a Bot API method and return its `result`; sends are paced like RateLimitedBot's"""
+        if method not in SEND_METHODS:
+            return await self.post(method, data, files, timeout)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            await await_send_slot(self.token, method, {**(data or {}), **(files or {})})
+            try:
+                return await self.post(method, data, files, timeout)
+            except TelegramApiError as e:
+                if e.retry_after is None or attempt > settings.TELEGRAM_SEND_RETRIES:
+                    raise
+                print(f"Telegram flood control: retrying {method} in {e.retry_after}s")
+                await asyncio.to_thread(telegram_send_limiter.get(self.token).pause, e.retry_after)
+
+    async def post(self, method, data=None, files=None, timeout=30):
+        """Post one Bot API request and return its `result`"""
+        url = f"{self.base_url}/{method}"
+        if files:
+            form = aiohttp.FormData()
+            for name, value in (data or {}).items():
+                form.add_field(name, str(value))
+            for name, (filename, content) in files.items():
+                form.add_field(name, content, filename=filename)
+            request_kwargs = {'data': form}
+        else:
+            request_kwargs = {'json': data}
+
+        async with self.session.post(url, timeout=aiohttp.ClientTimeout(total=timeout), **request_kwargs) as response:
+            status = response.status
+            body = await response.read()
+
+        result = json.loads(body)
+        if not result.get('ok'):
+            retry_after = result.get('parameters', {}).get('retry_after')
+            raise TelegramApiError(result.get('description', f"HTTP {status}"), retry_after)
+        return result.get('result')
+
+    async def iter_file(self, file_id, chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=60):
+        """Async version of telegram_files.iter_telegram_file(): an async iterator over the file's chunks.
+
+        getFile runs right away, so Telegram errors surface here; the
+        download itself starts when the iterator is first consumed.
+        """
+        telegram_file = await self.call('getFile', {'file_id': file_id})
+        url = f"{settings.TELEGRAM_API_URL}/file/bot{self.token}/{telegram_file['file_path']}"
+
+        async def chunks():
+            async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+
+        return chunks()
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        data = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        if reply_markup is not None:
+            data['reply_markup'] = reply_markup.to_dict() if hasattr(reply_markup, 'to_dict') else reply_markup
+        return await self.call('sendMessage', data)
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        data = {'chat_id': chat_id}
+        if caption:
+            data['caption'] = caption
+        return await self.call('sendPhoto', data, files={'photo': ('photo.jpg', bytes(photo))})
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        data = {'chat_id': chat_id}
+        if caption:
+            data['caption'] = caption
+        return await self.call('sendDocument', data, files={'document': (filename or 'file', bytes(document))})
+
+    async def send_media_group(self, chat_id, photos):
+        """Send (filename, content, caption) photos as one album"""
+        media = []
+        files = {}
+        for index, (filename, content, caption) in enumerate(photos):
+            name = f"photo{index}"
+            media.append({'type': 'photo', 'media': f"attach://{name}", 'caption': caption})
+            files[name] = (filename, bytes(content))
+        return await self.call('sendMediaGroup', {'chat_id': chat_id, 'media': json.dumps(media)}, files=files)
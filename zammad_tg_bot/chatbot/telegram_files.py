@@ -0,0 +1,23 @@
+import requests
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Plain keep-alive session for file downloads; telegram.Bot only offers whole-file downloads
+_session = requests.Session()
+
+
+def iter_telegram_file(bot, file_id, chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=60):
+    """Return an iterator over a Telegram file's content, downloaded chunk by chunk.
+
+    get_file() runs right away, so Telegram errors surface here; the
+    download itself starts when the iterator is first consumed.
+    """
+    telegram_file = bot.get_file(file_id)
+
+    def chunks():
+        with _session.get(telegram_file.file_path, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+
+    return chunks()
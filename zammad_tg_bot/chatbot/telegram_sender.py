@@ -0,0 +1,237 @@
+"""Pacing of outgoing Telegram messages within the Bot API limits.
+
+Telegram allows a bot about 30 messages per second overall, about one per
+second in a private chat and 20 per minute in a group; bursts above that
+are answered with 429 and a retry_after. Every send of a bot reserves the
+next free slot of its chat, then a second with room left in the bot's
+budget, and waits for it, so bursts (agent replies with attachments, closure notifications) are
+spread out instead of rejected. A send whose slot is more than
+TELEGRAM_SEND_MAX_WAIT seconds away is not queued: SendSlotTimeout is
+raised instead of sleeping in the request thread, so the update fails
+(and is retried by the update queue) rather than holding a worker. A 429
+holds back all sends of the bot for retry_after seconds and the message
+is sent again.
+
+Schedules are kept per bot token in a lock file shared by the processes
+of the node (TELEGRAM_SEND_STATE_DIR).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+import telegram
+from telegram.error import RetryAfter
+from telegram.utils.helpers import DEFAULT_NONE
+
+from .metrics import registry
+from .shared_state import SharedState, get_private_state_dir
+
+
+# Bot API methods that post a message into a chat
+SEND_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'sendVideo', 'sendAudio',
+    'sendVoice', 'sendAnimation', 'sendSticker', 'sendLocation', 'sendContact', 'sendPoll',
+    'forwardMessage', 'copyMessage',
+})
+
+send_wait_histogram = registry.histogram(
+    'telegram_send_wait_seconds', 'Time outgoing Telegram messages waited for a free send slot'
+)
+send_timeout_counter = registry.counter(
+    'telegram_send_timeouts_total', 'Sends given up because no slot was free within TELEGRAM_SEND_MAX_WAIT'
+)
+telegram_rate_limited_counter = registry.counter(
+    'telegram_rate_limited_total', 'Telegram 429 answers (flood control) to sent messages'
+)
+
+
+class SendSlotTimeout(RetryAfter):
+    """No send slot within TELEGRAM_SEND_MAX_WAIT seconds; the message was not sent"""
+
+
+class SendSlots:
+    """Evenly spaced send slots (`rate` per second) allowing bursts of `burst` messages"""
+
+    def __init__(self, rate, burst=1, next_slot=0.0):
+        self.interval = 1 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.next_slot = next_slot
+
+    def reserve(self, earliest, weight=1):
+        """Time at which `weight` messages may go out, not before `earliest`"""
+        send_at = max(earliest, self.next_slot - self.tolerance)
+        self.next_slot = max(self.next_slot, send_at) + self.interval * weight
+        return send_at
+
+
+def is_group_chat(chat_id):
+    """Groups, supergroups and channels have negative ids (or an @username)"""
+    try:
+        return int(chat_id) < 0
+    except (TypeError, ValueError):
+        return True
+
+
+def get_state_file(token):
+    """Schedule file of a bot, shared by the processes of the node"""
+    directory = settings.TELEGRAM_SEND_STATE_DIR or get_private_state_dir()
+    if not directory:
+        return None
+    bot_key = hashlib.sha256(token.encode()).hexdigest()[:16]
+    return os.path.join(directory, f"zammad_tg_bot_telegram_{bot_key}.json")
+
+
+class BotSendSchedule:
+    """Send slots of one bot: one for the bot as a whole and one per chat.
+
+    The next free slots are kept in the bot's state file, so all processes
+    of the node send within the same limits.
+    """
+
+    # Forget chats without pending sends once this many are tracked
+    PRUNE_THRESHOLD = 1000
+
+    def __init__(self, state_file=None):
+        self._shared = SharedState(state_file, self.new_state)
+
+    @staticmethod
+    def new_state():
+        # 'seconds': messages of the bot per wall clock second, 'chats': next free slot per chat
+        return {'seconds': {}, 'chats': {}, 'paused_until': 0.0}
+
+    def new_chat_slots(self, chat_id, next_slot):
+        if is_group_chat(chat_id):
+            return SendSlots(settings.TELEGRAM_GROUP_SEND_PER_MINUTE / 60, next_slot=next_slot)
+        return SendSlots(settings.TELEGRAM_CHAT_SEND_RATE, settings.TELEGRAM_CHAT_SEND_BURST, next_slot)
+
+    def find_bot_second(self, seconds, send_at, weight):
+        """First second from `send_at` on with room for `weight` more messages of the bot.
+
+        Counted per second rather than as one queue, so a message that
+        waits for its chat doesn't hold back the messages of other chats.
+        """
+        limit = max(1, int(settings.TELEGRAM_SEND_RATE))
+        second = int(send_at)
+        while 0 < seconds.get(str(second), 0) and seconds[str(second)] + weight > limit:
+            second += 1
+        return second
+
+    def reserve(self, chat_id, weight=1, max_wait=None):
+        """Seconds to wait before sending `weight` messages to `chat_id`.
+
+        Raises SendSlotTimeout, without taking the slot, if that is more than `max_wait`.
+        """
+        now = time.time()
+        with self._shared.locked() as state:
+            state['seconds'] = {key: count for key, count in state['seconds'].items() if int(key) >= int(now)}
+            chats = state['chats']
+            if len(chats) > self.PRUNE_THRESHOLD:
+                state['chats'] = chats = {key: slot for key, slot in chats.items() if slot > now}
+            key = str(chat_id)
+            chat_slots = self.new_chat_slots(chat_id, chats.get(key, 0.0))
+
+            send_at = chat_slots.reserve(max(now, state['paused_until']), weight)
+            second = self.find_bot_second(state['seconds'], send_at, weight)
+            send_at = max(send_at, second)
+            if max_wait is not None and send_at - now > max_wait:
+                raise SendSlotTimeout(send_at - now)
+            state['seconds'][str(second)] = state['seconds'].get(str(second), 0) + weight
+            chats[key] = chat_slots.next_slot
+        return send_at - now
+
+    def pause(self, seconds):
+        """Hold back every send of the bot (Telegram answered 429)"""
+        telegram_rate_limited_counter.inc()
+        with self._shared.locked() as state:
+            state['paused_until'] = max(state['paused_until'], time.time() + seconds)
+
+
+class TelegramSendLimiter:
+    """Send schedules by bot token"""
+
+    def __init__(self):
+        self._schedules = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        schedule = self._schedules.get(token)
+        if schedule is None:
+            with self._lock:
+                schedule = self._schedules.get(token)
+                if schedule is None:
+                    schedule = self._schedules[token] = BotSendSchedule(get_state_file(token))
+        return schedule
+
+    def clear(self):
+        with self._lock:
+            self._schedules.clear()
+
+
+telegram_send_limiter = TelegramSendLimiter()
+
+
+def get_send_weight(method, data):
+    """Messages a call posts (an album counts once per item)"""
+    if method == 'sendMediaGroup':
+        media = data.get('media') or ()
+        if isinstance(media, str):
+            # Multipart uploads send the album as JSON
+            media = json.loads(media)
+        return max(1, len(media))
+    return 1
+
+
+def reserve_send_slot(token, method, data):
+    """Seconds until the send may go out (SendSlotTimeout past TELEGRAM_SEND_MAX_WAIT)"""
+    try:
+        return telegram_send_limiter.get(token).reserve(
+            data.get('chat_id'), get_send_weight(method, data), settings.TELEGRAM_SEND_MAX_WAIT
+        )
+    except SendSlotTimeout as e:
+        send_timeout_counter.inc()
+        print(f"No Telegram send slot for {method} within {settings.TELEGRAM_SEND_MAX_WAIT}s "
+              f"(next in {e.retry_after:.0f}s), giving up")
+        raise
+
+
+def wait_for_send_slot(token, method, data):
+    """Block until the send may go out"""
+    delay = reserve_send_slot(token, method, data)
+    if delay > 0:
+        time.sleep(delay)
+    send_wait_histogram.observe(max(0.0, delay))
+
+
+async def await_send_slot(token, method, data):
+    """wait_for_send_slot() without blocking the event loop"""
+    # The schedule is behind a thread lock and a file lock
+    delay = await asyncio.to_thread(reserve_send_slot, token, method, data)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    send_wait_histogram.observe(max(0.0, delay))
+
+
+class RateLimitedBot(telegram.Bot):
+    """telegram.Bot whose sends go through the bot's send schedule and are retried after flood control"""
+
+    def _post(self, endpoint, data=None, timeout=DEFAULT_NONE, api_kwargs=None):
+        if endpoint not in SEND_METHODS:
+            return super()._post(endpoint, data, timeout=timeout, api_kwargs=api_kwargs)
+
+        slot_data = {**(data or {}), **(api_kwargs or {})}
+        attempt = 0
+        while True:
+            attempt += 1
+            wait_for_send_slot(self.token, endpoint, slot_data)
+            try:
+                return super()._post(endpoint, data, timeout=timeout, api_kwargs=api_kwargs)
+            except RetryAfter as e:
+                if attempt > settings.TELEGRAM_SEND_RETRIES:
+                    raise
+                bot_id = self.token.split(':')[0]
+                print(f"Telegram flood control for bot {bot_id}: retrying {endpoint} in {e.retry_after}s")
+                telegram_send_limiter.get(self.token).pause(e.retry_after)
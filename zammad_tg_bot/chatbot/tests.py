@@ -1,3 +1,382 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import zammad_api, zammad_outbox
+from .conversation_state import DatabaseConversationStore, SQLiteConversationStore
+from .dedup import UpdateDeduplicator
+from .models import ConversationState, PendingZammadWrite, ProcessedUpdate, TelegramBot
+from .zammad_circuit import CircuitBreaker, ZammadUnavailableError
+from .zammad_rate_limit import RateLimiter
+
+
+class ConversationStoreTests:
+    """Shared by the tests of both conversation state backends; make_store() returns the store"""
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_start_and_get(self):
+        version = self.store.start(1, 1, 'customer_number', {'language': 'en'}, ttl=60)
+        self.assertEqual(version, 1)
+        self.assertEqual(self.store.get(1, 1), {'language': 'en', 'step': 'customer_number', 'version': 1})
+        self.assertIsNone(self.store.get(1, 2))
+
+    def test_advance_bumps_version(self):
+        version = self.store.start(1, 1, 'customer_number', {}, ttl=60)
+        self.assertTrue(self.store.advance(1, 1, version, 'issue_type', {'customer_number': '42'}, ttl=60))
+        self.assertEqual(self.store.get(1, 1), {'customer_number': '42', 'step': 'issue_type', 'version': 2})
+
+    def test_advance_with_stale_version_is_refused(self):
+        version = self.store.start(1, 1, 'customer_number', {}, ttl=60)
+        self.assertTrue(self.store.advance(1, 1, version, 'issue_type', {'customer_number': '42'}, ttl=60))
+        # A second worker still holding the first version must not overwrite the answer
+        self.assertFalse(self.store.advance(1, 1, version, 'issue_type', {'customer_number': '43'}, ttl=60))
+        self.assertEqual(self.store.get(1, 1)['customer_number'], '42')
+
+    def test_restart_keeps_version_growing(self):
+        first = self.store.start(1, 1, 'customer_number', {}, ttl=60)
+        self.store.advance(1, 1, first, 'issue_type', {}, ttl=60)
+        second = self.store.start(1, 1, 'customer_number', {}, ttl=60)
+        self.assertEqual(second, 3)
+        # A step of the previous wizard can't match the new one
+        self.assertFalse(self.store.advance(1, 1, first, 'issue_type', {}, ttl=60))
+
+    def test_finish_only_at_current_version(self):
+        version = self.store.start(1, 1, 'customer_number', {}, ttl=60)
+        self.assertFalse(self.store.finish(1, 1, version + 1))
+        self.assertTrue(self.store.finish(1, 1, version))
+        self.assertIsNone(self.store.get(1, 1))
+        self.assertFalse(self.store.finish(1, 1))
+
+    def test_expired_state(self):
+        version = self.store.start(1, 1, 'customer_number', {}, ttl=0)
+        self.assertIsNone(self.store.get(1, 1))
+        self.assertFalse(self.store.advance(1, 1, version, 'issue_type', {}, ttl=60))
+        self.assertFalse(self.store.finish(1, 1, version))
+        # Starting over works on top of the expired row
+        self.assertEqual(self.store.start(1, 1, 'customer_number', {}, ttl=60), version + 1)
+
+    def test_purge_expired(self):
+        self.store.start(1, 1, 'customer_number', {}, ttl=0)
+        self.store.start(2, 1, 'customer_number', {}, ttl=60)
+        self.store.purge_expired()
+        self.assertFalse(self.store.finish(1, 1))
+        self.assertIsNotNone(self.store.get(2, 1))
+
+
+class DatabaseConversationStoreTests(ConversationStoreTests, TestCase):
+
+    def make_store(self):
+        return DatabaseConversationStore()
+
+    def test_purge_deletes_rows(self):
+        self.store.start(1, 1, 'customer_number', {}, ttl=0)
+        self.store.purge_expired()
+        self.assertFalse(ConversationState.objects.exists())
+
+
+class SQLiteConversationStoreTests(ConversationStoreTests, TestCase):
+
+    def make_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteConversationStore(os.path.join(directory.name, 'state.sqlite3'))
+
+
+@override_settings(ZAMMAD_NOTE_COALESCE_SECONDS=60, ZAMMAD_OUTBOX_RETRY_DELAY=15, ZAMMAD_OUTBOX_MAX_ATTEMPTS=3)
+class ZammadOutboxTests(TestCase):
+
+    def setUp(self):
+        self.bot = TelegramBot.objects.create(name='test', token='1:test')
+
+    def make_due(self, *writes):
+        PendingZammadWrite.objects.filter(id__in=[write.id for write in writes]).update(
+            next_attempt_at=timezone.now()
+        )
+
+    def test_only_the_head_of_a_ticket_is_claimed(self):
+        first = zammad_outbox.enqueue_close(self.bot, 1, 'User')
+        PendingZammadWrite.objects.filter(id=first.id).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+        zammad_outbox.enqueue_close(self.bot, 1, 'User')
+        other = zammad_outbox.enqueue_close(self.bot, 2, 'User')
+
+        # Ticket 1 waits for its head's retry time even though the later write is due
+        self.assertEqual(zammad_outbox.claim_due_writes(10), [other])
+
+    def test_processing_head_blocks_its_ticket(self):
+        first = zammad_outbox.enqueue_close(self.bot, 1, 'User')
+        zammad_outbox.enqueue_close(self.bot, 1, 'User')
+        self.assertEqual(zammad_outbox.claim_due_writes(10), [first])
+        self.assertEqual(zammad_outbox.claim_due_writes(10), [])
+
+    def test_burst_claim_stops_at_other_actions(self):
+        head = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'one')
+        second = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'two')
+        third = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'three')
+        zammad_outbox.enqueue_attachment(self.bot, 1, 'User', 'file-id', 'photo.jpg')
+        zammad_outbox.enqueue_note(self.bot, 1, 'User', 'four')
+        self.make_due(head)
+
+        [claimed] = zammad_outbox.claim_due_writes(10)
+        self.assertEqual(claimed, head)
+        self.assertEqual(zammad_outbox.claim_note_burst(claimed), [second, third])
+        self.assertEqual(
+            set(PendingZammadWrite.objects.filter(status='processing').values_list('id', flat=True)),
+            {head.id, second.id, third.id},
+        )
+
+    def test_failed_burst_is_released(self):
+        head = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'one')
+        second = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'two')
+        self.make_due(head)
+        [claimed] = zammad_outbox.claim_due_writes(10)
+
+        with mock.patch.object(zammad_api, 'add_note_to_ticket', return_value=False):
+            zammad_outbox.process_write(claimed)
+
+        head.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((head.status, head.attempts), ('pending', 1))
+        self.assertGreater(head.next_attempt_at, timezone.now())
+        self.assertEqual((second.status, second.attempts), ('pending', 0))
+
+    def test_sent_burst_is_one_article(self):
+        head = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'one')
+        second = zammad_outbox.enqueue_note(self.bot, 1, 'User', 'two')
+        self.make_due(head)
+        [claimed] = zammad_outbox.claim_due_writes(10)
+
+        with mock.patch.object(zammad_api, 'add_note_to_ticket', return_value=True) as add_note:
+            zammad_outbox.process_write(claimed)
+
+        add_note.assert_called_once()
+        body = add_note.call_args.args[2]
+        self.assertIn('one', body)
+        self.assertIn('two', body)
+        self.assertEqual(set(PendingZammadWrite.objects.values_list('status', flat=True)), {'done'})
+        second.refresh_from_db()
+        self.assertEqual(second.attempts, 1)
+
+    def test_last_attempt_becomes_dead_letter(self):
+        write = zammad_outbox.enqueue_close(self.bot, 1, 'User')
+        with mock.patch.object(zammad_api, 'close_zammad_ticket', return_value=False):
+            for _attempt in range(3):
+                self.make_due(write)
+                [claimed] = zammad_outbox.claim_due_writes(10)
+                zammad_outbox.process_write(claimed)
+
+        write.refresh_from_db()
+        self.assertEqual((write.status, write.attempts), ('dead', 3))
+        self.assertEqual(zammad_outbox.claim_due_writes(10), [])
+
+    def test_note_burst_open(self):
+        self.assertFalse(zammad_outbox.is_note_burst_open(1))
+        zammad_outbox.enqueue_note(self.bot, 1, 'User', 'one')
+        self.assertTrue(zammad_outbox.is_note_burst_open(1))
+        zammad_outbox.enqueue_attachment(self.bot, 1, 'User', 'file-id', 'photo.jpg')
+        self.assertFalse(zammad_outbox.is_note_burst_open(1))
+
+
+class UpdateDeduplicatorTests(TestCase):
+
+    def setUp(self):
+        self.bot = TelegramBot.objects.create(name='test', token='1:test')
+        self.deduplicator = UpdateDeduplicator(ttl=60, max_entries=3, prune_every=1000)
+
+    def test_repeated_update_is_duplicate(self):
+        self.assertFalse(self.deduplicator.is_duplicate(self.bot, 1))
+        self.assertTrue(self.deduplicator.is_duplicate(self.bot, 1))
+        self.assertTrue(self.deduplicator.is_duplicate(self.bot, 1))
+        self.assertFalse(self.deduplicator.is_duplicate(self.bot, 2))
+        self.assertEqual(self.deduplicator.suppressed_count(self.bot), 2)
+
+    def test_update_is_accepted_again_after_ttl(self):
+        self.deduplicator.is_duplicate(self.bot, 1)
+        self.deduplicator.is_duplicate(self.bot, 1)
+        ProcessedUpdate.objects.update(first_seen_at=timezone.now() - timedelta(seconds=61))
+
+        self.assertFalse(self.deduplicator.is_duplicate(self.bot, 1))
+        # The window starts over from the redelivery
+        self.assertEqual(self.deduplicator.suppressed_count(self.bot), 0)
+        self.assertTrue(self.deduplicator.is_duplicate(self.bot, 1))
+
+    def test_disabled_without_ttl(self):
+        deduplicator = UpdateDeduplicator(ttl=0)
+        self.assertFalse(deduplicator.is_duplicate(self.bot, 1))
+        self.assertFalse(deduplicator.is_duplicate(self.bot, 1))
+        self.assertFalse(ProcessedUpdate.objects.exists())
+
+    def test_prune_drops_expired_and_oldest_rows(self):
+        for update_id in range(1, 6):
+            self.deduplicator.is_duplicate(self.bot, update_id)
+        ProcessedUpdate.objects.filter(update_id=5).update(first_seen_at=timezone.now() - timedelta(seconds=61))
+
+        self.deduplicator.prune(self.bot)
+
+        self.assertEqual(sorted(ProcessedUpdate.objects.values_list('update_id', flat=True)), [2, 3, 4])
+
+    def test_prune_runs_every_n_inserts(self):
+        deduplicator = UpdateDeduplicator(ttl=60, max_entries=2, prune_every=4)
+        for update_id in range(1, 4):
+            deduplicator.is_duplicate(self.bot, update_id)
+        self.assertEqual(ProcessedUpdate.objects.count(), 3)
+        deduplicator.is_duplicate(self.bot, 4)
+        self.assertEqual(sorted(ProcessedUpdate.objects.values_list('update_id', flat=True)), [3, 4])
+
+
+class Base64EncoderTests(TestCase):
+
+    def setUp(self):
+        self.requests = zammad_api.attachment_manager
+        self.content = bytes(range(256)) * 3 + b'tail'
+
+    def encode(self, chunks):
+        return b''.join(self.requests.iter_base64(chunks))
+
+    def test_chunk_sizes_around_three_byte_groups(self):
+        expected = base64.b64encode(self.content)
+        for size in (1, 2, 3, 4, 5, 6, 7, len(self.content) - 1, len(self.content), len(self.content) + 1):
+            chunks = [self.content[start:start + size] for start in range(0, len(self.content), size)]
+            with self.subTest(size=size):
+                self.assertEqual(self.encode(chunks), expected)
+
+    def test_empty_chunks_and_content(self):
+        self.assertEqual(self.encode([b'', b'ab', b'', b'c', b'']), base64.b64encode(b'abc'))
+        self.assertEqual(self.encode([]), b'')
+        self.assertEqual(self.encode([b'']), b'')
+
+    def test_encoded_parts_have_no_padding_until_the_end(self):
+        parts = list(self.requests.iter_base64([b'a', b'bcd', b'ef', b'g']))
+        self.assertTrue(all(b'=' not in part for part in parts[:-1]))
+        self.assertEqual(b''.join(parts), base64.b64encode(b'abcdefg'))
+
+    def test_remainder_carries_over(self):
+        encoded, remainder = self.requests.encode_base64_chunk(b'a', b'bcde')
+        self.assertEqual((encoded, remainder), (base64.b64encode(b'abc'), b'de'))
+
+    def test_memoryview_chunks(self):
+        chunks = self.requests.iter_bytes_chunks(self.content)
+        self.assertEqual(self.encode(chunks), base64.b64encode(self.content))
+
+    def test_attachment_payload_is_valid_json(self):
+        chunks = [self.content[:7], self.content[7:]]
+        payload = b''.join(self.requests.iter_attachment_payload('User', 'photo.jpg', chunks, 'caption'))
+        attachment = json.loads(payload)['article']['attachments'][0]
+        self.assertEqual(attachment['filename'], 'photo.jpg')
+        self.assertEqual(base64.b64decode(attachment['data']), self.content)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('chatbot.zammad_circuit.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    def open_breaker(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.before_request()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(ZammadUnavailableError):
+            self.breaker.before_request()
+
+    def test_success_resets_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+
+    def test_half_open_lets_one_trial_through(self):
+        self.open_breaker()
+        self.now += 30
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.before_request()
+        # The other requests keep failing fast while the trial is out
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(ZammadUnavailableError):
+            self.breaker.before_request()
+
+    def test_failed_trial_keeps_it_open(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.before_request()
+        self.now += 5
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+        self.now += 29
+        with self.assertRaises(ZammadUnavailableError):
+            self.breaker.before_request()
+        self.now += 1
+        self.breaker.before_request()
+
+    def test_successful_trial_closes_it(self):
+        self.open_breaker()
+        self.now += 30
+        self.breaker.before_request()
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.before_request()
+        self.breaker.before_request()
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('chatbot.zammad_rate_limit.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Bucket of 4 tokens: background keeps 2 of them for the lanes above it, normal keeps 1
+        self.limiter = RateLimiter(rate=1, burst=4, max_wait=0)
+
+    def test_lanes_leave_reserve_to_higher_lanes(self):
+        self.assertEqual(self.limiter.try_acquire('background'), 0)
+        self.assertEqual(self.limiter.try_acquire('background'), 0)
+        self.assertGreater(self.limiter.try_acquire('background'), 0)
+        self.assertEqual(self.limiter.try_acquire('normal'), 0)
+        self.assertGreater(self.limiter.try_acquire('normal'), 0)
+        self.assertEqual(self.limiter.try_acquire('interactive'), 0)
+        self.assertEqual(self.limiter.try_acquire('interactive'), 1)
+
+    def test_wait_until_lane_has_room(self):
+        for _token in range(4):
+            self.limiter.try_acquire('interactive')
+        self.assertEqual(self.limiter.try_acquire('background'), 3)
+        self.now += 3
+        self.assertEqual(self.limiter.try_acquire('background'), 0)
+
+    def test_pause_holds_back_every_lane(self):
+        self.limiter.pause(10)
+        for lane in ('interactive', 'normal', 'background'):
+            self.assertEqual(self.limiter.try_acquire(lane), 10)
+        self.now += 10
+        # The bucket starts empty after the pause
+        self.assertEqual(self.limiter.try_acquire('interactive'), 1)
+        self.now += 1
+        self.assertEqual(self.limiter.try_acquire('interactive'), 0)
+
+    def test_acquire_gives_up_after_max_wait(self):
+        for _token in range(4):
+            self.limiter.acquire('interactive')
+        with self.assertRaises(zammad_api.ZammadRateLimitedError):
+            self.limiter.acquire('interactive')
+
+    def test_no_rate_means_no_budget(self):
+        limiter = RateLimiter(rate=0)
+        for _request in range(100):
+            self.assertEqual(limiter.try_acquire('background'), 0)
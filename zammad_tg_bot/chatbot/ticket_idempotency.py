@@ -0,0 +1,169 @@
+"""Creating each wizard's Zammad ticket at most once.
+
+Every wizard session gets an idempotency key. Before Zammad is asked to
+create the ticket, the key is recorded in TicketCreation and it is sent
+along as a ticket tag. If the same creation runs again (retry, redelivered
+update, a second worker), the ticket is looked up by its tag instead of
+being created again. A user who starts over after a failed attempt keeps
+the key of that attempt.
+
+The lookup goes through the Zammad search index, which Zammad updates in
+the background (and which needs Elasticsearch for tag searches). A failed
+request may still have created the ticket, so its creation becomes
+'uncertain': it is looked up with growing delays for TICKET_LOOKUP_WAIT
+seconds, and every later attempt only looks it up again until
+TICKET_CREATION_GRACE seconds after the failure. Only then is the ticket
+created again.
+"""
+import time
+import uuid
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import zammad_api
+from .metrics import registry
+from .models import TicketCreation
+from .zammad_circuit import zammad_breaker
+
+
+ticket_creations_counter = registry.counter(
+    'ticket_creations_total', 'Wizard ticket creations by outcome (created, found, in_progress, uncertain, failed)'
+)
+
+TAG_PREFIX = 'tg-'
+
+
+class TicketCreationInProgress(Exception):
+    """Another worker is creating the ticket for this key right now"""
+
+
+class TicketCreationUncertain(Exception):
+    """Zammad may have created the ticket, but it can't be found yet"""
+
+
+def get_tag(key):
+    return f"{TAG_PREFIX}{key}"
+
+
+def new_idempotency_key(bot_record, telegram_id):
+    """Key for a new wizard session (the key of an unconfirmed earlier attempt, if any)"""
+    TicketCreation.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=settings.TICKET_IDEMPOTENCY_TTL)
+    ).delete()
+    unconfirmed = TicketCreation.objects.filter(
+        bot=bot_record, telegram_id=telegram_id, status__in=('pending', 'uncertain'), attempts__gt=0
+    ).order_by('-id').first()
+    if unconfirmed is not None:
+        return unconfirmed.idempotency_key
+    return uuid.uuid4().hex
+
+
+def claim(creation):
+    """Mark the creation as running in this worker; False if another worker runs it"""
+    stale = timezone.now() - timedelta(seconds=settings.TICKET_CREATION_CLAIM_TIMEOUT)
+    return bool(
+        TicketCreation.objects.filter(pk=creation.pk)
+        .filter(Q(status__in=('pending', 'uncertain')) | Q(status='creating', started_at__lt=stale))
+        .update(status='creating', started_at=timezone.now(), attempts=F('attempts') + 1)
+    )
+
+
+def find_ticket(tag):
+    """The ticket carrying the tag, or None if there is none or Zammad can't be asked"""
+    try:
+        return zammad_api.find_ticket_by_tag(tag)
+    except requests.exceptions.RequestException as e:
+        print(f"Could not look up ticket {tag} in Zammad: {e}")
+        return None
+
+
+def begin_creation(bot_record, telegram_id, key):
+    """Claim the ticket creation of a wizard session before anything is sent.
+
+    Returns (creation, None) if this worker goes on to create the ticket
+    (see finish_creation), (creation, ticket data) if the session's ticket
+    exists already, or raises TicketCreationInProgress while another worker
+    creates it.
+    """
+    key = key or uuid.uuid4().hex
+    creation, _ = TicketCreation.objects.get_or_create(
+        idempotency_key=key, defaults={'bot': bot_record, 'telegram_id': telegram_id}
+    )
+    if creation.status == 'created':
+        ticket_creations_counter.inc(outcome='found')
+        return creation, {'id': creation.zammad_ticket_id, 'number': creation.zammad_ticket_number}
+    if not claim(creation):
+        ticket_creations_counter.inc(outcome='in_progress')
+        raise TicketCreationInProgress(key)
+    return creation, None
+
+
+def release(creation):
+    """Give up a claimed creation without having asked Zammad, so it can be retried at once"""
+    TicketCreation.objects.filter(pk=creation.pk, status='creating').update(status='pending', attempts=F('attempts') - 1)
+
+
+def find_ticket_with_backoff(tag):
+    """find_ticket() repeated with doubling delays (from TICKET_LOOKUP_DELAY) for up to TICKET_LOOKUP_WAIT seconds"""
+    delay = settings.TICKET_LOOKUP_DELAY
+    waited = 0.0
+    while waited + delay <= settings.TICKET_LOOKUP_WAIT and not zammad_breaker.is_open():
+        time.sleep(delay)
+        waited += delay
+        ticket_data = find_ticket(tag)
+        if ticket_data:
+            return ticket_data
+        delay *= 2
+    return None
+
+
+def is_within_grace(creation):
+    """Whether an earlier request of the creation may still have created a ticket the search doesn't show yet"""
+    grace_start = timezone.now() - timedelta(seconds=settings.TICKET_CREATION_GRACE)
+    return creation.uncertain_since is not None and creation.uncertain_since > grace_start
+
+
+def mark_uncertain(creation, since):
+    """Leave the creation to lookups until the grace period from `since` is over"""
+    TicketCreation.objects.filter(pk=creation.pk).update(status='uncertain', uncertain_since=since)
+    ticket_creations_counter.inc(outcome='uncertain')
+
+
+def finish_creation(creation, **ticket_fields):
+    """create_zammad_ticket() for a creation claimed by begin_creation().
+
+    Returns the ticket data, None if the ticket was not created, or raises
+    TicketCreationUncertain while a failed request may have created it.
+    """
+    tag = get_tag(creation.idempotency_key)
+    ticket_data = None
+    if creation.attempts:
+        # An earlier attempt may have created it without us learning about it
+        ticket_data = find_ticket(tag)
+    if not ticket_data and is_within_grace(creation):
+        # Not indexed yet, or never created: asking again could create a second ticket
+        mark_uncertain(creation, creation.uncertain_since)
+        raise TicketCreationUncertain(creation.idempotency_key)
+    if not ticket_data:
+        if zammad_breaker.is_open():
+            # The request would not be sent, so nothing can have been created
+            release(creation)
+            ticket_creations_counter.inc(outcome='failed')
+            return None
+        ticket_data = zammad_api.create_zammad_ticket(tags=[tag], **ticket_fields)
+        if not ticket_data or not ticket_data.get('id'):
+            # The request may have failed after Zammad created the ticket
+            ticket_data = find_ticket_with_backoff(tag)
+            if not ticket_data:
+                mark_uncertain(creation, timezone.now())
+                raise TicketCreationUncertain(creation.idempotency_key)
+
+    TicketCreation.objects.filter(pk=creation.pk).update(
+        status='created', zammad_ticket_id=ticket_data['id'], zammad_ticket_number=ticket_data.get('number') or ''
+    )
+    ticket_creations_counter.inc(outcome='created')
+    return ticket_data
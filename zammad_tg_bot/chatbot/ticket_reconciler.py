@@ -0,0 +1,117 @@
+import time
+from collections import defaultdict
+
+from django.utils import timezone
+
+from . import zammad_api
+from .models import OpenTicket
+from .views import ZAMMAD_OPEN_STATES, notify_ticket_closed
+
+
+class ReconcileStats:
+    """Counters of one reconciliation run"""
+
+    def __init__(self):
+        self.checked = 0
+        self.still_open = 0
+        self.closed = 0
+        self.notified = 0
+        self.skipped = 0
+        self.zammad_requests = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class TicketReconciler:
+    """Checks all local OpenTicket rows against Zammad, one search request per batch.
+
+    Tickets still open get their cached state refreshed. Tickets that are
+    closed (or gone) in Zammad are deleted, or only marked with their state
+    when delete_closed is False. Rows are paged by primary key, so memory
+    use is bounded by the batch size however many tickets there are.
+    """
+
+    def __init__(self, batch_size=100, notify=False, delete_closed=True):
+        self.batch_size = batch_size
+        self.notify = notify
+        self.delete_closed = delete_closed
+
+    def iter_batches(self):
+        """Yield OpenTicket rows in primary key order, batch_size at a time"""
+        last_id = 0
+        fields = ('id', 'bot_id', 'telegram_id', 'zammad_ticket_id', 'zammad_ticket_number')
+        while True:
+            batch = list(OpenTicket.objects.filter(id__gt=last_id).order_by('id').only(*fields)[:self.batch_size])
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+
+    def fetch_states(self, batch, stats):
+        """Zammad states of the batch's tickets, None if Zammad could not be searched"""
+        ticket_ids = {ticket.zammad_ticket_id for ticket in batch}
+        stats.zammad_requests += 1
+        states = zammad_api.search_ticket_states(ticket_ids)
+        if states is None:
+            return None
+
+        # Not in the search results (deleted, merged or not indexed yet): ask for each one directly
+        for ticket_id in ticket_ids - states.keys():
+            stats.zammad_requests += 1
+            ticket_details = zammad_api.get_ticket_details(ticket_id)
+            if ticket_details is not None:
+                states[ticket_id] = ticket_details.get('state', 'unknown').lower()
+        return states
+
+    def reconcile_batch(self, batch, stats):
+        stats.checked += len(batch)
+        states = self.fetch_states(batch, stats)
+        if states is None:
+            stats.skipped += len(batch)
+            return
+
+        ids_by_state = defaultdict(list)
+        closed = []
+        for ticket in batch:
+            state = states.get(ticket.zammad_ticket_id)
+            if state is None:
+                stats.skipped += 1
+                continue
+            ids_by_state[state].append(ticket.id)
+            if state in ZAMMAD_OPEN_STATES:
+                stats.still_open += 1
+            else:
+                closed.append((ticket, state))
+        stats.closed += len(closed)
+
+        if self.notify:
+            for ticket, state in closed:
+                if state != 'closed':
+                    continue
+                try:
+                    notify_ticket_closed(ticket)
+                    stats.notified += 1
+                except Exception as e:
+                    print(f"Error notifying user about closed ticket #{ticket.zammad_ticket_number}: {e}")
+
+        now = timezone.now()
+        for state, ticket_ids in ids_by_state.items():
+            if state not in ZAMMAD_OPEN_STATES and self.delete_closed:
+                continue
+            OpenTicket.objects.filter(id__in=ticket_ids).update(zammad_state=state, state_synced_at=now)
+        if self.delete_closed and closed:
+            OpenTicket.objects.filter(id__in=[ticket.id for ticket, state in closed]).delete()
+
+    def run(self, progress=None):
+        """Reconcile every open ticket, calling progress(stats) after each batch"""
+        stats = ReconcileStats()
+        # Bulk job: leave the Zammad request budget to user-facing requests first
+        with zammad_api.request_priority('background'):
+            for batch in self.iter_batches():
+                self.reconcile_batch(batch, stats)
+                if progress:
+                    progress(stats)
+        return stats
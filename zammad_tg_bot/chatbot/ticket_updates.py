@@ -0,0 +1,45 @@
+"""Notes and photos a customer sends on an open ticket, shared by the sync and async Telegram handlers."""
+from django.utils.translation import gettext as _
+
+from . import zammad_outbox
+
+
+def get_update_kind(text, has_photo):
+    """'note' for text that isn't a command, 'photo' for a photo, None for anything else"""
+    if text and not text.startswith('/'):
+        return 'note'
+    if has_photo:
+        return 'photo'
+    return None
+
+
+def get_photo_attachment(photo_file_id, caption):
+    """Filename and article text of a photo sent on a ticket"""
+    return f"photo_{photo_file_id}.jpg", caption or "Photo attachment"
+
+
+def enqueue_ticket_update(bot_record, ticket_id, user_name, kind, text=None, photo_file_id=None, caption=None):
+    """Record the update in the Zammad outbox (flush_zammad_outbox delivers it); (success, acknowledge)"""
+    if kind == 'note':
+        # Notes of a burst become one Zammad article and get one acknowledgement
+        acknowledge = not zammad_outbox.is_note_burst_open(ticket_id)
+        return zammad_outbox.enqueue_note(bot_record, ticket_id, user_name, text), acknowledge
+
+    filename, caption = get_photo_attachment(photo_file_id, caption)
+    return zammad_outbox.enqueue_attachment(bot_record, ticket_id, user_name, photo_file_id, filename, caption), True
+
+
+def get_progress_text(kind):
+    """What the user sees while the update goes to Zammad directly"""
+    if kind == 'note':
+        return _("Adding your note to the ticket...")
+    return _("Uploading your photo...")
+
+
+def get_result_text(success, acknowledge):
+    """The reply to the update, None if a burst was acknowledged already"""
+    if not success:
+        return _("❌ Sorry, there was an error updating your ticket.")
+    if acknowledge:
+        return _("✅ Successfully updated your ticket.")
+    return None
@@ -0,0 +1,157 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from .dispatcher import get_update_chat_id, make_shard_key
+from .metrics import registry
+from .models import PendingUpdate
+
+
+queue_depth_gauge = registry.gauge(
+    'telegram_update_queue_depth', 'Telegram updates waiting to be processed'
+)
+queue_wait_histogram = registry.histogram(
+    'telegram_update_queue_wait_seconds', 'Time between webhook receipt and worker pickup'
+)
+processing_histogram = registry.histogram(
+    'telegram_update_processing_seconds', 'Time spent processing a single Telegram update'
+)
+processed_counter = registry.counter(
+    'telegram_updates_processed_total', 'Processed Telegram updates by final status'
+)
+failed_updates_gauge = registry.gauge(
+    'telegram_update_dead_letters', 'Queued updates given up on after UPDATE_MAX_ATTEMPTS failures'
+)
+
+
+def _pending_update_fields(bot_record, update_data):
+    chat_id = get_update_chat_id(update_data)
+    return {
+        'bot': bot_record,
+        'payload': update_data,
+        'chat_id': chat_id,
+        'shard_key': make_shard_key(bot_record.id, chat_id),
+    }
+
+
+def enqueue_update(bot_record, update_data):
+    """Persist a raw Telegram update so a worker can process it later"""
+    return PendingUpdate.objects.create(**_pending_update_fields(bot_record, update_data))
+
+
+async def aenqueue_update(bot_record, update_data):
+    """Async version of enqueue_update() for ASGI views"""
+    return await PendingUpdate.objects.acreate(**_pending_update_fields(bot_record, update_data))
+
+
+def get_queue_depth():
+    """Number of updates still waiting for a worker"""
+    depth = PendingUpdate.objects.filter(status='pending').count()
+    queue_depth_gauge.set(depth)
+    return depth
+
+
+def get_failed_count():
+    """Number of updates kept as dead letters"""
+    failed = PendingUpdate.objects.filter(status='failed').count()
+    failed_updates_gauge.set(failed)
+    return failed
+
+
+def claim_pending_updates(limit, process_index=0, process_count=1):
+    """Mark up to `limit` pending updates as processing and return them in arrival order.
+
+    Each row is claimed with a conditional UPDATE, so several worker processes
+    can poll the same table without picking up the same update twice. With
+    `process_count` > 1 a process only sees the shard keys it owns, which keeps
+    every chat on a single process and therefore in order. An update waiting
+    for its retry holds back the later updates of its chat.
+    """
+    now = timezone.now()
+    waiting_retry = PendingUpdate.objects.filter(
+        bot=OuterRef('bot'), chat_id=OuterRef('chat_id'), id__lt=OuterRef('id'), status='pending', next_attempt_at__gt=now
+    )
+    pending = PendingUpdate.objects.filter(status='pending', next_attempt_at__lte=now).exclude(Exists(waiting_retry))
+    if process_count > 1:
+        pending = pending.annotate(process_shard=Mod('shard_key', process_count)).filter(process_shard=process_index)
+    candidate_ids = list(pending.order_by('id').values_list('id', flat=True)[:limit])
+    claimed_ids = [
+        update_id for update_id in candidate_ids
+        if PendingUpdate.objects.filter(id=update_id, status='pending').update(status='processing', started_at=now)
+    ]
+    return list(PendingUpdate.objects.filter(id__in=claimed_ids).select_related('bot').order_by('id'))
+
+
+def get_retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failures"""
+    return settings.UPDATE_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def process_pending_update(pending):
+    """Run the regular update handlers for a claimed update and record the outcome (done, retry later or dead letter)"""
+    from .views import process_telegram_update
+
+    started = time.monotonic()
+    if pending.started_at:
+        queue_wait_histogram.observe((pending.started_at - pending.received_at).total_seconds())
+
+    pending.attempts += 1
+    try:
+        process_telegram_update(pending.bot, pending.payload)
+        pending.status = 'done'
+        pending.finished_at = timezone.now()
+    except Exception as e:
+        pending.error = str(e)
+        # The update_id is remembered as processed, so Telegram's redelivery won't bring it back: retry it here
+        if pending.attempts >= settings.UPDATE_MAX_ATTEMPTS:
+            print(f"Giving up on queued update #{pending.id} for bot {pending.bot.name} "
+                  f"after {pending.attempts} attempts: {e}")
+            pending.status = 'failed'
+            pending.finished_at = timezone.now()
+        else:
+            print(f"Error processing queued update #{pending.id} for bot {pending.bot.name}, "
+                  f"retrying (attempt {pending.attempts}): {e}")
+            pending.status = 'pending'
+            pending.started_at = None
+            pending.next_attempt_at = timezone.now() + timedelta(seconds=get_retry_delay(pending.attempts))
+    finally:
+        pending.save(update_fields=['status', 'attempts', 'next_attempt_at', 'started_at', 'error', 'finished_at'])
+        processing_histogram.observe(time.monotonic() - started)
+        processed_counter.inc(status=pending.status)
+        close_old_connections()
+
+    return pending
+
+
+def requeue_stale_updates(older_than_seconds):
+    """Return updates stuck in 'processing' (e.g. after a worker crash) to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return PendingUpdate.objects.filter(status='processing', started_at__lt=cutoff).update(
+        status='pending', started_at=None
+    )
+
+
+def purge_finished_updates(older_than_seconds, failed_older_than_seconds=None):
+    """Delete processed updates older than the retention period (dead letters after their own, longer one)"""
+    now = timezone.now()
+    deleted, _ = PendingUpdate.objects.filter(
+        status='done', finished_at__lt=now - timedelta(seconds=older_than_seconds)
+    ).delete()
+    if failed_older_than_seconds is not None:
+        failed, _ = PendingUpdate.objects.filter(
+            status='failed', finished_at__lt=now - timedelta(seconds=failed_older_than_seconds)
+        ).delete()
+        deleted += failed
+    return deleted
+
+
+def retry_failed_updates(queryset):
+    """Put dead letters back in the queue with a fresh attempt budget"""
+    return queryset.filter(status='failed').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now(), started_at=None, finished_at=None
+    )
@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# ASGI deployments can serve the webhooks with the async views
+webhook_views = async_views if settings.ASYNC_WEBHOOKS else views
 
 urlpatterns = [
     # Zammad webhook must come BEFORE bot token pattern to avoid conflicts
-    path('webhook/zammad/', views.zammad_webhook, name='zammad_webhook'),
+    path('webhook/zammad/', webhook_views.zammad_webhook, name='zammad_webhook'),
     # Bot-specific webhook URL: https://<ngrok_domain>/telegram/webhook/<bot_token>/
-    path('webhook/<str:bot_token>/', views.telegram_webhook, name='telegram_webhook'),
-]
\ No newline at end of file
+    path('webhook/<str:bot_token>/', webhook_views.telegram_webhook, name='telegram_webhook'),
+    # Prometheus scrape endpoint (per process; protect it with METRICS_TOKEN)
+    path('metrics/', views.prometheus_metrics, name='prometheus_metrics'),
+]
@@ -1,32 +1,75 @@
+import hmac
 import json
 import os
-from django.http import HttpResponse, HttpResponseBadRequest
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from django.db import connections
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.translation import gettext as _
 from django.utils import translation
+from django.conf import settings
+from django.utils import timezone
 import telegram
-from . import zammad_api
-from .models import OpenTicket, TelegramBot, Customer, Question
+from . import zammad_api, zammad_outbox, update_queue
+from .attachment_pipeline import (
+    finish_attachment_sends, get_agent_attachment_caption, get_filename, get_oversize_reason, get_sendable_attachments,
+    get_skipped_attachment_text, iter_prefetched, plan_attachment_sends,
+)
+from .bot_registry import bot_registry
+from .conversation_state import conversation_states
+from .dedup import update_deduplicator
+from .metrics import registry, render_node_metrics
+from .telegram_files import iter_telegram_file
+from .ticket_idempotency import (
+    TicketCreationInProgress, TicketCreationUncertain, begin_creation, finish_creation, new_idempotency_key, release
+)
+from .telegram_sender import RateLimitedBot
+from .ticket_updates import (
+    enqueue_ticket_update, get_photo_attachment, get_progress_text, get_result_text, get_update_kind,
+)
+from .zammad_circuit import zammad_breaker
+from .models import OpenTicket, Customer
+from .photo_prefetch import photo_prefetcher
+from .questionnaire import questionnaire_cache
 from django.core.exceptions import ObjectDoesNotExist
 import json
 
 
+webhook_latency_histogram = registry.histogram(
+    'zammad_webhook_seconds', 'Time spent handling a Zammad webhook call'
+)
+attachment_lists_counter = registry.counter(
+    'zammad_article_attachment_lists_total', 'Agent reply attachment lists by source (payload or api)'
+)
+
+
 # Bot management
 def get_bot_by_token(token):
-    """Get or create a bot instance by token"""
-    try:
-        return TelegramBot.objects.get(token=token)
-    except ObjectDoesNotExist:
-        return None
+    """Get the cached bot record for a token (None if the token is unknown)"""
+    entry = bot_registry.get(token)
+    return entry.record if entry else None
 
 def get_telegram_bot_instance(token):
-    """Get telegram.Bot instance for a token"""
-    return telegram.Bot(token=token)
+    """Get the long-lived telegram.Bot instance for a token"""
+    entry = bot_registry.get(token)
+    if entry:
+        return entry.bot
+    return RateLimitedBot(
+        token=token, base_url=f"{settings.TELEGRAM_API_URL}/bot", base_file_url=f"{settings.TELEGRAM_API_URL}/file/bot"
+    )
+
+def get_bot_setting(bot_record, name, default=None):
+    """Read a ZammadGroup setting of a bot from the registry (no DB query)"""
+    entry = bot_registry.get_by_id(bot_record.id)
+    config = entry.config if entry else None
+    return getattr(config, name, default)
 
 def activate_bot_language(bot_record):
     """Activate the language for this bot from ZammadGroup.preferable_language"""
-    if bot_record and hasattr(bot_record, 'zammad_config'):
-        language = getattr(bot_record.zammad_config, 'preferable_language', 'ky')
+    if bot_record:
+        language = get_bot_setting(bot_record, 'preferable_language', 'ky')
     else:
         language = 'ky'  # Default to Kyrgyz
 
@@ -34,6 +77,46 @@ def activate_bot_language(bot_record):
     return language
 
 
+def process_telegram_update(bot_record, update_data):
+    """Dispatch a decoded Telegram update to the message or callback handlers"""
+    # Activate the language for this bot
+    activate_bot_language(bot_record)
+
+    # Create bot instance for this specific token
+    bot = get_telegram_bot_instance(bot_record.token)
+
+    update = telegram.Update.de_json(update_data, bot)
+
+    if zammad_breaker.is_open() and is_zammad_needed(update, bot_record):
+        # Zammad is down: answer at once instead of letting every handler wait for it
+        reply_zammad_unavailable(update, bot)
+        return
+
+    if update.message:
+        handle_message(update.message, bot, bot_record)
+    elif update.callback_query:
+        handle_callback_query(update.callback_query, bot, bot_record)
+
+
+def is_zammad_needed(update, bot_record):
+    """Whether handling the update talks to Zammad right away (outbox writes don't)"""
+    message = update.message
+    if message and zammad_outbox.is_enabled() and (message.photo or (message.text and not message.text.startswith('/'))):
+        return not OpenTicket.objects.filter(telegram_id=message.from_user.id, bot=bot_record).exists()
+    return True
+
+
+def reply_zammad_unavailable(update, bot):
+    """Tell the user that the support system can't be reached right now"""
+    if update.callback_query:
+        update.callback_query.answer()
+    if update.effective_chat:
+        bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=_("⚠️ The support system is temporarily unavailable. Please try again in a few minutes.")
+        )
+
+
 @csrf_exempt
 def telegram_webhook(request, bot_token):
     """Secure webhook handler that validates bot token"""
@@ -46,20 +129,23 @@ def telegram_webhook(request, bot_token):
         if not bot_record:
             return HttpResponseBadRequest("Invalid bot token")
 
-        # Activate the language for this bot
-        activate_bot_language(bot_record)
-
-        # Create bot instance for this specific token
-        bot = get_telegram_bot_instance(bot_token)
-
-        # Process the webhook
         update_data = json.loads(request.body.decode('utf-8'))
-        update = telegram.Update.de_json(update_data, bot)
+        update_id = update_data.get('update_id')
 
-        if update.message:
-            handle_message(update.message, bot, bot_record)
-        elif update.callback_query:
-            handle_callback_query(update.callback_query, bot, bot_record)
+        # Drop redeliveries before doing any work for them
+        if update_deduplicator.is_duplicate(bot_record, update_id):
+            return HttpResponse("ok")
+
+        try:
+            if settings.TELEGRAM_UPDATE_MODE == 'queue':
+                # Acknowledge right away, `run_update_workers` will process it
+                update_queue.enqueue_update(bot_record, update_data)
+            else:
+                process_telegram_update(bot_record, update_data)
+        except Exception:
+            # Telegram will redeliver after the error response, let it through
+            update_deduplicator.forget(bot_record, update_id)
+            raise
             
     except Exception as e:
         print(f"Error processing webhook for bot {bot_token}: {e}")
@@ -74,12 +160,35 @@ ZAMMAD_OPEN_STATES = ['new', 'open', 'pending reminder', 'pending close']
 
 
 # --- Helper Functions (Each does one specific job) ---
+def is_ticket_state_fresh(ticket_in_db):
+    """Check whether the cached Zammad state of a ticket can be used without asking Zammad"""
+    if not (ticket_in_db.zammad_state and ticket_in_db.state_synced_at):
+        return False
+    age = (timezone.now() - ticket_in_db.state_synced_at).total_seconds()
+    return age < settings.TICKET_STATE_TTL
+
+
+def is_ticket_open(ticket_in_db):
+    """Return whether the ticket is still open in Zammad, using the cached state when fresh"""
+    if not is_ticket_state_fresh(ticket_in_db):
+        ticket_details = zammad_api.get_ticket_details(ticket_in_db.zammad_ticket_id)
+
+        if ticket_details is None:
+            # Zammad unreachable: trust the last known state, keep the ticket if we know nothing
+            return not ticket_in_db.zammad_state or ticket_in_db.zammad_state in ZAMMAD_OPEN_STATES
+
+        ticket_in_db.zammad_state = ticket_details.get('state', 'unknown').lower()
+        ticket_in_db.state_synced_at = timezone.now()
+        ticket_in_db.save(update_fields=['zammad_state', 'state_synced_at'])
+
+    return ticket_in_db.zammad_state in ZAMMAD_OPEN_STATES
+
+
 def _closed_with_agent(message, user, bot_record):
     try:
         ticket_in_db = OpenTicket.objects.get(telegram_id=user.id, bot=bot_record)
-        ticket_details = zammad_api.get_ticket_details(ticket_in_db.zammad_ticket_id)
 
-        if ticket_details and ticket_details.get('state', 'unknown').lower() in ZAMMAD_OPEN_STATES:
+        if is_ticket_open(ticket_in_db):
             return
         else:
             # The ticket is closed or invalid in Zammad, so clean up our local DB.
@@ -102,36 +211,36 @@ def _handle_open_ticket_update(bot, message, user, bot_record):
         open_ticket = OpenTicket.objects.get(telegram_id=user.id, bot=bot_record)
 
         # Determine if this message is an update (text or photo)
-        is_text_update = message.text and not message.text.startswith('/')
-        is_photo_update = bool(message.photo)
-
-        if not (is_text_update or is_photo_update):
+        kind = get_update_kind(message.text, bool(message.photo))
+        if kind is None:
             # It's a command or something else, let the main handler deal with it.
             return False
 
         # --- Handle the update ---
-        success = False
-        if is_text_update:
-            bot.send_message(chat_id=message.chat.id, text=_("Adding your note to the ticket..."))
-            success = zammad_api.add_note_to_ticket(
-                open_ticket.zammad_ticket_id, user.first_name, message.text
+        photo_file_id = message.photo[-1].file_id if kind == 'photo' else None
+        if zammad_outbox.is_enabled():
+            # Recorded in the outbox, flush_zammad_outbox delivers it (with retries)
+            success, acknowledge = enqueue_ticket_update(
+                bot_record, open_ticket.zammad_ticket_id, user.first_name, kind, message.text, photo_file_id,
+                message.caption
             )
-        elif is_photo_update:
-            bot.send_message(chat_id=message.chat.id, text=_("Uploading your photo..."))
-            photo_file_id = message.photo[-1].file_id
-            file = bot.get_file(photo_file_id)
-            file_content = file.download_as_bytearray()
-            # Include photo caption if present
-            photo_caption = message.caption if message.caption else "Photo attachment"
-            success = zammad_api.add_attachment_to_ticket(
-                open_ticket.zammad_ticket_id, user.first_name, file_content, f"photo_{photo_file_id}.jpg", photo_caption
-            )
-
-        if success:
-            bot.send_message(chat_id=message.chat.id, text=_("✅ Successfully updated your ticket."))
         else:
-            # Let the user know if the update failed.
-            bot.send_message(chat_id=message.chat.id, text=_("❌ Sorry, there was an error updating your ticket."))
+            acknowledge = True
+            bot.send_message(chat_id=message.chat.id, text=get_progress_text(kind))
+            if kind == 'note':
+                success = zammad_api.add_note_to_ticket(open_ticket.zammad_ticket_id, user.first_name, message.text)
+            else:
+                filename, caption = get_photo_attachment(photo_file_id, message.caption)
+                # Streamed from Telegram into the Zammad request, never held in memory as a whole
+                success = zammad_api.add_attachment_stream_to_ticket(
+                    open_ticket.zammad_ticket_id, user.first_name, iter_telegram_file(bot, photo_file_id), filename,
+                    caption
+                )
+
+        # Let the user know how it went (a burst of notes is acknowledged once)
+        reply = get_result_text(success, acknowledge)
+        if reply:
+            bot.send_message(chat_id=message.chat.id, text=reply)
 
         return True  # Crucially, we signal that the message was handled.
 
@@ -181,9 +290,8 @@ def _handle_contact_message(bot, message, user, bot_record):
     # 1. Prevent creating a new ticket if one is already open
     try:
         ticket_in_db = OpenTicket.objects.get(telegram_id=user.id, bot=bot_record)
-        ticket_details = zammad_api.get_ticket_details(ticket_in_db.zammad_ticket_id)
 
-        if ticket_details and ticket_details.get('state', 'unknown').lower() in ZAMMAD_OPEN_STATES:
+        if is_ticket_open(ticket_in_db):
             bot.send_message(
                 chat_id=chat_id,
                 text=_("❌ You already have an open ticket: #{ticket_number}. Please wait for it to be resolved.").format(ticket_number=ticket_in_db.zammad_ticket_number)
@@ -215,19 +323,16 @@ def show_customer_selection(bot, chat_id, user, bot_record, phone_number):
         )
         return
     
-    # Store phone number in user session (we'll use a simple approach with user state)
-    # Store pending ticket creation state
-    from django.core.cache import cache
-    cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-    cache.set(cache_key, {
+    # Store pending ticket creation state (shared by all workers)
+    conversation_states.start(user.id, bot_record.id, 'customer_selection', {
         'phone_number': phone_number,
         'chat_id': chat_id,
         'user_id': user.id,
-        'step': 'customer_selection'
-    }, timeout=300)  # 5 minutes timeout
+        'idempotency_key': new_idempotency_key(bot_record, user.id),
+    }, ttl=300)  # 5 minutes timeout
     
     # Get customer prefix from ZammadGroup
-    customer_prefix = getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')
+    customer_prefix = get_bot_setting(bot_record, 'customer_prefix', 'AZS')
     
     bot.send_message(
         chat_id=chat_id,
@@ -235,19 +340,21 @@ def show_customer_selection(bot, chat_id, user, bot_record, phone_number):
     )
 
 
-def show_priority_selection(bot, chat_id, user, bot_record, customer, phone_number):
+def show_priority_selection(bot, chat_id, user, bot_record, customer, phone_number, version=None,
+                            idempotency_key=None):
     """Show issue type selection buttons after customer selection"""
-    from django.core.cache import cache
-    
-    # Update cache with customer and move to priority selection step
-    cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-    cache.set(cache_key, {
+    # Store the customer and move to priority selection step
+    pending_data = {
         'phone_number': phone_number,
         'chat_id': chat_id,
         'user_id': user.id,
         'customer_id': customer.id,
-        'step': 'priority_selection'
-    }, timeout=300)
+        'idempotency_key': idempotency_key,
+    }
+    if version is None:
+        conversation_states.start(user.id, bot_record.id, 'priority_selection', pending_data, ttl=300)
+    elif not conversation_states.advance(user.id, bot_record.id, version, 'priority_selection', pending_data, ttl=300):
+        return  # another worker already handled a message of this step
     
     # Create inline keyboard for issue type selection
     keyboard = [
@@ -279,9 +386,7 @@ def _handle_customer_number_input(bot, message, user, bot_record):
     if not message.text or message.text.startswith('/'):
         return False
     
-    from django.core.cache import cache
-    cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-    pending_data = cache.get(cache_key)
+    pending_data = conversation_states.get(user.id, bot_record.id)
     
     if not pending_data:
         return False  # No pending ticket creation
@@ -292,6 +397,13 @@ def _handle_customer_number_input(bot, message, user, bot_record):
         
         # Find customer with this number for this bot
         customer = Customer.objects.get(first_name=customer_number, telegram_bot=bot_record)
+
+        # Resolve the customer's Zammad user while the user picks the issue and answers the questions
+        customer_last_name = get_bot_setting(bot_record, 'customer_last_name', None)
+        if customer_last_name:
+            zammad_api.prefetch_zammad_user(
+                f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{customer.first_name}", customer_last_name
+            )
         
         # Show priority selection instead of creating ticket immediately
         show_priority_selection(
@@ -300,7 +412,9 @@ def _handle_customer_number_input(bot, message, user, bot_record):
             user,
             bot_record,
             customer,
-            pending_data['phone_number']
+            pending_data['phone_number'],
+            version=pending_data['version'],
+            idempotency_key=pending_data.get('idempotency_key')
         )
         
         return True
@@ -315,7 +429,7 @@ def _handle_customer_number_input(bot, message, user, bot_record):
         
     except Customer.DoesNotExist:
         # Customer not found
-        customer_prefix = getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')
+        customer_prefix = get_bot_setting(bot_record, 'customer_prefix', 'AZS')
         
         bot.send_message(
             chat_id=message.chat.id,
@@ -336,41 +450,45 @@ def _handle_customer_number_input(bot, message, user, bot_record):
         return True
 
 
-def start_question_flow(bot, chat_id, user, bot_record, customer, phone_number, priority, issue_type=None):
+def start_question_flow(bot, chat_id, user, bot_record, customer, phone_number, priority, issue_type=None,
+                        idempotency_key=None):
     """Start the question flow or create ticket if no questions"""
     # Get active questions ordered by sequence
-    questions = Question.objects.filter(is_active=True).order_by('order')
+    questionnaire = questionnaire_cache.current()
     
-    if not questions.exists():
+    if not len(questionnaire):
         # No questions, create ticket immediately
-        create_ticket_with_customer(bot, chat_id, user, bot_record, customer, phone_number, priority, issue_type)
+        create_ticket_with_customer(
+            bot, chat_id, user, bot_record, customer, phone_number, priority, issue_type, idempotency_key
+        )
         return
     
     # Start question flow
-    from django.core.cache import cache
-    cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-    cache.set(cache_key, {
+    conversation_states.start(user.id, bot_record.id, 'questions', {
         'phone_number': phone_number,
         'chat_id': chat_id,
         'user_id': user.id,
         'customer_id': customer.id,
         'priority': priority,
         'issue_type': issue_type,
-        'step': 'questions',
+        'idempotency_key': idempotency_key,
+        'questionnaire_version': questionnaire.version,
+        'question_ids': [question.id for question in questionnaire],
         'current_question': 0,
         'answers': {}
-    }, timeout=600)  # 10 minutes for questions
+    }, ttl=600)  # 10 minutes for questions
     
     # Ask first question
-    ask_current_question(bot, chat_id, user, bot_record, questions[0], 0)
+    ask_current_question(bot, chat_id, user, bot_record, questionnaire, 0)
 
 
-def ask_current_question(bot, chat_id, user, bot_record, question, question_index):
+def ask_current_question(bot, chat_id, user, bot_record, questionnaire, question_index):
     """Ask the current question"""
-    total_questions = Question.objects.filter(is_active=True).count()
+    question = questionnaire[question_index]
+    total_questions = len(questionnaire)
 
     # Get current language from bot
-    language = getattr(bot_record.zammad_config, 'preferable_language', 'ky')
+    language = get_bot_setting(bot_record, 'preferable_language', 'ky')
 
     # Get translated question text
     question_text = question.get_text(language)
@@ -404,21 +522,19 @@ def handle_question_answer(bot, message, user, bot_record):
     if not (is_text_answer or is_photo_answer):
         return False
     
-    from django.core.cache import cache
-    cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-    pending_data = cache.get(cache_key)
+    pending_data = conversation_states.get(user.id, bot_record.id)
     
     if not pending_data or pending_data.get('step') != 'questions':
         return False
     
-    # Get current question
-    questions = Question.objects.filter(is_active=True).order_by('order')
+    # Get current question from the questionnaire the user started with
+    questionnaire = questionnaire_cache.get(pending_data.get('questionnaire_version'), pending_data.get('question_ids'))
     current_question_index = pending_data.get('current_question', 0)
     
-    if current_question_index >= questions.count():
+    if current_question_index >= len(questionnaire):
         return False
     
-    current_question = questions[current_question_index]
+    current_question = questionnaire[current_question_index]
     
     # Validate answer type matches question type
     if current_question.question_type == 'text' and not is_text_answer:
@@ -438,7 +554,7 @@ def handle_question_answer(bot, message, user, bot_record):
     answers = pending_data.get('answers', {})
 
     # Get current language for storing question text
-    language = getattr(bot_record.zammad_config, 'preferable_language', 'ky')
+    language = get_bot_setting(bot_record, 'preferable_language', 'ky')
     question_text = current_question.get_text(language)
 
     if is_text_answer:
@@ -447,25 +563,29 @@ def handle_question_answer(bot, message, user, bot_record):
             'answer': message.text
         }
     elif is_photo_answer:
-        # Handle photo answer
+        # Handle photo answer; the download starts now, the ticket is created later
         photo_file_id = message.photo[-1].file_id
+        photo_prefetcher.prefetch(bot, photo_file_id, message.photo[-1].file_size)
         photo_caption = message.caption if message.caption else "Photo attachment"
         answers[f"q_{current_question.id}"] = {
             'question': question_text,
             'answer': f"[Photo: {photo_file_id}] {photo_caption}",
             'photo_file_id': photo_file_id,
+            'photo_size': message.photo[-1].file_size,
             'caption': photo_caption
         }
     
     # Move to next question or finish
     next_question_index = current_question_index + 1
     
-    if next_question_index >= questions.count():
-        # All questions answered, create ticket
+    if next_question_index >= len(questionnaire):
+        # All questions answered, create ticket (only the worker that ends the wizard does)
+        if not conversation_states.finish(user.id, bot_record.id, pending_data['version']):
+            return True
+
         from .models import Customer
         try:
             customer = Customer.objects.get(id=pending_data['customer_id'])
-            cache.delete(cache_key)
             
             create_ticket_with_customer_and_answers(
                 bot,
@@ -476,30 +596,41 @@ def handle_question_answer(bot, message, user, bot_record):
                 pending_data['phone_number'],
                 pending_data['priority'],
                 answers,
-                pending_data.get('issue_type')
+                pending_data.get('issue_type'),
+                pending_data.get('idempotency_key')
             )
         except Customer.DoesNotExist:
             bot.send_message(
                 chat_id=message.chat.id,
                 text=_("❌ Error: Customer not found. Please start again.")
             )
-            cache.delete(cache_key)
     else:
-        # Ask next question
+        # Ask next question, unless another worker already stored an answer to this one
         pending_data['current_question'] = next_question_index
         pending_data['answers'] = answers
-        cache.set(cache_key, pending_data, timeout=600)
+        if not conversation_states.advance(
+            user.id, bot_record.id, pending_data['version'], 'questions', pending_data, ttl=600
+        ):
+            return True
         
-        next_question = questions[next_question_index]
-        ask_current_question(bot, message.chat.id, user, bot_record, next_question, next_question_index)
+        ask_current_question(bot, message.chat.id, user, bot_record, questionnaire, next_question_index)
     
     return True
 
 
-def create_ticket_with_customer(bot, chat_id, user, bot_record, customer, phone_number, priority=2, issue_type=None):
+def create_ticket_with_customer(bot, chat_id, user, bot_record, customer, phone_number, priority=2, issue_type=None,
+                                idempotency_key=None):
     """Create ticket with the selected customer and priority"""
+    try:
+        creation, ticket_data = claim_ticket_creation(bot, chat_id, user, bot_record, idempotency_key)
+    except TicketCreationInProgress:
+        return  # the worker creating it answers the user
+    if ticket_data:
+        # Created by an earlier run of this session (e.g. a redelivered update)
+        save_created_ticket(bot, chat_id, user, bot_record, customer, priority, issue_type, ticket_data)
+        return
+
     priority_text = {1: _("Low"), 2: _("Medium"), 3: _("High")}
-    bot.send_message(chat_id=chat_id, text=_("Thank you! Creating your ticket. Please wait..."))
 
     ticket_title = _("New Ticket from Telegram User: {user_name}").format(user_name=user.first_name)
     
@@ -520,47 +651,162 @@ def create_ticket_with_customer(bot, chat_id, user, bot_record, customer, phone_
         username=user.username,
         user_id=user.id,
         phone_number=phone_number,
-        customer_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {getattr(bot_record.zammad_config, 'customer_last_name', '') or ''}",
+        customer_name=f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {get_bot_setting(bot_record, 'customer_last_name', '') or ''}",
         priority_text=priority_text.get(priority, _("Medium")),
         issue_description=issue_description
     )
 
     # Use bot's zammad_group or default to "Users" 
-    group_name = getattr(bot_record.zammad_config, 'zammad_group', None) or "Users"
-    ticket_data = zammad_api.create_zammad_ticket(
-        title=ticket_title, 
-        body=ticket_body, 
-        group=group_name,
-        customer_first_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)}",
-        customer_last_name=getattr(bot_record.zammad_config, 'customer_last_name', None),
-        priority=priority
-    )
-
-    if ticket_data and ticket_data.get('id'):
-        OpenTicket.objects.create(
-            telegram_id=user.id,
-            bot=bot_record,
-            customer=customer,
-            zammad_ticket_id=ticket_data.get('id'),
-            zammad_ticket_number=ticket_data.get('number'),
+    group_name = get_bot_setting(bot_record, 'zammad_group', None) or "Users"
+    # Looks the ticket up by the session's key instead of creating it a second time
+    try:
+        ticket_data = finish_creation(
+            creation,
+            title=ticket_title,
+            body=ticket_body,
+            group=group_name,
+            customer_first_name=f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{str(customer.first_name)}",
+            customer_last_name=get_bot_setting(bot_record, 'customer_last_name', None),
             priority=priority
         )
-        issue_info = f"\nIssue Type: {issue_type}" if issue_type else ""
-        response_text = _("✅ Success! Your ticket has been created.\nTicket Number: {ticket_number}\nCustomer: {customer_name}{issue_info}").format(
-            ticket_number=ticket_data.get('number'),
-            customer_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {getattr(bot_record.zammad_config, 'customer_last_name', '') or ''}",
-            issue_info=issue_info
-        )
+    except TicketCreationUncertain:
+        send_ticket_uncertain(bot, chat_id)
+        return
+
+    if ticket_data and ticket_data.get('id'):
+        save_created_ticket(bot, chat_id, user, bot_record, customer, priority, issue_type, ticket_data)
     else:
-        response_text = _("❌ Error! Could not create the ticket. Please check the server logs.")
+        bot.send_message(chat_id=chat_id, text=_("❌ Error! Could not create the ticket. Please check the server logs."))
+
+
+def send_ticket_uncertain(bot, chat_id):
+    """Zammad may have created the ticket but doesn't show it yet; starting over finds it instead of a duplicate"""
+    bot.send_message(
+        chat_id=chat_id,
+        text=_("⏳ Zammad has not confirmed your ticket yet. Please start again in a few minutes, "
+               "the ticket will not be created twice.")
+    )
+
+
+def claim_ticket_creation(bot, chat_id, user, bot_record, idempotency_key):
+    """Claim the session's ticket creation and tell the user it started.
 
+    Returns (creation, None) to go on with finish_creation(), (creation, ticket
+    data) if the ticket exists already, or raises TicketCreationInProgress
+    while another worker creates it.
+    """
+    creation, ticket_data = begin_creation(bot_record, user.id, idempotency_key)
+    if ticket_data is None:
+        try:
+            bot.send_message(chat_id=chat_id, text=_("Thank you! Creating your ticket. Please wait..."))
+        except Exception:
+            # Zammad wasn't asked yet, the redelivered update may start over right away
+            release(creation)
+            raise
+    return creation, ticket_data
+
+
+def save_created_ticket(bot, chat_id, user, bot_record, customer, priority, issue_type, ticket_data, missing_photos=()):
+    """Remember the user's new ticket, attach the photo answers it still lacks and tell the user"""
+    # A repeated creation finds the same ticket, so the row may exist already
+    OpenTicket.objects.update_or_create(
+        telegram_id=user.id,
+        bot=bot_record,
+        defaults={
+            'customer': customer,
+            'zammad_ticket_id': ticket_data.get('id'),
+            'zammad_ticket_number': ticket_data.get('number'),
+            'priority': priority,
+            'zammad_state': 'new',
+            'state_synced_at': timezone.now(),
+        }
+    )
+    attach_missing_photos(bot, bot_record, user, ticket_data.get('id'), missing_photos)
+
+    issue_info = f"\nIssue Type: {issue_type}" if issue_type else ""
+    response_text = _("✅ Success! Your ticket has been created.\nTicket Number: {ticket_number}\nCustomer: {customer_name}{issue_info}").format(
+        ticket_number=ticket_data.get('number'),
+        customer_name=f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {get_bot_setting(bot_record, 'customer_last_name', '') or ''}",
+        issue_info=issue_info
+    )
     bot.send_message(chat_id=chat_id, text=response_text)
 
 
-def create_ticket_with_customer_and_answers(bot, chat_id, user, bot_record, customer, phone_number, priority, answers, issue_type=None):
+def attach_missing_photos(bot, bot_record, user, ticket_id, missing_photos):
+    """Attach the photo answers left out of the first article on their own (queued in outbox mode)"""
+    for answer_data in missing_photos:
+        try:
+            photo_file_id = answer_data['photo_file_id']
+            if zammad_outbox.is_enabled():
+                zammad_outbox.enqueue_attachment(
+                    bot_record, ticket_id, user.first_name, photo_file_id,
+                    f"question_photo_{photo_file_id}.jpg",
+                    answer_data.get('caption', 'Photo attachment from question')
+                )
+                continue
+
+            # Download and attach the photo to the ticket
+            file_chunks = iter_telegram_file(bot, photo_file_id)
+            caption = answer_data.get('caption', 'Photo attachment from question')
+            
+            zammad_api.add_attachment_stream_to_ticket(
+                ticket_id, 
+                user.first_name, 
+                file_chunks, 
+                f"question_photo_{photo_file_id}.jpg", 
+                caption
+            )
+        except Exception as e:
+            print(f"Error adding photo attachment to ticket: {e}")
+
+
+def collect_answer_photos(bot, answers):
+    """Photo answers as (filename, content) pairs, plus the answers whose photo has to be uploaded on its own.
+
+    The photos sent with the ticket are held in memory and Base64-encoded
+    into one request, so together they stay under
+    TICKET_INLINE_ATTACHMENTS_MAX_BYTES; the rest is streamed afterwards.
+    """
+    budget = settings.TICKET_INLINE_ATTACHMENTS_MAX_BYTES
+    inline_bytes = 0
+    photos = []
+    missing = []
+    for answer_data in answers.values():
+        if 'photo_file_id' not in answer_data:
+            continue
+        photo_file_id = answer_data['photo_file_id']
+        if inline_bytes + (answer_data.get('photo_size') or 0) > budget:
+            missing.append(answer_data)
+            continue
+        content = photo_prefetcher.take(photo_file_id)
+        if content is None:
+            try:
+                content = b''.join(iter_telegram_file(bot, photo_file_id))
+            except Exception as e:
+                print(f"Error downloading photo answer {photo_file_id}: {e}")
+                missing.append(answer_data)
+                continue
+        if inline_bytes + len(content) > budget:
+            missing.append(answer_data)
+            continue
+        inline_bytes += len(content)
+        photos.append((f"question_photo_{photo_file_id}.jpg", content))
+    return photos, missing
+
+
+def create_ticket_with_customer_and_answers(bot, chat_id, user, bot_record, customer, phone_number, priority, answers, issue_type=None,
+                                            idempotency_key=None):
     """Create ticket with customer, priority, and question answers"""
+    try:
+        creation, ticket_data = claim_ticket_creation(bot, chat_id, user, bot_record, idempotency_key)
+    except TicketCreationInProgress:
+        return  # the worker creating it answers the user
+    if ticket_data:
+        # Created by an earlier run of this session (e.g. a redelivered update), photos included
+        save_created_ticket(bot, chat_id, user, bot_record, customer, priority, issue_type, ticket_data)
+        return
+
     priority_text = {1: _("Low"), 2: _("Medium"), 3: _("High")}
-    bot.send_message(chat_id=chat_id, text=_("Thank you! Creating your ticket. Please wait..."))
 
     ticket_title = _("New Ticket from Telegram User: {user_name}").format(user_name=user.first_name)
     
@@ -583,7 +829,7 @@ def create_ticket_with_customer_and_answers(bot, chat_id, user, bot_record, cust
         username=user.username,
         user_id=user.id,
         phone_number=phone_number,
-        customer_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {getattr(bot_record.zammad_config, 'customer_last_name', '') or ''}",
+        customer_name=f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {get_bot_setting(bot_record, 'customer_last_name', '') or ''}",
         priority_text=priority_text.get(priority, _("Medium")),
         issue_description=issue_description
     )
@@ -592,59 +838,32 @@ def create_ticket_with_customer_and_answers(bot, chat_id, user, bot_record, cust
     for answer_data in answers.values():
         ticket_body += f"**Q:** {answer_data['question']}\n**A:** {answer_data['answer']}\n\n"
 
+    # Photo answers go into the first article (prefetched while the user answered)
+    photos, missing_photos = collect_answer_photos(bot, answers)
+
     # Use bot's zammad_group or default to "Users" 
-    group_name = getattr(bot_record.zammad_config, 'zammad_group', None) or "Users"
-    ticket_data = zammad_api.create_zammad_ticket(
-        title=ticket_title, 
-        body=ticket_body, 
-        group=group_name,
-        customer_first_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)}",
-        customer_last_name=getattr(bot_record.zammad_config, 'customer_last_name', None),
-        priority=priority
-    )
+    group_name = get_bot_setting(bot_record, 'zammad_group', None) or "Users"
+    # Looks the ticket up by the session's key instead of creating it a second time
+    try:
+        ticket_data = finish_creation(
+            creation,
+            title=ticket_title,
+            body=ticket_body,
+            group=group_name,
+            customer_first_name=f"{get_bot_setting(bot_record, 'customer_prefix', 'AZS')}_{str(customer.first_name)}",
+            customer_last_name=get_bot_setting(bot_record, 'customer_last_name', None),
+            priority=priority,
+            attachments=photos
+        )
+    except TicketCreationUncertain:
+        send_ticket_uncertain(bot, chat_id)
+        return
 
     if ticket_data and ticket_data.get('id'):
-        # Create the ticket record
-        OpenTicket.objects.create(
-            telegram_id=user.id,
-            bot=bot_record,
-            customer=customer,
-            zammad_ticket_id=ticket_data.get('id'),
-            zammad_ticket_number=ticket_data.get('number'),
-            priority=priority
-        )
-        
-        # Add photo attachments from answers if any
-        ticket_id = ticket_data.get('id')
-        for answer_data in answers.values():
-            if 'photo_file_id' in answer_data:
-                try:
-                    # Download and attach the photo to the ticket
-                    photo_file_id = answer_data['photo_file_id']
-                    file = bot.get_file(photo_file_id)
-                    file_content = file.download_as_bytearray()
-                    caption = answer_data.get('caption', 'Photo attachment from question')
-                    
-                    zammad_api.add_attachment_to_ticket(
-                        ticket_id, 
-                        user.first_name, 
-                        file_content, 
-                        f"question_photo_{photo_file_id}.jpg", 
-                        caption
-                    )
-                except Exception as e:
-                    print(f"Error adding photo attachment to ticket: {e}")
-        
-        issue_info = f"\nIssue Type: {issue_type}" if issue_type else ""
-        response_text = _("✅ Success! Your ticket has been created.\nTicket Number: {ticket_number}\nCustomer: {customer_name}{issue_info}").format(
-            ticket_number=ticket_data.get('number'),
-            customer_name=f"{getattr(bot_record.zammad_config, 'customer_prefix', 'AZS')}_{str(customer.first_name)} {getattr(bot_record.zammad_config, 'customer_last_name', '') or ''}",
-            issue_info=issue_info
-        )
+        # Photos over the inline budget or not downloaded are attached on their own
+        save_created_ticket(bot, chat_id, user, bot_record, customer, priority, issue_type, ticket_data, missing_photos)
     else:
-        response_text = _("❌ Error! Could not create the ticket. Please check the server logs.")
-
-    bot.send_message(chat_id=chat_id, text=response_text)
+        bot.send_message(chat_id=chat_id, text=_("❌ Error! Could not create the ticket. Please check the server logs."))
 
 
 # --- Main Dispatcher Function ---
@@ -714,8 +933,9 @@ class WebhookHandler:
         """Extract ticket and article information from webhook payload"""
         if 'ticket' in payload and 'article' in payload:
             # Full webhook payload format
-            ticket_info = payload.get('ticket', {})
-            article_info = payload.get('article', {})
+            ticket_info = payload.get('ticket') or {}
+            # State-only triggers (e.g. a close) send "article": null
+            article_info = payload.get('article') or {}
             ticket_id = ticket_info.get('id')
             ticket_state = ticket_info.get('state')
         else:
@@ -728,24 +948,55 @@ class WebhookHandler:
                 'sender': payload.get('article_sender') or payload.get('sender'),
                 'internal': payload.get('article_internal') or payload.get('internal'),
                 'body': payload.get('article_body') or payload.get('body', ''),
-                'subject': payload.get('article_subject') or payload.get('subject', '')
+                'subject': payload.get('article_subject') or payload.get('subject', ''),
+                'attachments': payload.get('article_attachments'),
             }
             ticket_info = {'id': ticket_id, 'state': ticket_state}
         
+        if article_info:
+            article_info['attachments'] = self.extract_article_attachments(article_info)
         return ticket_info, article_info
     
-    def process_agent_article(self, ticket_id, article_info):
-        """Process new article from agent if it meets criteria"""
+    def extract_article_attachments(self, article_info):
+        """Attachment list sent along with the article, None if the payload has none.
+        
+        An empty list means the article has no attachments, None that they
+        have to be looked up in Zammad.
+        """
+        attachments = article_info.get('attachments')
+        if isinstance(attachments, str):
+            # Form-encoded triggers send it as a JSON string
+            try:
+                attachments = json.loads(attachments)
+            except ValueError:
+                return None
+        if not isinstance(attachments, list):
+            return None
+        return [attachment for attachment in attachments if isinstance(attachment, dict)]
+    
+    def is_agent_article(self, article_info):
+        """Check whether the article is a public reply from an agent"""
         if not (article_info and article_info.get('body')):
-            return
+            return False
         
         article_type = article_info.get('type')
         article_sender = article_info.get('sender')
         article_internal = str(article_info.get('internal', '')).lower() in ['true', '1', 'yes']
         
-        if article_type in ['web', 'email', 'phone', 'note'] and article_sender != 'Customer' and not article_internal:
+        return article_type in ['web', 'email', 'phone', 'note'] and article_sender != 'Customer' and not article_internal
+    
+    def process_agent_article(self, ticket_id, article_info):
+        """Process new article from agent if it meets criteria"""
+        if self.is_agent_article(article_info):
             self.agent_handler.handle_agent_response(ticket_id, article_info)
     
+    def update_ticket_state(self, ticket_id, ticket_state):
+        """Store the state Zammad sent so incoming messages don't have to fetch it"""
+        if ticket_id and ticket_state:
+            OpenTicket.objects.filter(zammad_ticket_id=ticket_id).update(
+                zammad_state=str(ticket_state).lower(), state_synced_at=timezone.now()
+            )
+    
     def process_ticket_closure(self, ticket_id, ticket_state):
         """Handle ticket closure notification"""
         if not (ticket_id and ticket_state == 'closed'):
@@ -753,27 +1004,49 @@ class WebhookHandler:
         
         try:
             ticket_to_close = OpenTicket.objects.get(zammad_ticket_id=ticket_id)
-
-            # Activate the language for this bot
-            activate_bot_language(ticket_to_close.bot)
-
-            # Get the bot instance for this ticket
-            bot = get_telegram_bot_instance(ticket_to_close.bot.token)
-            bot.send_message(
-                chat_id=ticket_to_close.telegram_id,
-                text=_("✅ Your ticket has been resolved and closed by our support team.")
-            )
+            notify_ticket_closed(ticket_to_close)
             ticket_to_close.delete()
         except ObjectDoesNotExist:
             pass
 
 
+def notify_ticket_closed(open_ticket):
+    """Tell the Telegram user that their ticket was closed by the support team"""
+    bot_entry = bot_registry.get_by_id(open_ticket.bot_id)
+
+    # Activate the language for this bot
+    activate_bot_language(bot_entry.record)
+
+    # Get the bot instance for this ticket
+    bot = bot_entry.bot
+    bot.send_message(
+        chat_id=open_ticket.telegram_id,
+        text=_("✅ Your ticket has been resolved and closed by our support team.")
+    )
+
+
+def prometheus_metrics(request):
+    """Metrics of this process (of the whole node with METRICS_DIR) in the Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    if not token:
+        return HttpResponseForbidden("Metrics are disabled, set METRICS_TOKEN")
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponseForbidden("Invalid metrics token")
+    
+    # Queue, dead letter and outbox counts live in the database, refresh them for the scrape
+    update_queue.get_queue_depth()
+    update_queue.get_failed_count()
+    zammad_outbox.get_outbox_depth()
+    return HttpResponse(render_node_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_exempt
 def zammad_webhook(request):
     """Main webhook handler for Zammad notifications"""
     if request.method != "POST":
         return HttpResponse("ok")
     
+    started = time.monotonic()
     try:
         webhook_handler = WebhookHandler()
         
@@ -783,11 +1056,14 @@ def zammad_webhook(request):
         ticket_id = ticket_info.get('id')
         ticket_state = ticket_info.get('state')
         
+        webhook_handler.update_ticket_state(ticket_id, ticket_state)
         webhook_handler.process_agent_article(ticket_id, article_info)
         webhook_handler.process_ticket_closure(ticket_id, ticket_state)
         
     except Exception as e:
         print(f"Error processing Zammad webhook: {e}")
+    finally:
+        webhook_latency_histogram.observe(time.monotonic() - started)
     
     return HttpResponse("ok")
 
@@ -818,59 +1094,111 @@ class TelegramMessageHandler:
     
     def send_attachment_to_telegram(self, telegram_chat_id, file_content, filename, mime_type):
         """Send a single attachment to Telegram"""
+        caption = get_agent_attachment_caption(filename)
         try:
             if mime_type.startswith('image/'):
                 # Send as photo
-                self.bot.send_photo(
-                    chat_id=telegram_chat_id,
-                    photo=file_content,
-                    caption=_("📎 Agent sent: {filename}").format(filename=filename)
-                )
+                self.bot.send_photo(chat_id=telegram_chat_id, photo=file_content, caption=caption)
             else:
                 # Send as document
                 self.bot.send_document(
-                    chat_id=telegram_chat_id,
-                    document=file_content,
-                    filename=filename,
-                    caption=_("📎 Agent sent: {filename}").format(filename=filename)
+                    chat_id=telegram_chat_id, document=file_content, filename=filename, caption=caption
                 )
         except Exception as send_error:
             print(f"Error sending attachment {filename} to Telegram: {send_error}")
             # Fallback: send as document if photo fails
             try:
                 self.bot.send_document(
-                    chat_id=telegram_chat_id,
-                    document=file_content,
-                    filename=filename,
-                    caption=_("📎 Agent sent: {filename}").format(filename=filename)
+                    chat_id=telegram_chat_id, document=file_content, filename=filename, caption=caption
                 )
             except Exception as fallback_error:
                 print(f"Fallback also failed for {filename}: {fallback_error}")
     
-    def send_article_attachments_to_telegram(self, article_id, telegram_chat_id):
-        """Download and send attachments from Zammad article to Telegram"""
+    def send_photo_group(self, telegram_chat_id, photos):
+        """Send downloaded images as one media group, `photos` is a list of (filename, content)"""
+        try:
+            self.bot.send_media_group(
+                chat_id=telegram_chat_id,
+                media=[
+                    telegram.InputMediaPhoto(
+                        media=file_content, caption=get_agent_attachment_caption(filename), filename=filename
+                    )
+                    for filename, file_content in photos
+                ]
+            )
+        except Exception as group_error:
+            print(f"Error sending media group to Telegram: {group_error}")
+            # Fallback: send them one by one
+            for filename, file_content in photos:
+                self.send_attachment_to_telegram(telegram_chat_id, file_content, filename, 'image/')
+    
+    def send_skipped_attachment_notice(self, telegram_chat_id, filename):
+        """Tell the user about an agent attachment that could not be forwarded"""
+        try:
+            self.bot.send_message(chat_id=telegram_chat_id, text=get_skipped_attachment_text(filename))
+        except Exception as e:
+            print(f"Error sending skipped attachment notice for {filename}: {e}")
+    
+    def send_planned(self, telegram_chat_id, sends):
+        """Carry out sends from plan_attachment_sends()"""
+        for kind, value in sends:
+            if kind == 'album':
+                self.send_photo_group(telegram_chat_id, value)
+            elif kind == 'file':
+                filename, file_content, mime_type = value
+                self.send_attachment_to_telegram(telegram_chat_id, file_content, filename, mime_type)
+            else:
+                self.send_skipped_attachment_notice(telegram_chat_id, value)
+    
+    def download_article_attachment(self, article_id, attachment):
+        """Download one attachment (None if missing or bigger than ATTACHMENT_MAX_BYTES)"""
+        filename = get_filename(attachment)
+        max_bytes = settings.ATTACHMENT_MAX_BYTES
+        oversize_reason = get_oversize_reason(attachment, max_bytes)
+        if oversize_reason:
+            print(f"Skipping attachment {filename}: {oversize_reason}")
+            return None
+        try:
+            return zammad_api.download_attachment(article_id, attachment.get('id'), max_bytes)
+        except (zammad_api.AttachmentTooLargeError, zammad_api.ZammadRateLimitedError, zammad_api.ZammadUnavailableError) as e:
+            print(f"Skipping attachment {filename}: {e}")
+            return None
+        finally:
+            # Runs on a pool thread, don't leave its database connection open
+            connections.close_all()
+    
+    def send_article_attachments_to_telegram(self, article_id, telegram_chat_id, attachments=None):
+        """Download and send attachments from Zammad article to Telegram.
+        
+        `attachments` is the list from the webhook payload; without it the
+        article is fetched from Zammad. Up to ATTACHMENT_DOWNLOAD_WORKERS
+        downloads run ahead of the upload to Telegram. Attachments are still
+        sent in article order, consecutive images as one media group (see
+        attachment_pipeline).
+        """
         try:
             # Get list of attachments for this article
-            attachments = zammad_api.get_article_attachments(article_id)
-            
+            if attachments is None:
+                attachment_lists_counter.inc(source='api')
+                attachments = zammad_api.get_article_attachments(article_id)
+            else:
+                attachment_lists_counter.inc(source='payload')
+            attachments = get_sendable_attachments(attachments)
             if not attachments:
                 return
+            
+            workers = max(1, settings.ATTACHMENT_DOWNLOAD_WORKERS)
+            photos = []
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                def start_download(attachment):
+                    return executor.submit(self.download_article_attachment, article_id, attachment)
                 
-            for attachment in attachments:
-                attachment_id = attachment.get('id')
-                filename = attachment.get('filename', 'attachment')
-                mime_type = attachment.get('preferences', {}).get('Mime-Type', '')
-                
-                if not attachment_id:
-                    continue
-                    
-                # Download the attachment content
-                file_content = zammad_api.download_attachment(article_id, attachment_id)
-                if not file_content:
-                    continue
-                    
-                # Send the attachment
-                self.send_attachment_to_telegram(telegram_chat_id, file_content, filename, mime_type)
+                with closing(iter_prefetched(attachments, start_download, workers)) as downloads:
+                    for attachment, download in downloads:
+                        sends, photos = plan_attachment_sends(photos, attachment, download.result())
+                        self.send_planned(telegram_chat_id, sends)
+            
+            self.send_planned(telegram_chat_id, finish_attachment_sends(photos))
                         
         except Exception as e:
             print(f"Error processing attachments for article {article_id}: {e}")
@@ -884,12 +1212,13 @@ class AgentResponseHandler:
         try:
             # Find the ticket in our local DB
             open_ticket = OpenTicket.objects.get(zammad_ticket_id=ticket_id)
+            bot_entry = bot_registry.get_by_id(open_ticket.bot_id)
 
             # Activate the language for this bot
-            activate_bot_language(open_ticket.bot)
+            activate_bot_language(bot_entry.record)
 
             # Create telegram handler for this specific bot
-            telegram_handler = TelegramMessageHandler(open_ticket.bot.token)
+            telegram_handler = TelegramMessageHandler(bot_entry.record.token)
             
             # Handle text content
             response_body = article_info.get('body', '')
@@ -899,7 +1228,9 @@ class AgentResponseHandler:
             # Handle attachments
             article_id = article_info.get('id')
             if article_id:
-                telegram_handler.send_article_attachments_to_telegram(article_id, open_ticket.telegram_id)
+                telegram_handler.send_article_attachments_to_telegram(
+                    article_id, open_ticket.telegram_id, article_info.get('attachments')
+                )
             
         except ObjectDoesNotExist:
             pass
@@ -938,7 +1269,10 @@ def handle_callback_query(query, bot, bot_record):
         ticket_id = int(query.data.split('_')[-1])
 
         # 1. Tell Zammad to close the ticket
-        success = zammad_api.close_zammad_ticket(ticket_id, user.first_name)
+        if zammad_outbox.is_enabled():
+            success = zammad_outbox.enqueue_close(bot_record, ticket_id, user.first_name)
+        else:
+            success = zammad_api.close_zammad_ticket(ticket_id, user.first_name)
 
         if success:
             # 2. If Zammad confirmed, delete the ticket from our local database
@@ -973,10 +1307,8 @@ def handle_priority_selection_callback(query, bot, bot_record):
             bot.answer_callback_query(callback_query_id=query.id, text=_("Invalid selection"))
             return
             
-        # Get pending ticket data from cache
-        from django.core.cache import cache
-        cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-        pending_data = cache.get(cache_key)
+        # Get pending ticket data
+        pending_data = conversation_states.get(user.id, bot_record.id)
         
         if not pending_data or pending_data.get('step') != 'priority_selection':
             bot.answer_callback_query(callback_query_id=query.id, text=_("Session expired. Please start again."))
@@ -995,8 +1327,10 @@ def handle_priority_selection_callback(query, bot, bot_record):
             bot.answer_callback_query(callback_query_id=query.id, text=_("Customer not found"))
             return
             
-        # Clear cache
-        cache.delete(cache_key)
+        # End this step; a repeated tap handled by another worker stops here
+        if not conversation_states.finish(user.id, bot_record.id, pending_data['version']):
+            bot.answer_callback_query(callback_query_id=query.id)
+            return
         
         # Give feedback to user
         bot.answer_callback_query(
@@ -1019,7 +1353,8 @@ def handle_priority_selection_callback(query, bot, bot_record):
             bot_record,
             customer,
             pending_data['phone_number'],
-            priority
+            priority,
+            idempotency_key=pending_data.get('idempotency_key')
         )
         
     except (ValueError, IndexError) as e:
@@ -1052,10 +1387,8 @@ def handle_issue_type_selection_callback(query, bot, bot_record):
             bot.answer_callback_query(callback_query_id=query.id, text=_("Invalid selection"))
             return
             
-        # Get pending ticket data from cache
-        from django.core.cache import cache
-        cache_key = f"pending_ticket_{user.id}_{bot_record.id}"
-        pending_data = cache.get(cache_key)
+        # Get pending ticket data
+        pending_data = conversation_states.get(user.id, bot_record.id)
         
         if not pending_data or pending_data.get('step') != 'priority_selection':
             bot.answer_callback_query(callback_query_id=query.id, text=_("Session expired. Please start again."))
@@ -1094,8 +1427,10 @@ def handle_issue_type_selection_callback(query, bot, bot_record):
             bot.answer_callback_query(callback_query_id=query.id, text=_("Customer not found"))
             return
             
-        # Clear cache
-        cache.delete(cache_key)
+        # End this step; a repeated tap handled by another worker stops here
+        if not conversation_states.finish(user.id, bot_record.id, pending_data['version']):
+            bot.answer_callback_query(callback_query_id=query.id)
+            return
         
         # Give feedback to user
         bot.answer_callback_query(
@@ -1121,7 +1456,8 @@ def handle_issue_type_selection_callback(query, bot, bot_record):
             customer,
             pending_data['phone_number'],
             priority,
-            issue_display
+            issue_display,
+            idempotency_key=pending_data.get('idempotency_key')
         )
         
     except (ValueError, IndexError) as e:
@@ -1,27 +1,47 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 import requests
 import json
 import base64
+from urllib.parse import urlencode
 
+from .zammad_circuit import ResilientAdapter, ZammadUnavailableError, zammad_breaker, zammad_retry_policy
+from .zammad_metrics import timed_operation
+from .zammad_rate_limit import ZammadRateLimitedError, request_priority, zammad_rate_limiter
 
-class ZammadApiClient:
-    """Base class for Zammad API operations with common functionality"""
+
+class AttachmentTooLargeError(Exception):
+    """Attachment is bigger than the caller's size limit (not retried with other URLs)"""
+
+
+class ZammadApiBase:
+    """Configuration, headers and response handling shared by the sync and async clients (no I/O)"""
     
     def __init__(self):
         self.zammad_url = os.getenv("ZAMMAD_URL")
         self.zammad_token = os.getenv("ZAMMAD_TOKEN")
         self.agent_email = os.getenv("ZAMMAD_AGENT_EMAIL")
+        self.pool_size = int(os.getenv("ZAMMAD_POOL_SIZE", "10"))
         
         if not all([self.zammad_url, self.zammad_token]):
             raise ValueError("Zammad URL or Token not found in environment variables.")
     
+    def get_auth_headers(self):
+        """Headers for Zammad API requests without a body"""
+        return {"Authorization": f"Token token={self.zammad_token}"}
+    
     def get_headers(self):
         """Create standard headers for Zammad API requests"""
         return {
-            "Authorization": f"Token token={self.zammad_token}",
+            **self.get_auth_headers(),
             "Content-Type": "application/json",
         }
     
+    def get_ticket_url(self, ticket_id):
+        return f"{self.zammad_url}/api/v1/tickets/{ticket_id}"
+    
     def handle_response(self, response, operation_name):
         """Handle Zammad API response and check for errors"""
         if response.status_code >= 400:
@@ -29,35 +49,75 @@ class ZammadApiClient:
             print(f"Response Body: {response.text}")
             response.raise_for_status()
         return response.json()
+
+
+class ZammadApiClient(ZammadApiBase):
+    """Base class for Zammad API operations, sending requests through the shared pooled session"""
+    
+    # One keep-alive connection pool shared by every manager instance
+    _session = None
+    _session_lock = threading.Lock()
+    
+    @staticmethod
+    def create_session(pool_size):
+        """Create a requests session that keeps up to `pool_size` connections alive"""
+        session = requests.Session()
+        # Every request spends the node's Zammad request budget (see zammad_rate_limit),
+        # is retried if idempotent and fails fast while Zammad is down (see zammad_circuit)
+        adapter = ResilientAdapter(
+            zammad_rate_limiter, zammad_breaker, zammad_retry_policy, pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # Token auth only: don't collect Zammad session cookies shared across threads
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
     
-    def make_request(self, method, url, payload=None, timeout=10):
-        """Make HTTP request to Zammad API"""
+    @property
+    def session(self):
+        """Shared, thread-safe pooled session for all Zammad requests"""
+        if ZammadApiClient._session is None:
+            with ZammadApiClient._session_lock:
+                if ZammadApiClient._session is None:
+                    ZammadApiClient._session = self.create_session(self.pool_size)
+        return ZammadApiClient._session
+    
+    def make_request(self, method, url, payload=None, timeout=10, body=None):
+        """Make HTTP request to Zammad API (`body` is already encoded JSON, e.g. a generator of chunks)"""
         headers = self.get_headers()
+        data = body if body is not None else json.dumps(payload)
         
         if method.upper() == 'GET':
-            response = requests.get(url, headers=headers, timeout=timeout)
+            response = self.session.get(url, headers=headers, timeout=timeout)
         elif method.upper() == 'POST':
-            response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
+            response = self.session.post(url, headers=headers, data=data, timeout=timeout)
         elif method.upper() == 'PUT':
-            response = requests.put(url, headers=headers, data=json.dumps(payload), timeout=timeout)
+            response = self.session.put(url, headers=headers, data=data, timeout=timeout)
         else:
             raise ValueError(f"Unsupported HTTP method: {method}")
         
         return response
 
 
-class ZammadTicketManager(ZammadApiClient):
-    """Manages Zammad ticket operations"""
+class ZammadTicketRequests(ZammadApiBase):
+    """URLs, payloads and response handling of ticket operations.
+
+    Shared by ZammadTicketManager and its async counterpart, which only
+    differ in how they send the requests.
+    """
+    # Seconds create_ticket waits for a resolution already running before starting its own
+    USER_PREFETCH_WAIT = 15
     
-    def build_ticket_payload(self, title, body, group="Users", customer_email=None, priority=2):
-        """Build the payload for creating a new ticket"""
+    def build_ticket_payload(self, title, body, group="Users", customer_email=None, priority=2, attachments=None,
+                             tags=None):
+        """Build the payload for creating a new ticket; attachments are (filename, content) pairs"""
         if not self.agent_email:
             raise ValueError("Agent email not found in environment variables.")
         
         # Use provided customer_email or fall back to agent_email
         customer = customer_email if customer_email else self.agent_email
         
-        return {
+        payload = {
             "title": title,
             "group_id": int(group) if group.isdigit() else 1,  # Convert to int, default to 1 (Users)
             "customer": customer,
@@ -69,6 +129,19 @@ class ZammadTicketManager(ZammadApiClient):
                 "internal": False,
             }
         }
+        if attachments:
+            # Sent with the first article, so the ticket needs no further uploads
+            payload["article"]["attachments"] = [
+                {
+                    "filename": filename,
+                    "data": base64.b64encode(content).decode('utf-8'),
+                    "mime-type": "image/jpeg",
+                }
+                for filename, content in attachments
+            ]
+        if tags:
+            payload["tags"] = ",".join(tags)
+        return payload
     
     def build_close_ticket_payload(self, user_name):
         """Build payload for closing a ticket"""
@@ -89,38 +162,198 @@ class ZammadTicketManager(ZammadApiClient):
             "internal": False,
         }
     
+    @property
+    def user_cache(self):
+        """Persistent email -> Zammad user mapping (imported lazily, it needs the Django models)"""
+        from .zammad_users import zammad_user_cache
+        return zammad_user_cache
+    
+    def build_customer_email(self, first_name, last_name):
+        """Email of the Zammad user that represents a customer"""
+        return f"{first_name.lower()}.{last_name.lower()}@customer.local"
+    
+    def build_user_payload(self, first_name, last_name, email):
+        """Build payload for creating a customer user"""
+        return {
+            "firstname": first_name,
+            "lastname": last_name,
+            "email": email,
+            "login": email,
+            "roles": ["Customer"]
+        }
+    
+    def get_user_search_url(self, email):
+        return f"{self.zammad_url}/api/v1/users/search?query=email:{email}"
+    
+    def get_users_url(self):
+        return f"{self.zammad_url}/api/v1/users"
+    
+    def get_tickets_url(self):
+        return f"{self.zammad_url}/api/v1/tickets"
+    
+    def get_articles_url(self):
+        return f"{self.zammad_url}/api/v1/ticket_articles"
+    
+    def parse_user_search(self, response, email):
+        """The user found by an email search, or None"""
+        search_results = self.handle_response(response, "searching for Zammad user")
+        if search_results and len(search_results) > 0:
+            print(f"Found existing Zammad user: {email}")
+            return search_results[0]
+        return None
+    
+    def parse_created_user(self, response, email):
+        user = self.handle_response(response, "creating Zammad user")
+        print(f"Created new Zammad user: {email}")
+        return user
+    
+    def find_user_by_email(self, users, email):
+        """The user with exactly this email from a users list, or None"""
+        for user in users:
+            if user.get('email', '').lower() == email.lower():
+                print(f"Found existing Zammad user after 422: {email}")
+                return user
+        return None
+    
+    def parse_created_ticket(self, response):
+        ticket_data = self.handle_response(response, "creating ticket")
+        print(f"Successfully created Zammad ticket: {ticket_data.get('number')}")
+        return ticket_data
+    
+    def is_stale_customer_error(self, error, customer_email):
+        """Whether a failed ticket creation means the mapped customer was removed or merged in Zammad"""
+        return bool(customer_email) and "422" in str(error)
+    
+    def parse_ticket_details(self, response):
+        """Ticket data, or {"error": "not_found"} for a ticket Zammad doesn't know"""
+        if response.status_code == 404:
+            print("Ticket not found in Zammad.")
+            return {"error": "not_found"}
+        response.raise_for_status()
+        return response.json()
+    
+    def parse_close_response(self, response, ticket_id):
+        if response.status_code >= 400:
+            print(f"Error closing ticket! Status: {response.status_code}")
+            print(f"Response Body: {response.text}")
+            return False
+        print(f"Successfully closed ticket ID: {ticket_id}")
+        return True
+    
+    def parse_note_response(self, response, ticket_id):
+        response.raise_for_status()
+        print(f"Successfully added note to ticket ID: {ticket_id}")
+        return True
+    
+    def extract_ticket_states(self, search_results):
+        """Map ticket id -> lower-case state name from a tickets/search response"""
+        if isinstance(search_results, dict):
+            # Non-expanded format: ticket ids plus an assets section
+            assets = search_results.get('assets', {})
+            state_names = {int(state_id): state.get('name') for state_id, state in assets.get('TicketState', {}).items()}
+            tickets = assets.get('Ticket', {}).values()
+        else:
+            state_names = {}
+            tickets = search_results or []
+        
+        states = {}
+        for ticket in tickets:
+            state = ticket.get('state') or state_names.get(ticket.get('state_id')) or 'unknown'
+            states[int(ticket['id'])] = str(state).lower()
+        return states
+    
+    def get_ticket_search_url(self, query, limit):
+        params = urlencode({"query": query, "limit": limit, "expand": "true"})
+        return f"{self.zammad_url}/api/v1/tickets/search?{params}"
+    
+    def get_ticket_states_search_url(self, ticket_ids):
+        """Search for the tickets with these ids"""
+        ticket_ids = list(ticket_ids)
+        query = "id:(" + " OR ".join(str(ticket_id) for ticket_id in ticket_ids) + ")"
+        return self.get_ticket_search_url(query, len(ticket_ids))
+    
+    def parse_ticket_states(self, response):
+        return self.extract_ticket_states(self.handle_response(response, "searching tickets"))
+    
+    def parse_tag_search(self, response):
+        """The first ticket of a tag search, or None"""
+        tickets = self.handle_response(response, "searching ticket by tag")
+        if isinstance(tickets, dict):
+            tickets = list(tickets.get('assets', {}).get('Ticket', {}).values())
+        return tickets[0] if tickets else None
+
+
+class ZammadTicketManager(ZammadApiClient, ZammadTicketRequests):
+    """Manages Zammad ticket operations"""
+    
+    # Customer users being resolved ahead of ticket creation: email -> Future
+    _pending_users = {}
+    _pending_users_lock = threading.Lock()
+    _user_executor = None
+    
     def create_or_get_zammad_user(self, first_name, last_name):
         """Create or get Zammad user based on customer name"""
-        # Generate email based on names
-        email = f"{first_name.lower()}.{last_name.lower()}@customer.local"
+        email = self.build_customer_email(first_name, last_name)
+
+        user = self.user_cache.get(email)
+        if user:
+            return user
 
+        pending = self._pending_users.get(email)
+        if pending is not None:
+            try:
+                user = pending.result(timeout=self.USER_PREFETCH_WAIT)
+            except Exception as e:
+                print(f"Background resolution of Zammad user {email} failed: {e}")
+            if user:
+                return user
+
+        return self.resolve_and_store_user(first_name, last_name, email)
+
+    def resolve_and_store_user(self, first_name, last_name, email):
+        user = self.resolve_zammad_user(first_name, last_name, email)
+        if user:
+            self.user_cache.store(email, user)
+        return user
+
+    def prefetch_zammad_user(self, first_name, last_name):
+        """Start resolving a customer's Zammad user in the background, ahead of create_ticket"""
+        email = self.build_customer_email(first_name, last_name)
+        with ZammadTicketManager._pending_users_lock:
+            if email in self._pending_users:
+                return
+            if ZammadTicketManager._user_executor is None:
+                ZammadTicketManager._user_executor = ThreadPoolExecutor(2, thread_name_prefix='zammad-user')
+            self._pending_users[email] = self._user_executor.submit(
+                self._prefetch_user, first_name, last_name, email
+            )
+
+    def _prefetch_user(self, first_name, last_name, email):
+        from django.db import connections
+        try:
+            return self.user_cache.get(email) or self.resolve_and_store_user(first_name, last_name, email)
+        finally:
+            with ZammadTicketManager._pending_users_lock:
+                self._pending_users.pop(email, None)
+            connections.close_all()
+
+    @timed_operation('resolve_user')
+    def resolve_zammad_user(self, first_name, last_name, email):
+        """Find the Zammad user for an email in Zammad, creating it if needed"""
         # Try to find existing user by exact email match
-        search_url = f"{self.zammad_url}/api/v1/users/search?query=email:{email}"
         try:
-            response = self.make_request('GET', search_url)
-            search_results = self.handle_response(response, "searching for Zammad user")
-
-            if search_results and len(search_results) > 0:
-                print(f"Found existing Zammad user: {email}")
-                return search_results[0]
+            response = self.make_request('GET', self.get_user_search_url(email))
+            user = self.parse_user_search(response, email)
+            if user:
+                return user
         except requests.exceptions.RequestException as e:
             print(f"Error searching for Zammad user: {e}")
 
         # Create new Zammad user
-        user_data = {
-            "firstname": first_name,
-            "lastname": last_name,
-            "email": email,
-            "login": email,
-            "roles": ["Customer"]
-        }
-
-        create_url = f"{self.zammad_url}/api/v1/users"
+        user_data = self.build_user_payload(first_name, last_name, email)
         try:
-            response = self.make_request('POST', create_url, user_data)
-            user = self.handle_response(response, "creating Zammad user")
-            print(f"Created new Zammad user: {email}")
-            return user
+            response = self.make_request('POST', self.get_users_url(), user_data)
+            return self.parse_created_user(response, email)
         except requests.exceptions.RequestException as e:
             print(f"Error creating Zammad user: {e}")
             # If user already exists (422 error), try to fetch by email
@@ -132,23 +365,17 @@ class ZammadTicketManager(ZammadApiClient):
         """Fetch user by email when we know they exist"""
         try:
             # Try alternative search endpoint
-            search_url = f"{self.zammad_url}/api/v1/users?search={email}"
+            search_url = f"{self.get_users_url()}?search={email}"
             response = self.make_request('GET', search_url)
-            users = response.json()
-
-            # Find exact email match
-            for user in users:
-                if user.get('email', '').lower() == email.lower():
-                    print(f"Found existing Zammad user after 422: {email}")
-                    return user
+            return self.find_user_by_email(response.json(), email)
         except Exception as e:
             print(f"Error fetching user by email: {e}")
         return None
     
-    def create_ticket(self, title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2):
+    @timed_operation('create_ticket')
+    def create_ticket(self, title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2,
+                      attachments=None, tags=None):
         """Creates a new ticket in Zammad with customer as the user"""
-        url = f"{self.zammad_url}/api/v1/tickets"
-        
         # If customer info provided, create/get Zammad user for customer
         customer_email = None
         if customer_first_name and customer_last_name:
@@ -156,82 +383,118 @@ class ZammadTicketManager(ZammadApiClient):
             if zammad_user:
                 customer_email = zammad_user['email']
         
-        payload = self.build_ticket_payload(title, body, group, customer_email, priority)
+        payload = self.build_ticket_payload(title, body, group, customer_email, priority, attachments, tags)
 
         try:
-            response = self.make_request('POST', url, payload)
-            ticket_data = self.handle_response(response, "creating ticket")
-            print(f"Successfully created Zammad ticket: {ticket_data.get('number')}")
-            return ticket_data
+            response = self.make_request('POST', self.get_tickets_url(), payload)
+            return self.parse_created_ticket(response)
         except requests.exceptions.RequestException as e:
             print(f"Failed to connect to Zammad for ticket creation: {e}")
+            if self.is_stale_customer_error(e, customer_email):
+                self.user_cache.invalidate(customer_email)
             return None
     
+    @timed_operation('get_ticket_details')
     def get_ticket_details(self, ticket_id):
         """Fetches details for a single ticket from Zammad by its ID"""
-        url = f"{self.zammad_url}/api/v1/tickets/{ticket_id}?expand=true"
+        url = f"{self.get_ticket_url(ticket_id)}?expand=true"
         
         try:
-            headers = {"Authorization": f"Token token={self.zammad_token}"}
-            response = requests.get(url, headers=headers, timeout=10)
-
-            if response.status_code == 404:
-                print("Ticket not found in Zammad.")
-                return {"error": "not_found"}
-
-            response.raise_for_status()
-            return response.json()
+            response = self.session.get(url, headers=self.get_auth_headers(), timeout=10)
+            return self.parse_ticket_details(response)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching ticket details: {e}")
             return None
     
+    @timed_operation('search_ticket_states')
+    def search_ticket_states(self, ticket_ids):
+        """Fetches the states of many tickets with one search request (None if Zammad is unreachable)"""
+        try:
+            response = self.make_request('GET', self.get_ticket_states_search_url(ticket_ids), timeout=30)
+            return self.parse_ticket_states(response)
+        except requests.exceptions.RequestException as e:
+            print(f"Error searching tickets: {e}")
+            return None
+    
+    @timed_operation('find_ticket_by_tag')
+    def find_ticket_by_tag(self, tag):
+        """Return the ticket carrying a tag, or None (raises RequestException if Zammad can't be asked)"""
+        response = self.make_request('GET', self.get_ticket_search_url(f"tags:{tag}", 1))
+        return self.parse_tag_search(response)
+    
+    @timed_operation('close_ticket')
     def close_ticket(self, ticket_id, user_name):
         """Updates a ticket in Zammad to set its state to 'closed'"""
-        url = f"{self.zammad_url}/api/v1/tickets/{ticket_id}"
         payload = self.build_close_ticket_payload(user_name)
 
         try:
-            response = self.make_request('PUT', url, payload)
-            
-            if response.status_code >= 400:
-                print(f"Error closing ticket! Status: {response.status_code}")
-                print(f"Response Body: {response.text}")
-                return False
-
-            print(f"Successfully closed ticket ID: {ticket_id}")
-            return True
+            response = self.make_request('PUT', self.get_ticket_url(ticket_id), payload)
+            return self.parse_close_response(response, ticket_id)
         except requests.exceptions.RequestException as e:
             print(f"Error connecting to Zammad to close ticket: {e}")
             return False
     
+    @timed_operation('add_note_to_ticket')
     def add_note_to_ticket(self, ticket_id, user_name, note_body):
         """Adds a new text article (note) to an existing Zammad ticket"""
-        url = f"{self.zammad_url}/api/v1/ticket_articles"
         payload = self.build_note_payload(ticket_id, user_name, note_body)
 
         try:
-            response = self.make_request('POST', url, payload, timeout=15)
-            response.raise_for_status()
-            print(f"Successfully added note to ticket ID: {ticket_id}")
-            return True
+            response = self.make_request('POST', self.get_articles_url(), payload, timeout=15)
+            return self.parse_note_response(response, ticket_id)
         except requests.exceptions.RequestException as e:
             print(f"Error adding note to ticket: {e}")
             return False
 
 
-
-
-
-
-
-
-class ZammadAttachmentManager(ZammadApiClient):
-    """Manages Zammad attachment operations"""
+class ZammadAttachmentRequests(ZammadApiBase):
+    """Upload payloads (streamed through Base64), download URLs and response handling of attachments"""
+    
+    # Bytes per chunk when streaming an upload (a multiple of 3, so chunks encode to Base64 without padding)
+    UPLOAD_CHUNK_SIZE = 48 * 1024
+    # Placeholder replaced by the streamed Base64 data when the payload is serialized
+    DATA_PLACEHOLDER = "__ATTACHMENT_DATA__"
     
     def encode_file_to_base64(self, file_content):
         """Encode file content to Base64 string"""
         return base64.b64encode(file_content).decode('utf-8')
     
+    def iter_bytes_chunks(self, file_content):
+        """Split in-memory file content into upload chunks without copying it"""
+        view = memoryview(file_content)
+        for start in range(0, len(view), self.UPLOAD_CHUNK_SIZE):
+            yield view[start:start + self.UPLOAD_CHUNK_SIZE]
+    
+    def encode_base64_chunk(self, remainder, chunk):
+        """Base64 of the whole 3-byte groups of `remainder` + `chunk`, and the bytes left for the next chunk"""
+        data = remainder + bytes(chunk)
+        usable = len(data) - len(data) % 3
+        return base64.b64encode(data[:usable]), data[usable:]
+    
+    def iter_base64(self, chunks):
+        """Base64-encode a stream of byte chunks of any size, chunk by chunk"""
+        remainder = b""
+        for chunk in chunks:
+            encoded, remainder = self.encode_base64_chunk(remainder, chunk)
+            if encoded:
+                yield encoded
+        if remainder:
+            yield base64.b64encode(remainder)
+    
+    def split_attachment_payload(self, user_name, filename, caption):
+        """The JSON attachment payload as the bytes before and after the Base64 file data"""
+        payload = self.build_attachment_payload(user_name, filename, self.DATA_PLACEHOLDER, caption)
+        prefix, suffix = json.dumps(payload).split(self.DATA_PLACEHOLDER)
+        # Base64 output only uses JSON-safe characters, so it goes into the string as is
+        return prefix.encode('utf-8'), suffix.encode('utf-8')
+    
+    def iter_attachment_payload(self, user_name, filename, chunks, caption):
+        """Yield the JSON attachment payload as bytes, streaming the file data through Base64"""
+        prefix, suffix = self.split_attachment_payload(user_name, filename, caption)
+        yield prefix
+        yield from self.iter_base64(chunks)
+        yield suffix
+    
     def build_attachment_body_text(self, user_name, caption):
         """Build body text for attachment based on caption"""
         if caption:
@@ -258,79 +521,161 @@ class ZammadAttachmentManager(ZammadApiClient):
             }
         }
     
-    def generate_attachment_urls(self, article_id, attachment_id):
-        """Generate possible attachment download URLs"""
+    # Attachment download URLs differ between Zammad versions; tried in this order
+    ATTACHMENT_URL_SCHEMES = {
+        "ticket_attachment": "{zammad_url}api/v1/ticket_attachment/{article_id}/{attachment_id}",
+        "article_attachments": "{zammad_url}api/v1/ticket_articles/{article_id}/attachments/{attachment_id}",
+        "attachments": "{zammad_url}api/v1/attachments/{attachment_id}",
+    }
+    
+    # Zammad URL -> name of the scheme that worked last ('' if not known yet), shared by all instances
+    _attachment_schemes = {}
+    
+    def generate_attachment_urls(self, article_id, attachment_id, schemes=None):
+        """Generate possible attachment download URLs as (scheme, url) pairs"""
         return [
-            f"{self.zammad_url}api/v1/ticket_attachment/{article_id}/{attachment_id}",
-            f"{self.zammad_url}api/v1/ticket_articles/{article_id}/attachments/{attachment_id}",
-            f"{self.zammad_url}api/v1/attachments/{attachment_id}"
+            (scheme, self.ATTACHMENT_URL_SCHEMES[scheme].format(
+                zammad_url=self.zammad_url, article_id=article_id, attachment_id=attachment_id
+            ))
+            for scheme in (schemes or self.ATTACHMENT_URL_SCHEMES)
         ]
     
-    def try_download_from_url(self, url):
-        """Try to download attachment from a specific URL"""
-        headers = {"Authorization": f"Token token={self.zammad_token}"}
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.content
+    def get_fallback_schemes(self, known_scheme):
+        """Schemes to probe when the known one is missing or no longer works"""
+        return [scheme for scheme in self.ATTACHMENT_URL_SCHEMES if scheme != known_scheme]
+    
+    def is_new_working_scheme(self, scheme, known_scheme, attachment_id, file_content):
+        """Whether a probe download found a scheme that should be remembered"""
+        if file_content is None:
+            print(f"Error: Could not download attachment {attachment_id}")
+            return False
+        if scheme != known_scheme:
+            print(f"Zammad attachment downloads work with the '{scheme}' URL scheme")
+            return True
+        return False
+    
+    def parse_upload_response(self, response, ticket_id):
+        if response.status_code >= 400:
+            print(f"--- ZAMMAD UPLOAD ERROR (Base64) ---")
+            print(f"Status Code: {response.status_code}")
+            print(f"Response Body: {response.text}")
+            print(f"------------------------------------")
+            return False
+        print(f"Successfully added Base64 attachment to ticket ID: {ticket_id}")
+        return True
+
+
+class ZammadAttachmentManager(ZammadApiClient, ZammadAttachmentRequests):
+    """Manages Zammad attachment operations"""
+    
+    def get_attachment_scheme(self):
+        """The download URL scheme known to work for this Zammad, or None"""
+        scheme = ZammadAttachmentRequests._attachment_schemes.get(self.zammad_url)
+        if scheme is None:
+            from .models import ZammadInstance
+            instance = ZammadInstance.objects.filter(zammad_url=self.zammad_url).first()
+            scheme = instance.attachment_url_scheme if instance else ''
+            ZammadAttachmentRequests._attachment_schemes[self.zammad_url] = scheme
+        return scheme or None
     
-    def attempt_attachment_download(self, possible_urls):
-        """Attempt to download attachment from multiple possible URLs"""
-        for url in possible_urls:
+    def set_attachment_scheme(self, scheme):
+        """Remember (in process and in the database) which scheme works, '' to forget it"""
+        from .models import ZammadInstance
+        ZammadAttachmentRequests._attachment_schemes[self.zammad_url] = scheme
+        ZammadInstance.objects.update_or_create(
+            zammad_url=self.zammad_url, defaults={"attachment_url_scheme": scheme}
+        )
+    
+    def try_download_from_url(self, url, max_bytes=None):
+        """Try to download attachment from a specific URL, reading at most `max_bytes`"""
+        with self.session.get(url, headers=self.get_auth_headers(), timeout=30, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise AttachmentTooLargeError(f"Attachment is larger than {max_bytes} bytes")
+                chunks.append(chunk)
+            return b"".join(chunks)
+    
+    def attempt_attachment_download(self, possible_urls, max_bytes=None):
+        """Attempt to download attachment from multiple possible URLs, returns (scheme, content)"""
+        for scheme, url in possible_urls:
             try:
-                return self.try_download_from_url(url)
+                return scheme, self.try_download_from_url(url, max_bytes)
+            except (ZammadRateLimitedError, ZammadUnavailableError):
+                # No budget left or Zammad down, other URLs won't do better
+                raise
             except requests.exceptions.RequestException:
                 continue
-        return None
+        return None, None
     
     def add_attachment_to_ticket(self, ticket_id, user_name, file_content, filename, caption=None):
         """Adds an attachment to a ticket with Base64 encoded file payload"""
-        url = f"{self.zammad_url}/api/v1/tickets/{ticket_id}"
+        return self.add_attachment_stream_to_ticket(
+            ticket_id, user_name, self.iter_bytes_chunks(file_content), filename, caption
+        )
+    
+    @timed_operation('add_attachment_to_ticket')
+    def add_attachment_stream_to_ticket(self, ticket_id, user_name, chunks, filename, caption=None):
+        """Adds an attachment read from an iterable of byte chunks (e.g. a Telegram download).
         
-        encoded_file = self.encode_file_to_base64(file_content)
-        payload = self.build_attachment_payload(user_name, filename, encoded_file, caption)
+        The request body is encoded while it is sent (chunked transfer encoding),
+        so memory use doesn't grow with the file size.
+        """
+        body = self.iter_attachment_payload(user_name, filename, chunks, caption)
 
         try:
-            response = self.make_request('PUT', url, payload, timeout=90)
-
-            if response.status_code >= 400:
-                print(f"--- ZAMMAD UPLOAD ERROR (Base64) ---")
-                print(f"Status Code: {response.status_code}")
-                print(f"Response Body: {response.text}")
-                print(f"------------------------------------")
-                return False
-
-            print(f"Successfully added Base64 attachment to ticket ID: {ticket_id}")
-            return True
+            response = self.make_request('PUT', self.get_ticket_url(ticket_id), timeout=90, body=body)
+            return self.parse_upload_response(response, ticket_id)
         except requests.exceptions.RequestException as e:
             print(f"A network-level error occurred adding Base64 attachment: {e}")
             return False
     
-    def download_attachment(self, article_id, attachment_id):
-        """Downloads a specific attachment from Zammad"""
-        possible_urls = self.generate_attachment_urls(article_id, attachment_id)
-        file_content = self.attempt_attachment_download(possible_urls)
+    @timed_operation('download_attachment')
+    def download_attachment(self, article_id, attachment_id, max_bytes=None):
+        """Downloads a specific attachment from Zammad (AttachmentTooLargeError above `max_bytes`)"""
+        known_scheme = self.get_attachment_scheme()
+        if known_scheme:
+            _, file_content = self.attempt_attachment_download(
+                self.generate_attachment_urls(article_id, attachment_id, [known_scheme]), max_bytes
+            )
+            if file_content is not None:
+                return file_content
         
-        if file_content is None:
-            print(f"Error: Could not download attachment {attachment_id}")
+        # Unknown or no longer working: probe the other schemes
+        scheme, file_content = self.attempt_attachment_download(
+            self.generate_attachment_urls(article_id, attachment_id, self.get_fallback_schemes(known_scheme)), max_bytes
+        )
+        
+        if self.is_new_working_scheme(scheme, known_scheme, attachment_id, file_content):
+            self.set_attachment_scheme(scheme)
         
         return file_content
 
 
-class ZammadArticleManager(ZammadApiClient):
+class ZammadArticleRequests(ZammadApiBase):
+    """URLs and response handling of article operations"""
+    
+    def get_article_url(self, article_id):
+        return f"{self.zammad_url}api/v1/ticket_articles/{article_id}"
+    
+    def extract_attachments_from_article(self, article_data):
+        """Extract attachments list from article data"""
+        return article_data.get('attachments', [])
+
+
+class ZammadArticleManager(ZammadApiClient, ZammadArticleRequests):
     """Manages Zammad article operations"""
     
     def fetch_article_details(self, article_id):
         """Fetch article details from Zammad API"""
-        url = f"{self.zammad_url}api/v1/ticket_articles/{article_id}"
-        headers = {"Authorization": f"Token token={self.zammad_token}"}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = self.session.get(self.get_article_url(article_id), headers=self.get_auth_headers(), timeout=10)
         response.raise_for_status()
         return response.json()
     
-    def extract_attachments_from_article(self, article_data):
-        """Extract attachments list from article data"""
-        return article_data.get('attachments', [])
-    
+    @timed_operation('get_article_attachments')
     def get_article_attachments(self, article_id):
         """Fetches attachments for a specific article from Zammad"""
         try:
@@ -349,9 +694,22 @@ article_manager = ZammadArticleManager()
 
 
 # Backward compatibility functions
-def create_zammad_ticket(title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2):
+def create_zammad_ticket(title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2,
+                         attachments=None, tags=None):
     """Creates a new ticket in Zammad (backward compatibility)"""
-    return ticket_manager.create_ticket(title, body, group, customer_first_name, customer_last_name, priority)
+    return ticket_manager.create_ticket(
+        title, body, group, customer_first_name, customer_last_name, priority, attachments, tags
+    )
+
+
+def find_ticket_by_tag(tag):
+    """Finds the ticket carrying a tag"""
+    return ticket_manager.find_ticket_by_tag(tag)
+
+
+def prefetch_zammad_user(first_name, last_name):
+    """Starts resolving a customer's Zammad user in the background"""
+    ticket_manager.prefetch_zammad_user(first_name, last_name)
 
 
 def get_ticket_details(ticket_id):
@@ -359,6 +717,11 @@ def get_ticket_details(ticket_id):
     return ticket_manager.get_ticket_details(ticket_id)
 
 
+def search_ticket_states(ticket_ids):
+    """Fetches the states of many tickets at once"""
+    return ticket_manager.search_ticket_states(ticket_ids)
+
+
 def close_zammad_ticket(ticket_id, user_name):
     """Closes a ticket in Zammad (backward compatibility)"""
     return ticket_manager.close_ticket(ticket_id, user_name)
@@ -374,12 +737,17 @@ def add_attachment_to_ticket(ticket_id, user_name, file_content, filename, capti
     return attachment_manager.add_attachment_to_ticket(ticket_id, user_name, file_content, filename, caption)
 
 
+def add_attachment_stream_to_ticket(ticket_id, user_name, chunks, filename, caption=None):
+    """Adds an attachment streamed from an iterable of byte chunks"""
+    return attachment_manager.add_attachment_stream_to_ticket(ticket_id, user_name, chunks, filename, caption)
+
+
 def get_article_attachments(article_id):
     """Gets attachments for an article (backward compatibility)"""
     return article_manager.get_article_attachments(article_id)
 
 
-def download_attachment(article_id, attachment_id):
+def download_attachment(article_id, attachment_id, max_bytes=None):
     """Downloads an attachment (backward compatibility)"""
-    return attachment_manager.download_attachment(article_id, attachment_id)
+    return attachment_manager.download_attachment(article_id, attachment_id, max_bytes)
 
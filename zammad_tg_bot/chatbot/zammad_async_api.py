@@ -0,0 +1,471 @@
+import asyncio
+import base64
+import json
+import weakref
+
+import aiohttp
+
+from .zammad_api import AttachmentTooLargeError, ZammadApiBase, ZammadArticleRequests, ZammadAttachmentRequests, ZammadTicketRequests
+from .zammad_circuit import RETRY_STATUSES, ZammadUnavailableError, retries_counter, zammad_breaker, zammad_retry_policy
+from .zammad_metrics import current_operation, get_body_size, get_received_size, record_response, timed_operation
+from .zammad_rate_limit import ZammadRateLimitedError, zammad_rate_limiter
+
+
+class AsyncZammadHTTPError(aiohttp.ClientError):
+    """Zammad answered with an error status (raised by BufferedResponse.raise_for_status)"""
+
+
+# Exceptions the async managers treat as "request failed", like requests.exceptions.RequestException
+ASYNC_REQUEST_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ZammadRateLimitedError, ZammadUnavailableError)
+
+
+class BufferedResponse:
+    """Fully read aiohttp response exposing the parts of requests.Response the managers use"""
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AsyncZammadHTTPError(f"{self.status_code} Error for url: {self.url}")
+
+
+async def fetch(session, method, url, timeout, max_bytes=None, **kwargs):
+    """Send a request on an aiohttp session and read the whole response (at most `max_bytes` of it).
+
+    Like the sync session, idempotent requests are retried with backoff and
+    nothing is sent while the circuit breaker is open.
+    """
+    attempts = zammad_retry_policy.get_attempts(method)
+    sent_bytes = get_body_size(kwargs.get('data'))
+    attempt = 0
+    while True:
+        attempt += 1
+        zammad_breaker.before_request()
+        try:
+            response = await fetch_within_budget(session, method, url, timeout, max_bytes, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            record_response(None)
+            zammad_breaker.record_failure()
+            if attempt >= attempts:
+                raise
+        else:
+            record_response(response.status_code, sent_bytes, get_received_size(response))
+            if response.status_code not in RETRY_STATUSES:
+                zammad_breaker.record_success()
+                return response
+            zammad_breaker.record_failure()
+            if attempt >= attempts:
+                return response
+
+        retries_counter.inc(method=method, operation=current_operation())
+        await asyncio.sleep(zammad_retry_policy.get_delay(attempt))
+
+
+async def fetch_within_budget(session, method, url, timeout, max_bytes=None, **kwargs):
+    """Wait for the shared Zammad request budget, retrying 429 answers after their Retry-After"""
+    # A streamed (async generator) body is gone after the first try
+    replayable = not hasattr(kwargs.get('data'), '__aiter__')
+    attempt = 0
+    while True:
+        attempt += 1
+        await zammad_rate_limiter.aacquire()
+        response = await fetch_once(session, method, url, timeout, max_bytes, **kwargs)
+        if response.status_code != 429:
+            return response
+        if not await zammad_rate_limiter.ahandle_rate_limited(response.headers.get('Retry-After'), attempt, replayable):
+            return response
+
+
+async def fetch_once(session, method, url, timeout, max_bytes=None, **kwargs):
+    client_timeout = aiohttp.ClientTimeout(total=timeout, connect=zammad_retry_policy.connect_timeout or None)
+    async with session.request(method, url, timeout=client_timeout, **kwargs) as response:
+        if not max_bytes:
+            content = await response.read()
+            return BufferedResponse(response.status, response.headers, content, url)
+
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise AttachmentTooLargeError(f"Attachment is larger than {max_bytes} bytes")
+            chunks.append(chunk)
+        return BufferedResponse(response.status, response.headers, b"".join(chunks), url)
+
+
+async def iter_async(chunks):
+    """Feed a chunk generator (e.g. iter_attachment_payload) to aiohttp as a streamed body"""
+    for chunk in chunks:
+        yield chunk
+
+
+class AsyncZammadApiClient(ZammadApiBase):
+    """Async counterpart of ZammadApiClient built on aiohttp"""
+
+    # aiohttp sessions belong to the event loop that created them, so keep one pooled session per loop
+    _async_sessions = weakref.WeakKeyDictionary()
+
+    @property
+    def async_session(self):
+        """Shared pooled aiohttp session for the running event loop"""
+        loop = asyncio.get_running_loop()
+        session = AsyncZammadApiClient._async_sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+            AsyncZammadApiClient._async_sessions[loop] = session
+        return session
+
+    @classmethod
+    async def close_sessions(cls):
+        """Close the session of the running event loop (e.g. before the loop shuts down)"""
+        session = cls._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def make_request(self, method, url, payload=None, timeout=10, body=None):
+        """Make HTTP request to Zammad API without blocking the event loop (`body`: encoded JSON chunks, sync or async)"""
+        headers = self.get_headers()
+        if body is None:
+            data = json.dumps(payload)
+        else:
+            data = body if hasattr(body, '__aiter__') else iter_async(body)
+
+        if method.upper() == 'GET':
+            response = await fetch(self.async_session, 'GET', url, timeout, headers=headers)
+        elif method.upper() in ('POST', 'PUT'):
+            response = await fetch(self.async_session, method.upper(), url, timeout, headers=headers, data=data)
+        else:
+            raise ValueError(f"Unsupported HTTP method: {method}")
+
+        return response
+
+
+class AsyncZammadTicketManager(AsyncZammadApiClient, ZammadTicketRequests):
+    """Async version of ZammadTicketManager (same methods, URLs and payloads)"""
+
+    # Customer users being resolved ahead of ticket creation: event loop -> {email: Task}
+    _pending_users = weakref.WeakKeyDictionary()
+
+    def get_pending_users(self):
+        return AsyncZammadTicketManager._pending_users.setdefault(asyncio.get_running_loop(), {})
+
+    async def create_or_get_zammad_user(self, first_name, last_name):
+        """Create or get Zammad user based on customer name"""
+        email = self.build_customer_email(first_name, last_name)
+
+        user = await self.user_cache.aget(email)
+        if user:
+            return user
+
+        pending = self.get_pending_users().get(email)
+        if pending is not None:
+            try:
+                user = await asyncio.wait_for(asyncio.shield(pending), self.USER_PREFETCH_WAIT)
+            except Exception as e:
+                print(f"Background resolution of Zammad user {email} failed: {e}")
+            if user:
+                return user
+
+        return await self.resolve_and_store_user(first_name, last_name, email)
+
+    async def resolve_and_store_user(self, first_name, last_name, email):
+        user = await self.resolve_zammad_user(first_name, last_name, email)
+        if user:
+            await self.user_cache.astore(email, user)
+        return user
+
+    def prefetch_zammad_user(self, first_name, last_name):
+        """Start resolving a customer's Zammad user in a task of the running loop, ahead of create_ticket"""
+        email = self.build_customer_email(first_name, last_name)
+        pending_users = self.get_pending_users()
+        if email in pending_users:
+            return
+        task = asyncio.create_task(self.resolve_and_store_user(first_name, last_name, email))
+        pending_users[email] = task
+        task.add_done_callback(lambda _: pending_users.pop(email, None))
+
+    @timed_operation('resolve_user')
+    async def resolve_zammad_user(self, first_name, last_name, email):
+        """Find the Zammad user for an email in Zammad, creating it if needed"""
+        try:
+            response = await self.make_request('GET', self.get_user_search_url(email))
+            user = self.parse_user_search(response, email)
+            if user:
+                return user
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error searching for Zammad user: {e}")
+
+        user_data = self.build_user_payload(first_name, last_name, email)
+        try:
+            response = await self.make_request('POST', self.get_users_url(), user_data)
+            return self.parse_created_user(response, email)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error creating Zammad user: {e}")
+            if "422" in str(e):
+                return await self._fetch_user_by_email(email)
+            return None
+
+    async def _fetch_user_by_email(self, email):
+        """Fetch user by email when we know they exist"""
+        try:
+            search_url = f"{self.get_users_url()}?search={email}"
+            response = await self.make_request('GET', search_url)
+            return self.find_user_by_email(response.json(), email)
+        except Exception as e:
+            print(f"Error fetching user by email: {e}")
+        return None
+
+    @timed_operation('create_ticket')
+    async def create_ticket(self, title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2,
+                            attachments=None, tags=None):
+        """Creates a new ticket in Zammad with customer as the user"""
+        customer_email = None
+        if customer_first_name and customer_last_name:
+            zammad_user = await self.create_or_get_zammad_user(customer_first_name, customer_last_name)
+            if zammad_user:
+                customer_email = zammad_user['email']
+
+        payload = self.build_ticket_payload(title, body, group, customer_email, priority, attachments, tags)
+
+        try:
+            response = await self.make_request('POST', self.get_tickets_url(), payload)
+            return self.parse_created_ticket(response)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Failed to connect to Zammad for ticket creation: {e}")
+            if self.is_stale_customer_error(e, customer_email):
+                await self.user_cache.ainvalidate(customer_email)
+            return None
+
+    @timed_operation('get_ticket_details')
+    async def get_ticket_details(self, ticket_id):
+        """Fetches details for a single ticket from Zammad by its ID"""
+        try:
+            response = await self.make_request('GET', f"{self.get_ticket_url(ticket_id)}?expand=true")
+            return self.parse_ticket_details(response)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error fetching ticket details: {e}")
+            return None
+
+    @timed_operation('search_ticket_states')
+    async def search_ticket_states(self, ticket_ids):
+        """Fetches the states of many tickets with one search request (None if Zammad is unreachable)"""
+        try:
+            response = await self.make_request('GET', self.get_ticket_states_search_url(ticket_ids), timeout=30)
+            return self.parse_ticket_states(response)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error searching tickets: {e}")
+            return None
+
+    @timed_operation('find_ticket_by_tag')
+    async def find_ticket_by_tag(self, tag):
+        """Return the ticket carrying a tag, or None (raises one of ASYNC_REQUEST_ERRORS if Zammad can't be asked)"""
+        response = await self.make_request('GET', self.get_ticket_search_url(f"tags:{tag}", 1))
+        return self.parse_tag_search(response)
+
+    @timed_operation('close_ticket')
+    async def close_ticket(self, ticket_id, user_name):
+        """Updates a ticket in Zammad to set its state to 'closed'"""
+        payload = self.build_close_ticket_payload(user_name)
+
+        try:
+            response = await self.make_request('PUT', self.get_ticket_url(ticket_id), payload)
+            return self.parse_close_response(response, ticket_id)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error connecting to Zammad to close ticket: {e}")
+            return False
+
+    @timed_operation('add_note_to_ticket')
+    async def add_note_to_ticket(self, ticket_id, user_name, note_body):
+        """Adds a new text article (note) to an existing Zammad ticket"""
+        payload = self.build_note_payload(ticket_id, user_name, note_body)
+
+        try:
+            response = await self.make_request('POST', self.get_articles_url(), payload, timeout=15)
+            return self.parse_note_response(response, ticket_id)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error adding note to ticket: {e}")
+            return False
+
+
+class AsyncZammadAttachmentManager(AsyncZammadApiClient, ZammadAttachmentRequests):
+    """Async version of ZammadAttachmentManager (same methods, URLs and payloads)"""
+
+    async def try_download_from_url(self, url, max_bytes=None):
+        """Try to download attachment from a specific URL, reading at most `max_bytes`"""
+        response = await fetch(self.async_session, 'GET', url, 30, max_bytes=max_bytes, headers=self.get_auth_headers())
+        response.raise_for_status()
+        return response.content
+
+    async def attempt_attachment_download(self, possible_urls, max_bytes=None):
+        """Attempt to download attachment from multiple possible URLs, returns (scheme, content)"""
+        for scheme, url in possible_urls:
+            try:
+                return scheme, await self.try_download_from_url(url, max_bytes)
+            except (ZammadRateLimitedError, ZammadUnavailableError):
+                raise
+            except ASYNC_REQUEST_ERRORS:
+                continue
+        return None, None
+
+    async def get_attachment_scheme(self):
+        """The download URL scheme known to work for this Zammad, or None"""
+        scheme = ZammadAttachmentRequests._attachment_schemes.get(self.zammad_url)
+        if scheme is None:
+            from .models import ZammadInstance
+            instance = await ZammadInstance.objects.filter(zammad_url=self.zammad_url).afirst()
+            scheme = instance.attachment_url_scheme if instance else ''
+            ZammadAttachmentRequests._attachment_schemes[self.zammad_url] = scheme
+        return scheme or None
+
+    async def set_attachment_scheme(self, scheme):
+        """Remember (in process and in the database) which scheme works, '' to forget it"""
+        from .models import ZammadInstance
+        ZammadAttachmentRequests._attachment_schemes[self.zammad_url] = scheme
+        await ZammadInstance.objects.aupdate_or_create(
+            zammad_url=self.zammad_url, defaults={"attachment_url_scheme": scheme}
+        )
+
+    async def aiter_attachment_payload(self, user_name, filename, chunks, caption):
+        """iter_attachment_payload() for an async iterable of byte chunks (e.g. a streamed Telegram download)"""
+        prefix, suffix = self.split_attachment_payload(user_name, filename, caption)
+        yield prefix
+        remainder = b""
+        async for chunk in chunks:
+            encoded, remainder = self.encode_base64_chunk(remainder, chunk)
+            if encoded:
+                yield encoded
+        if remainder:
+            yield base64.b64encode(remainder)
+        yield suffix
+
+    async def add_attachment_to_ticket(self, ticket_id, user_name, file_content, filename, caption=None):
+        """Adds an attachment to a ticket with Base64 encoded file payload"""
+        return await self.add_attachment_stream_to_ticket(
+            ticket_id, user_name, self.iter_bytes_chunks(file_content), filename, caption
+        )
+
+    @timed_operation('add_attachment_to_ticket')
+    async def add_attachment_stream_to_ticket(self, ticket_id, user_name, chunks, filename, caption=None):
+        """Adds an attachment read from a sync or async iterable of byte chunks, encoded while it is sent"""
+        if hasattr(chunks, '__aiter__'):
+            body = self.aiter_attachment_payload(user_name, filename, chunks, caption)
+        else:
+            body = self.iter_attachment_payload(user_name, filename, chunks, caption)
+
+        try:
+            response = await self.make_request('PUT', self.get_ticket_url(ticket_id), timeout=90, body=body)
+            return self.parse_upload_response(response, ticket_id)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"A network-level error occurred adding Base64 attachment: {e}")
+            return False
+
+    @timed_operation('download_attachment')
+    async def download_attachment(self, article_id, attachment_id, max_bytes=None):
+        """Downloads a specific attachment from Zammad"""
+        known_scheme = await self.get_attachment_scheme()
+        if known_scheme:
+            _, file_content = await self.attempt_attachment_download(
+                self.generate_attachment_urls(article_id, attachment_id, [known_scheme]), max_bytes
+            )
+            if file_content is not None:
+                return file_content
+
+        scheme, file_content = await self.attempt_attachment_download(
+            self.generate_attachment_urls(article_id, attachment_id, self.get_fallback_schemes(known_scheme)), max_bytes
+        )
+
+        if self.is_new_working_scheme(scheme, known_scheme, attachment_id, file_content):
+            await self.set_attachment_scheme(scheme)
+
+        return file_content
+
+
+class AsyncZammadArticleManager(AsyncZammadApiClient, ZammadArticleRequests):
+    """Async version of ZammadArticleManager (same methods and URLs)"""
+
+    async def fetch_article_details(self, article_id):
+        """Fetch article details from Zammad API"""
+        response = await fetch(self.async_session, 'GET', self.get_article_url(article_id), 10, headers=self.get_auth_headers())
+        response.raise_for_status()
+        return response.json()
+
+    @timed_operation('get_article_attachments')
+    async def get_article_attachments(self, article_id):
+        """Fetches attachments for a specific article from Zammad"""
+        try:
+            article_data = await self.fetch_article_details(article_id)
+            return self.extract_attachments_from_article(article_data)
+        except ASYNC_REQUEST_ERRORS as e:
+            print(f"Error fetching article details: {e}")
+            return []
+
+
+# Global async instances, mirroring ticket_manager / attachment_manager / article_manager
+async_ticket_manager = AsyncZammadTicketManager()
+async_attachment_manager = AsyncZammadAttachmentManager()
+async_article_manager = AsyncZammadArticleManager()
+
+
+async def create_zammad_ticket(title, body, group="Users", customer_first_name=None, customer_last_name=None, priority=2,
+                               attachments=None, tags=None):
+    """Creates a new ticket in Zammad"""
+    return await async_ticket_manager.create_ticket(
+        title, body, group, customer_first_name, customer_last_name, priority, attachments, tags
+    )
+
+
+async def find_ticket_by_tag(tag):
+    """Finds the ticket carrying a tag"""
+    return await async_ticket_manager.find_ticket_by_tag(tag)
+
+
+async def get_ticket_details(ticket_id):
+    """Fetches details for a single ticket"""
+    return await async_ticket_manager.get_ticket_details(ticket_id)
+
+
+async def search_ticket_states(ticket_ids):
+    """Fetches the states of many tickets at once"""
+    return await async_ticket_manager.search_ticket_states(ticket_ids)
+
+
+async def close_zammad_ticket(ticket_id, user_name):
+    """Closes a ticket in Zammad"""
+    return await async_ticket_manager.close_ticket(ticket_id, user_name)
+
+
+async def add_note_to_ticket(ticket_id, user_name, note_body):
+    """Adds a note to a ticket"""
+    return await async_ticket_manager.add_note_to_ticket(ticket_id, user_name, note_body)
+
+
+async def add_attachment_to_ticket(ticket_id, user_name, file_content, filename, caption=None):
+    """Adds an attachment to a ticket"""
+    return await async_attachment_manager.add_attachment_to_ticket(ticket_id, user_name, file_content, filename, caption)
+
+
+async def add_attachment_stream_to_ticket(ticket_id, user_name, chunks, filename, caption=None):
+    """Adds an attachment streamed from an iterable (sync or async) of byte chunks"""
+    return await async_attachment_manager.add_attachment_stream_to_ticket(ticket_id, user_name, chunks, filename, caption)
+
+
+async def get_article_attachments(article_id):
+    """Gets attachments for an article"""
+    return await async_article_manager.get_article_attachments(article_id)
+
+
+async def download_attachment(article_id, attachment_id, max_bytes=None):
+    """Downloads an attachment"""
+    return await async_attachment_manager.download_attachment(article_id, attachment_id, max_bytes)
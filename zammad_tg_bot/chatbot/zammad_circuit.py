@@ -0,0 +1,162 @@
+"""Retries and a circuit breaker for Zammad requests.
+
+Idempotent requests (GET) that fail with a connection error, a timeout or
+a 502/503/504 are sent again after a jittered exponential backoff. After
+ZAMMAD_BREAKER_FAILURES failures in a row the breaker opens: requests fail
+at once with ZammadUnavailableError instead of waiting for timeouts, and
+every ZAMMAD_BREAKER_RESET seconds a single request is let through to see
+whether Zammad is back.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+
+from .metrics import registry
+from .zammad_metrics import CountingChunks, current_operation, get_body_size, get_received_size, record_response
+from .zammad_rate_limit import RateLimitedAdapter
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+RETRY_STATUSES = (502, 503, 504)
+
+breaker_open_gauge = registry.gauge(
+    'zammad_circuit_open', '1 while Zammad requests fail fast because Zammad is unhealthy'
+)
+short_circuited_counter = registry.counter(
+    'zammad_requests_short_circuited_total', 'Zammad requests refused by the open circuit breaker'
+)
+retries_counter = registry.counter(
+    'zammad_request_retries_total', 'Idempotent Zammad requests sent again after a failure, by operation'
+)
+
+
+class ZammadUnavailableError(requests.exceptions.ConnectionError):
+    """Zammad is considered down, the request was not sent"""
+
+
+class CircuitBreaker:
+    """Counts consecutive Zammad failures and refuses requests while Zammad looks down"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Whether requests are currently refused (no trial request due yet)"""
+        opened_at = self.opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.reset_timeout
+
+    def before_request(self):
+        """Raise ZammadUnavailableError unless the request may be sent"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let this one request through as a trial, the others keep failing fast
+                self.opened_at = time.monotonic()
+                return
+        short_circuited_counter.inc()
+        raise ZammadUnavailableError("Zammad is unavailable (circuit breaker open)")
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print("Zammad is reachable again, closing the circuit breaker")
+            self.failures = 0
+            self.opened_at = None
+        breaker_open_gauge.set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold:
+                return
+            if self.opened_at is None:
+                print(f"Zammad failed {self.failures} times in a row, failing fast for {self.reset_timeout}s")
+            self.opened_at = time.monotonic()
+        breaker_open_gauge.set(1)
+
+
+class RetryPolicy:
+    """How often and how late idempotent Zammad requests are retried"""
+
+    def __init__(self, retries=2, backoff=0.5, backoff_max=5.0, connect_timeout=3.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+
+    def get_attempts(self, method):
+        return 1 + self.retries if method.upper() in IDEMPOTENT_METHODS else 1
+
+    def get_delay(self, attempt):
+        """Seconds to wait after the `attempt`-th failure ("full jitter" exponential backoff)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+    def get_timeout(self, timeout):
+        """(connect, read) timeout, so an unreachable Zammad fails after connect_timeout"""
+        if timeout is None or isinstance(timeout, tuple) or not self.connect_timeout:
+            return timeout
+        return (min(self.connect_timeout, timeout), timeout)
+
+
+class ResilientAdapter(RateLimitedAdapter):
+    """RateLimitedAdapter that also retries idempotent requests and honours the circuit breaker"""
+
+    def __init__(self, rate_limiter, breaker, retry_policy, **kwargs):
+        self.breaker = breaker
+        self.retry_policy = retry_policy
+        super().__init__(rate_limiter, **kwargs)
+
+    def send(self, request, **kwargs):
+        kwargs['timeout'] = self.retry_policy.get_timeout(kwargs.get('timeout'))
+        attempts = self.retry_policy.get_attempts(request.method)
+        sent_bytes = get_body_size(request.body)
+        if sent_bytes is None:
+            # Streamed upload: count it while it goes out
+            request.body = counted_body = CountingChunks(request.body)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_request()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                record_response(None)
+                self.breaker.record_failure()
+                if attempt >= attempts:
+                    raise
+            else:
+                record_response(
+                    response.status_code,
+                    sent_bytes if sent_bytes is not None else counted_body.size,
+                    get_received_size(response, streamed=kwargs.get('stream', False)),
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt >= attempts:
+                    return response
+                response.close()
+
+            retries_counter.inc(method=request.method, operation=current_operation())
+            time.sleep(self.retry_policy.get_delay(attempt))
+
+
+zammad_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("ZAMMAD_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.getenv("ZAMMAD_BREAKER_RESET", "30")),
+)
+zammad_retry_policy = RetryPolicy(
+    retries=int(os.getenv("ZAMMAD_RETRIES", "2")),
+    backoff=float(os.getenv("ZAMMAD_RETRY_BACKOFF", "0.5")),
+    backoff_max=float(os.getenv("ZAMMAD_RETRY_BACKOFF_MAX", "5")),
+    connect_timeout=float(os.getenv("ZAMMAD_CONNECT_TIMEOUT", "3")),
+)
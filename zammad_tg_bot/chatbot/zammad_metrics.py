@@ -0,0 +1,102 @@
+"""Latency, status code and payload size metrics of Zammad API calls.
+
+Manager methods are wrapped with @timed_operation(name); the transport
+(the session adapter, or fetch() for the async client) labels every HTTP
+response it records with the operation that is running.
+"""
+import contextvars
+import functools
+import inspect
+import time
+
+from .metrics import registry
+
+
+PAYLOAD_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 8 * 1024 ** 2, 64 * 1024 ** 2)
+
+operation_histogram = registry.histogram(
+    'zammad_operation_seconds', 'Duration of Zammad API operations (all requests and retries of one call)'
+)
+responses_counter = registry.counter(
+    'zammad_responses_total', 'Zammad HTTP responses by operation and status code ("error" if none came)'
+)
+payload_histogram = registry.histogram(
+    'zammad_payload_bytes', 'Zammad request and response body sizes by operation and direction',
+    buckets=PAYLOAD_BUCKETS
+)
+
+_current_operation = contextvars.ContextVar('zammad_operation', default='other')
+
+
+def current_operation():
+    return _current_operation.get()
+
+
+def timed_operation(name):
+    """Time a Zammad manager method (sync or async) and label its requests with `name`"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _current_operation.set(name)
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    operation_histogram.observe(time.perf_counter() - started, operation=name)
+                    _current_operation.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_operation.set(name)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                operation_histogram.observe(time.perf_counter() - started, operation=name)
+                _current_operation.reset(token)
+        return wrapper
+    return decorator
+
+
+def get_body_size(body):
+    """Size of a request body known before sending (None for streamed bodies)"""
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return None
+
+
+class CountingChunks:
+    """Iterates a streamed request body, counting the bytes that went out"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
+
+
+def record_response(status, sent_bytes=None, received_bytes=None):
+    """Count one Zammad response (status None for a request that got no response)"""
+    operation = _current_operation.get()
+    responses_counter.inc(operation=operation, status=str(status) if status is not None else 'error')
+    if sent_bytes:
+        payload_histogram.observe(sent_bytes, operation=operation, direction='sent')
+    if received_bytes is not None:
+        payload_histogram.observe(received_bytes, operation=operation, direction='received')
+
+
+def get_received_size(response, streamed=False):
+    """Response body size, without reading a streamed body"""
+    content_length = response.headers.get('Content-Length')
+    if content_length and content_length.isdigit():
+        return int(content_length)
+    if streamed:
+        return None
+    return len(response.content or b'')
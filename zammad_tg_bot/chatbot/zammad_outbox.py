@@ -0,0 +1,244 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Min, Subquery
+from django.utils import timezone
+
+from . import zammad_api
+from .bot_registry import bot_registry
+from .metrics import registry
+from .models import PendingZammadWrite
+from .telegram_files import iter_telegram_file
+
+
+MAX_RETRY_DELAY = 3600
+MAX_NOTES_PER_ARTICLE = 50
+
+outbox_depth_gauge = registry.gauge(
+    'zammad_outbox_depth', 'Zammad writes waiting to be sent'
+)
+outbox_delivery_histogram = registry.histogram(
+    'zammad_outbox_delivery_seconds', 'Time between recording a Zammad write and Zammad accepting it'
+)
+outbox_attempts_counter = registry.counter(
+    'zammad_outbox_attempts_total', 'Zammad write attempts by action and result'
+)
+coalesced_notes_counter = registry.counter(
+    'zammad_notes_coalesced_total', 'Notes merged into an earlier note of the same burst'
+)
+
+
+def is_enabled():
+    """Whether handlers should record Zammad writes instead of sending them inline"""
+    return settings.ZAMMAD_WRITE_MODE == 'outbox'
+
+
+def enqueue_write(bot_record, zammad_ticket_id, action, user_name, **fields):
+    """Record a Zammad write for the flusher"""
+    return PendingZammadWrite.objects.create(
+        bot=bot_record, zammad_ticket_id=zammad_ticket_id, action=action, user_name=user_name or '', **fields
+    )
+
+
+def enqueue_note(bot_record, zammad_ticket_id, user_name, note_body):
+    """Record a note; it waits ZAMMAD_NOTE_COALESCE_SECONDS for more notes of the same burst"""
+    send_after = timezone.now() + timedelta(seconds=settings.ZAMMAD_NOTE_COALESCE_SECONDS)
+    return enqueue_write(bot_record, zammad_ticket_id, 'note', user_name, body=note_body, next_attempt_at=send_after)
+
+
+def get_burst_end(head):
+    """Notes recorded up to this time are merged into the article of the burst head note"""
+    return head.created_at + timedelta(seconds=settings.ZAMMAD_NOTE_COALESCE_SECONDS)
+
+
+def is_note_burst_open(zammad_ticket_id):
+    """Whether a new note will be merged into a note of the ticket that is still waiting to be sent.
+
+    Uses the same rule as claim_note_burst(): the ticket's oldest unsent
+    write is a waiting note, only notes follow it, and its window has not
+    ended yet.
+    """
+    if not settings.ZAMMAD_NOTE_COALESCE_SECONDS:
+        return False
+    unsent = list(
+        PendingZammadWrite.objects.filter(zammad_ticket_id=zammad_ticket_id, status__in=['pending', 'processing'])
+        .order_by('id').only('action', 'status', 'created_at')[:MAX_NOTES_PER_ARTICLE]
+    )
+    if not unsent or len(unsent) >= MAX_NOTES_PER_ARTICLE:
+        return False
+    head = unsent[0]
+    return (
+        head.status == 'pending' and timezone.now() <= get_burst_end(head)
+        and all(write.action == 'note' for write in unsent)
+    )
+
+
+def enqueue_attachment(bot_record, zammad_ticket_id, user_name, telegram_file_id, filename, caption=None):
+    """Record a Telegram file to attach; it is downloaded from Telegram when the write is sent"""
+    return enqueue_write(
+        bot_record, zammad_ticket_id, 'attachment', user_name,
+        telegram_file_id=telegram_file_id, filename=filename, body=caption or '',
+    )
+
+
+def enqueue_close(bot_record, zammad_ticket_id, user_name):
+    return enqueue_write(bot_record, zammad_ticket_id, 'close', user_name)
+
+
+def get_outbox_depth():
+    """Number of writes not yet accepted by Zammad (dead letters excluded)"""
+    depth = PendingZammadWrite.objects.filter(status__in=['pending', 'processing']).count()
+    outbox_depth_gauge.set(depth)
+    return depth
+
+
+def claim_due_writes(limit):
+    """Mark up to `limit` writes as processing and return them.
+
+    Only the oldest unsent write of each ticket can be claimed, and only once
+    its retry time has come, so a ticket's notes, attachments and close reach
+    Zammad in the order they were recorded even when some of them fail.
+    """
+    now = timezone.now()
+    # The head of a ticket is its oldest unsent write, whatever state the other tickets are in
+    head_ids = PendingZammadWrite.objects.filter(status__in=['pending', 'processing']).values(
+        'zammad_ticket_id'
+    ).annotate(head_id=Min('id')).values('head_id')
+    candidate_ids = list(
+        PendingZammadWrite.objects.filter(id__in=Subquery(head_ids), status='pending', next_attempt_at__lte=now)
+        .order_by('id').values_list('id', flat=True)[:limit]
+    )
+    claimed_ids = [
+        write_id for write_id in candidate_ids
+        if PendingZammadWrite.objects.filter(id=write_id, status='pending').update(status='processing', started_at=now)
+    ]
+    return list(PendingZammadWrite.objects.filter(id__in=claimed_ids).order_by('id'))
+
+
+def claim_note_burst(write):
+    """Claim the notes recorded right after `write` within the coalescing window.
+
+    Only consecutive notes are taken (an attachment or close in between ends
+    the burst), so the order of a ticket's writes is kept.
+    """
+    if not settings.ZAMMAD_NOTE_COALESCE_SECONDS or write.action != 'note':
+        return []
+
+    window_end = get_burst_end(write)
+    later_writes = PendingZammadWrite.objects.filter(
+        zammad_ticket_id=write.zammad_ticket_id, id__gt=write.id, status='pending'
+    ).order_by('id')[:MAX_NOTES_PER_ARTICLE - 1]
+
+    burst = []
+    for later in later_writes:
+        if later.action != 'note' or later.created_at > window_end:
+            break
+        if not PendingZammadWrite.objects.filter(id=later.id, status='pending').update(
+            status='processing', started_at=timezone.now()
+        ):
+            break
+        burst.append(later)
+    return burst
+
+
+def format_note_burst(notes):
+    """Join several notes into one article body, each line prefixed with its time"""
+    return "<br>".join(
+        f"[{timezone.localtime(note.created_at).strftime('%H:%M:%S')}] {note.body}" for note in notes
+    )
+
+
+def send_write(write, burst=()):
+    """Perform the Zammad call of a write (merged with its note burst), True if Zammad accepted it"""
+    if write.action == 'note':
+        body = format_note_burst([write, *burst]) if burst else write.body
+        return zammad_api.add_note_to_ticket(write.zammad_ticket_id, write.user_name, body)
+
+    if write.action == 'attachment':
+        bot = bot_registry.get_by_id(write.bot_id).bot
+        file_chunks = iter_telegram_file(bot, write.telegram_file_id)
+        return zammad_api.add_attachment_stream_to_ticket(
+            write.zammad_ticket_id, write.user_name, file_chunks, write.filename, write.body or None
+        )
+
+    if write.action == 'close':
+        return zammad_api.close_zammad_ticket(write.zammad_ticket_id, write.user_name)
+
+    raise ValueError(f"Unknown outbox action: {write.action}")
+
+
+def get_retry_delay(attempts, base_delay=None):
+    """Seconds to wait before the next attempt after `attempts` failures"""
+    base_delay = base_delay if base_delay is not None else settings.ZAMMAD_OUTBOX_RETRY_DELAY
+    return min(base_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def process_write(write, max_attempts=None):
+    """Send a claimed write and record the outcome (done, retry later or dead letter)"""
+    max_attempts = max_attempts or settings.ZAMMAD_OUTBOX_MAX_ATTEMPTS
+    write.attempts += 1
+    burst = claim_note_burst(write)
+    burst_ids = [note.id for note in burst]
+
+    try:
+        with zammad_api.request_priority('normal'):
+            success = send_write(write, burst)
+        error = '' if success else 'Zammad rejected the request (see log)'
+    except Exception as e:
+        success = False
+        error = str(e)
+
+    now = timezone.now()
+    if success:
+        write.status = 'done'
+        write.finished_at = now
+        for sent in [write, *burst]:
+            outbox_delivery_histogram.observe((now - sent.created_at).total_seconds())
+        if burst_ids:
+            PendingZammadWrite.objects.filter(id__in=burst_ids).update(status='done', finished_at=now, attempts=1)
+            coalesced_notes_counter.inc(len(burst_ids))
+    else:
+        if burst_ids:
+            # Merged again into the next attempt of this note
+            PendingZammadWrite.objects.filter(id__in=burst_ids).update(status='pending', started_at=None)
+
+        if write.attempts >= max_attempts:
+            write.status = 'dead'
+            write.finished_at = now
+            print(f"Giving up on {write.action} for Zammad ticket {write.zammad_ticket_id} "
+                  f"after {write.attempts} attempts: {error}")
+        else:
+            write.status = 'pending'
+            write.next_attempt_at = now + timedelta(seconds=get_retry_delay(write.attempts))
+
+    write.error = error
+    try:
+        write.save(update_fields=['status', 'attempts', 'next_attempt_at', 'finished_at', 'error'])
+    finally:
+        outbox_attempts_counter.inc(action=write.action, result='ok' if success else 'error')
+        close_old_connections()
+
+    return write
+
+
+def retry_dead_writes(queryset):
+    """Put dead letters back in the outbox with a fresh attempt budget"""
+    return queryset.filter(status='dead').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now(), finished_at=None
+    )
+
+
+def requeue_stale_writes(older_than_seconds):
+    """Return writes stuck in 'processing' (e.g. after a flusher crash) to the outbox"""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return PendingZammadWrite.objects.filter(status='processing', started_at__lt=cutoff).update(
+        status='pending', started_at=None
+    )
+
+
+def purge_sent_writes(older_than_seconds):
+    """Delete writes Zammad accepted longer ago than the retention period"""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    deleted, _ = PendingZammadWrite.objects.filter(status='done', finished_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,232 @@
+"""Request budget for Zammad shared by every thread (and, through a lock file, every process) of a node.
+
+Requests take a token from a token bucket refilled at ZAMMAD_RATE_LIMIT per
+second. Lower priority lanes leave part of the bucket to the higher ones, so
+when the budget runs short, ticket creation and user-visible notes still go
+out while background work (e.g. reconciliation) waits. A 429 from Zammad
+pauses all lanes for its Retry-After.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import registry
+from .shared_state import SharedState, get_private_state_dir
+
+
+# Share of the bucket each lane leaves untouched for the lanes above it
+LANE_RESERVE = {
+    'interactive': 0.0,  # ticket creation, user notes, agent replies (default)
+    'normal': 0.25,      # outbox deliveries
+    'background': 0.5,   # reconciliation and other bulk jobs
+}
+DEFAULT_RETRY_AFTER = 5
+
+rate_limited_counter = registry.counter(
+    'zammad_rate_limited_total', 'Zammad responses with status 429'
+)
+rate_limit_wait_histogram = registry.histogram(
+    'zammad_rate_limit_wait_seconds', 'Time requests waited for the Zammad request budget, by lane'
+)
+
+_current_lane = contextvars.ContextVar('zammad_request_lane', default='interactive')
+
+
+class ZammadRateLimitedError(requests.exceptions.RequestException):
+    """No request budget within ZAMMAD_RATE_MAX_WAIT seconds (handled like any failed request)"""
+
+
+@contextmanager
+def request_priority(lane):
+    """Send the Zammad requests made inside the block in `lane`"""
+    if lane not in LANE_RESERVE:
+        raise ValueError(f"Unknown Zammad request lane: {lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delay or HTTP date)"""
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimiter:
+    """Token bucket with priority lanes and a shared Retry-After pause.
+
+    The bucket state lives in `state_file` under an flock, so worker
+    processes on the same node share one budget; without a file (or
+    without fcntl) it is shared by the threads of this process only.
+    """
+
+    def __init__(self, rate=0.0, burst=None, state_file=None, max_wait=30, max_retries=2):
+        self.rate = rate
+        # Lanes leave part of the bucket to the ones above them, which takes room for at least two tokens
+        self.burst = max(2.0, burst or rate)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._shared = SharedState(state_file, self.new_state)
+        # Last pause read from the state file and the file version it came from (see get_blocked_until)
+        self._blocked_until = 0.0
+        self._seen_version = None
+
+    def new_state(self):
+        return {'tokens': self.burst, 'updated': time.time(), 'blocked_until': 0.0}
+
+    def locked_state(self):
+        """The bucket state, locked against other threads and processes for the block"""
+        return self._shared.locked()
+
+    def get_blocked_until(self):
+        """End of the shared 429 pause, without locking.
+
+        The file is only read again after it changed; a read that catches a
+        write half done keeps the last known value until the next call.
+        """
+        if not self._shared.is_shared:
+            with self.locked_state() as state:
+                return state['blocked_until']
+        try:
+            stat = os.stat(self._shared.path)
+        except FileNotFoundError:
+            return 0.0
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._seen_version:
+            try:
+                with open(self._shared.path) as state_file:
+                    self._blocked_until = json.loads(state_file.read())['blocked_until']
+                self._seen_version = version
+            except (OSError, ValueError, KeyError):
+                pass
+        return self._blocked_until
+
+    def try_acquire(self, lane):
+        """Take a token for `lane`: 0 if taken, otherwise seconds to wait before trying again"""
+        now = time.time()
+        if self.rate <= 0:
+            # No budget to spend, only a 429 pause can hold the request back
+            return max(0.0, self.get_blocked_until() - now)
+
+        with self.locked_state() as state:
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+
+            tokens = min(self.burst, state['tokens'] + max(0.0, now - state['updated']) * self.rate)
+            state['updated'] = now
+            needed = min(self.burst, 1 + LANE_RESERVE[lane] * self.burst)
+            if tokens >= needed:
+                state['tokens'] = tokens - 1
+                return 0
+            state['tokens'] = tokens
+            return (needed - tokens) / self.rate
+
+    def acquire(self, lane=None):
+        """Block until `lane` may send a request, ZammadRateLimitedError after max_wait seconds"""
+        lane = lane or _current_lane.get()
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(lane)
+            if not wait:
+                break
+            self.check_wait(lane, started, wait)
+            time.sleep(wait)
+        rate_limit_wait_histogram.observe(time.monotonic() - started, lane=lane)
+
+    async def aacquire(self, lane=None):
+        """acquire() without blocking the event loop"""
+        lane = lane or _current_lane.get()
+        started = time.monotonic()
+        while True:
+            if self.rate <= 0:
+                wait = self.try_acquire(lane)
+            else:
+                # The bucket is behind a thread lock and a file lock
+                wait = await asyncio.to_thread(self.try_acquire, lane)
+            if not wait:
+                break
+            self.check_wait(lane, started, wait)
+            await asyncio.sleep(wait)
+        rate_limit_wait_histogram.observe(time.monotonic() - started, lane=lane)
+
+    def check_wait(self, lane, started, wait):
+        if time.monotonic() - started + wait > self.max_wait:
+            raise ZammadRateLimitedError(
+                f"Zammad request budget exhausted ({lane} lane), next request possible in {wait:.1f}s"
+            )
+
+    def pause(self, seconds):
+        """Hold back every lane for `seconds` and start again with an empty bucket"""
+        with self.locked_state() as state:
+            state['blocked_until'] = max(state['blocked_until'], time.time() + seconds)
+            state['tokens'] = 0
+            state['updated'] = state['blocked_until']
+
+    def handle_rate_limited(self, retry_after, attempt, replayable=True):
+        """Record a 429 answer to the `attempt`-th try, returns whether to send the request again"""
+        seconds = parse_retry_after(retry_after)
+        rate_limited_counter.inc()
+        print(f"Zammad rate limit reached, pausing Zammad requests for {seconds:.0f}s")
+        self.pause(seconds)
+        return replayable and attempt <= self.max_retries
+
+    async def ahandle_rate_limited(self, retry_after, attempt, replayable=True):
+        """handle_rate_limited() with the locked state update run in a thread"""
+        return await asyncio.to_thread(self.handle_rate_limited, retry_after, attempt, replayable)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter that spends the shared request budget and retries 429 answers after Retry-After"""
+
+    def __init__(self, rate_limiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        # A streamed (generator) body is gone after the first try
+        replayable = request.body is None or isinstance(request.body, (bytes, str))
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire()
+            response = super().send(request, **kwargs)
+            if response.status_code != 429:
+                return response
+            if not self.rate_limiter.handle_rate_limited(response.headers.get('Retry-After'), attempt, replayable):
+                return response
+            response.close()
+
+
+def create_rate_limiter():
+    """Rate limiter configured from the ZAMMAD_RATE_* environment variables"""
+    state_file = os.getenv("ZAMMAD_RATE_LIMIT_FILE")
+    if state_file is None:
+        directory = get_private_state_dir()
+        state_file = os.path.join(directory, "zammad_rate_limit.json") if directory else ''
+    return RateLimiter(
+        rate=float(os.getenv("ZAMMAD_RATE_LIMIT", "0")),
+        burst=float(os.getenv("ZAMMAD_RATE_BURST", "0")) or None,
+        state_file=state_file or None,
+        max_wait=float(os.getenv("ZAMMAD_RATE_MAX_WAIT", "30")),
+        max_retries=int(os.getenv("ZAMMAD_RATE_LIMIT_RETRIES", "2")),
+    )
+
+
+zammad_rate_limiter = create_rate_limiter()
@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import registry
+from .models import ZammadCustomerUser
+
+
+user_lookups_counter = registry.counter(
+    'zammad_customer_user_lookups_total', 'Customer user lookups by where they were answered (memory, db, miss)'
+)
+
+
+class ZammadUserCache:
+    """Email -> Zammad user mapping for the generated customer users.
+
+    An in-memory LRU sits in front of the ZammadCustomerUser table, so only a
+    customer that was never resolved (or whose mapping was invalidated) costs
+    a users/search round-trip to Zammad. Cached users are returned as
+    {'id': ..., 'email': ...}, the fields create_ticket needs.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries if max_entries is not None else settings.ZAMMAD_USER_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, email, user_id):
+        user = {'id': user_id, 'email': email}
+        with self._lock:
+            self._entries[email] = user
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return user
+
+    def _get_cached(self, email):
+        with self._lock:
+            user = self._entries.get(email)
+            if user is not None:
+                self._entries.move_to_end(email)
+        return user
+
+    def get(self, email):
+        """Return the known Zammad user for an email, or None"""
+        user = self._get_cached(email)
+        if user is not None:
+            user_lookups_counter.inc(source='memory')
+            return user
+
+        mapping = ZammadCustomerUser.objects.filter(email=email).first()
+        if mapping is None:
+            user_lookups_counter.inc(source='miss')
+            return None
+        user_lookups_counter.inc(source='db')
+        return self._remember(email, mapping.zammad_user_id)
+
+    async def aget(self, email):
+        """Async version of get()"""
+        user = self._get_cached(email)
+        if user is not None:
+            user_lookups_counter.inc(source='memory')
+            return user
+
+        mapping = await ZammadCustomerUser.objects.filter(email=email).afirst()
+        if mapping is None:
+            user_lookups_counter.inc(source='miss')
+            return None
+        user_lookups_counter.inc(source='db')
+        return self._remember(email, mapping.zammad_user_id)
+
+    def store(self, email, user):
+        """Persist the Zammad user found or created for an email"""
+        ZammadCustomerUser.objects.update_or_create(email=email, defaults={'zammad_user_id': user['id']})
+        self._remember(email, user['id'])
+
+    async def astore(self, email, user):
+        """Async version of store()"""
+        await ZammadCustomerUser.objects.aupdate_or_create(email=email, defaults={'zammad_user_id': user['id']})
+        self._remember(email, user['id'])
+
+    def forget(self, email):
+        """Drop the in-memory entry only (used by the model signals)"""
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def invalidate(self, email):
+        """Forget the mapping so the next lookup asks Zammad again"""
+        ZammadCustomerUser.objects.filter(email=email).delete()
+        self.forget(email)
+
+    async def ainvalidate(self, email):
+        """Async version of invalidate()"""
+        await ZammadCustomerUser.objects.filter(email=email).adelete()
+        self.forget(email)
+
+    def clear(self):
+        """Forget all in-memory entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+zammad_user_cache = ZammadUserCache()
@@ -49,6 +49,114 @@ TELEGRAM_BOT_TOKENS = {
     'bot3': env('TELEGRAM_BOT_TOKEN_3', default=''),
 }
 
+TELEGRAM_API_URL = env('TELEGRAM_API_URL', default='https://api.telegram.org')
+
+# Serve the Telegram and Zammad webhooks with the async views (chatbot.async_views).
+# Use together with an ASGI server, e.g. `uvicorn zammad_tg_bot.asgi:application`.
+ASYNC_WEBHOOKS = env.bool('ASYNC_WEBHOOKS', default=False)
+
+# Telegram update processing
+# 'sync'  - process updates inside the webhook request
+# 'queue' - store updates and return immediately, `manage.py run_update_workers` processes them
+TELEGRAM_UPDATE_MODE = env('TELEGRAM_UPDATE_MODE', default='sync')
+UPDATE_WORKER_COUNT = env.int('UPDATE_WORKER_COUNT', default=4)
+# A queued update whose handler fails is tried this many times in all, UPDATE_RETRY_DELAY seconds after the
+# first failure (doubled after every further one); then it is kept as a failed dead letter
+UPDATE_MAX_ATTEMPTS = env.int('UPDATE_MAX_ATTEMPTS', default=3)
+UPDATE_RETRY_DELAY = env.int('UPDATE_RETRY_DELAY', default=5)
+
+# Seconds a process may serve cached bot configuration before re-reading it.
+# Edits in the admin invalidate the cache of the process that saved them at once.
+BOT_REGISTRY_TTL = env.int('BOT_REGISTRY_TTL', default=300)
+# HTTP connections kept open per telegram.Bot (shared between worker threads)
+TELEGRAM_CON_POOL_SIZE = env.int('TELEGRAM_CON_POOL_SIZE', default=8)
+
+# Outgoing messages are paced to stay within the Bot API limits (per bot, shared by all processes of
+# the node through a lock file in TELEGRAM_SEND_STATE_DIR, by default a private zammad_tg_bot-<uid> directory
+# in the temp directory):
+# messages per second for the whole bot, per private chat (with short bursts) and per minute in a group
+TELEGRAM_SEND_RATE = env.float('TELEGRAM_SEND_RATE', default=25)
+TELEGRAM_CHAT_SEND_RATE = env.float('TELEGRAM_CHAT_SEND_RATE', default=1)
+TELEGRAM_CHAT_SEND_BURST = env.int('TELEGRAM_CHAT_SEND_BURST', default=3)
+TELEGRAM_GROUP_SEND_PER_MINUTE = env.float('TELEGRAM_GROUP_SEND_PER_MINUTE', default=20)
+TELEGRAM_SEND_STATE_DIR = env('TELEGRAM_SEND_STATE_DIR', default='')
+# Longest a send may wait for its slot; a send that would wait longer fails instead of blocking the worker
+TELEGRAM_SEND_MAX_WAIT = env.float('TELEGRAM_SEND_MAX_WAIT', default=30)
+# Times a message rejected by Telegram flood control (429) is sent again after retry_after
+TELEGRAM_SEND_RETRIES = env.int('TELEGRAM_SEND_RETRIES', default=3)
+
+# Redelivered Telegram updates (same update_id) are dropped for this many seconds.
+# Telegram keeps undelivered updates for 24 hours. Set to 0 to disable deduplication.
+UPDATE_DEDUP_TTL = env.int('UPDATE_DEDUP_TTL', default=86400)
+UPDATE_DEDUP_MAX_PER_BOT = env.int('UPDATE_DEDUP_MAX_PER_BOT', default=10000)
+
+# How notes, attachments and ticket closes reach Zammad
+# 'inline' - inside the Telegram handler; a Zammad error is reported to the user
+# 'outbox' - stored and acknowledged at once, `manage.py flush_zammad_outbox` sends them
+ZAMMAD_WRITE_MODE = env('ZAMMAD_WRITE_MODE', default='inline')
+ZAMMAD_OUTBOX_WORKERS = env.int('ZAMMAD_OUTBOX_WORKERS', default=4)
+# A write that failed this many times is kept as a dead letter (retry it from the admin)
+ZAMMAD_OUTBOX_MAX_ATTEMPTS = env.int('ZAMMAD_OUTBOX_MAX_ATTEMPTS', default=10)
+# Seconds before the first retry, doubled after every failure (at most one hour)
+ZAMMAD_OUTBOX_RETRY_DELAY = env.int('ZAMMAD_OUTBOX_RETRY_DELAY', default=15)
+
+# Outbox mode only: notes sent within this many seconds of each other are merged into
+# one Zammad article and acknowledged once. 0 sends every note as its own article.
+ZAMMAD_NOTE_COALESCE_SECONDS = env.int('ZAMMAD_NOTE_COALESCE_SECONDS', default=0)
+
+# Agent attachments: downloads from Zammad running ahead of the upload to Telegram,
+# and the largest file forwarded (bigger ones are skipped; Telegram bots can send up to 50 MB)
+ATTACHMENT_DOWNLOAD_WORKERS = env.int('ATTACHMENT_DOWNLOAD_WORKERS', default=3)
+ATTACHMENT_MAX_BYTES = env.int('ATTACHMENT_MAX_BYTES', default=20 * 1024 * 1024)
+
+# Photo answers are downloaded in the background while the user answers the next questions
+# (0 workers disables it). The temp directory is shared by the workers of one server;
+# photos not picked up within the TTL are deleted. The directory and the photos are only readable
+# by the user the bot runs as, so every worker must run as that user.
+PHOTO_PREFETCH_WORKERS = env.int('PHOTO_PREFETCH_WORKERS', default=2)
+PHOTO_PREFETCH_DIR = env('PHOTO_PREFETCH_DIR', default='')
+PHOTO_PREFETCH_MAX_BYTES = env.int('PHOTO_PREFETCH_MAX_BYTES', default=64 * 1024 * 1024)
+PHOTO_PREFETCH_TTL = env.int('PHOTO_PREFETCH_TTL', default=900)
+# Photo answers sent inside the ticket creation request are held in memory and Base64-encoded,
+# so together they stay under this size; the others are streamed to the ticket afterwards
+TICKET_INLINE_ATTACHMENTS_MAX_BYTES = env.int('TICKET_INLINE_ATTACHMENTS_MAX_BYTES', default=8 * 1024 * 1024)
+
+# Seconds the Zammad state cached on an OpenTicket is trusted before asking Zammad again.
+# The Zammad webhook refreshes it on every ticket change.
+TICKET_STATE_TTL = env.int('TICKET_STATE_TTL', default=300)
+
+# Bearer token required by the Prometheus endpoint (/telegram/metrics/); empty disables the endpoint
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+# Directory where the web server and worker processes of the node leave their metrics, so a scrape of any worker
+# reports all of them (empty: a scrape reports the metrics of the worker that answers it); files are written every
+# METRICS_WRITE_INTERVAL seconds and dropped once they are three intervals old
+METRICS_DIR = env('METRICS_DIR', default='')
+METRICS_WRITE_INTERVAL = env.int('METRICS_WRITE_INTERVAL', default=15)
+
+# Customer emails -> Zammad user ids kept in memory (the full mapping lives in ZammadCustomerUser)
+ZAMMAD_USER_CACHE_SIZE = env.int('ZAMMAD_USER_CACHE_SIZE', default=1024)
+
+# Where the ticket wizard keeps each user's step: 'database' (shared by all workers and nodes)
+# or 'sqlite' (a local file, CONVERSATION_STATE_FILE, for a single node)
+CONVERSATION_STATE_BACKEND = env('CONVERSATION_STATE_BACKEND', default='database')
+CONVERSATION_STATE_FILE = env('CONVERSATION_STATE_FILE', default='')
+
+# Seconds a worker keeps its copy of the questions; the worker that saves a question reloads at once
+QUESTIONNAIRE_REFRESH = env.int('QUESTIONNAIRE_REFRESH', default=60)
+
+# Wizard tickets carry a "tg-<key>" tag so a failed or repeated creation finds the ticket instead of
+# creating another: keys are kept this many seconds, a creation left running is taken over after
+# TICKET_CREATION_CLAIM_TIMEOUT seconds.
+# The lookup uses the Zammad search index, so Zammad needs Elasticsearch and the ticket is only found once
+# it was indexed. A failed request is followed by lookups TICKET_LOOKUP_DELAY, 2x, 4x... seconds apart for up
+# to TICKET_LOOKUP_WAIT seconds; until TICKET_CREATION_GRACE seconds after it (longer than the indexing lag)
+# the ticket is only looked up, never created again.
+TICKET_IDEMPOTENCY_TTL = env.int('TICKET_IDEMPOTENCY_TTL', default=7 * 86400)
+TICKET_CREATION_CLAIM_TIMEOUT = env.int('TICKET_CREATION_CLAIM_TIMEOUT', default=120)
+TICKET_LOOKUP_DELAY = env.float('TICKET_LOOKUP_DELAY', default=1.0)
+TICKET_LOOKUP_WAIT = env.float('TICKET_LOOKUP_WAIT', default=7.0)
+TICKET_CREATION_GRACE = env.int('TICKET_CREATION_GRACE', default=300)
+
 
 # Application definition
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zammad_tg_bot.settings')
 
 application = get_wsgi_application()
+
+# Share this server's metrics with the node's other processes (METRICS_DIR)
+from chatbot.metrics import start_configured_snapshots  # noqa: E402
+
+start_configured_snapshots()